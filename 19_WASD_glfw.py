@@ -2,6 +2,7 @@ import pyrr
 import glfw
 from OpenGL.GL import *
 from libraries.Camera import Camera
+from libraries.Frame_Clock import FrameClock
 from libraries.OBJ_Loader import ObjLoader
 from libraries.Texture_Loader import load_texture
 from OpenGL.GL.shaders import compileProgram, compileShader
@@ -75,15 +76,17 @@ def key_input_clb(window, key, scancode, action, mode):
         left, right, forward, backward = False, False, False, False
 
 
-def do_movement():
+def do_movement(dt):
+    # speed * dt so it doesn't depend on the frame rate
+    velocity = cam.movement_speed * dt
     if left:
-        cam.process_keyboard("LEFT", 0.05)
+        cam.process_keyboard("LEFT", velocity)
     if right:
-        cam.process_keyboard("RIGHT", 0.05)
+        cam.process_keyboard("RIGHT", velocity)
     if forward:
-        cam.process_keyboard("FORWARD", 0.05)
+        cam.process_keyboard("FORWARD", velocity)
     if backward:
-        cam.process_keyboard("BACKWARD", 0.05)
+        cam.process_keyboard("BACKWARD", velocity)
 
 
 def mouse_look_clb(window, xpos, ypos):
@@ -127,6 +130,8 @@ glfw.set_cursor_pos_callback(window, mouse_look_clb)
 glfw.set_key_callback(window, key_input_clb)
 glfw.set_input_mode(window, glfw.CURSOR, glfw.CURSOR_DISABLED)
 glfw.make_context_current(window)
+# wait for vsync in the swap instead of drawing frames nobody sees
+glfw.swap_interval(1)
 
 # =============================================
 # Define Object, VBO, EBO, and VAO
@@ -215,15 +220,25 @@ view_loc = glGetUniformLocation(shader, "view")
 
 glUniformMatrix4fv(proj_loc, 1, GL_FALSE, projection)
 
+# Camera updates in fixed steps, the swap interval paces the frames
+frame_clock = FrameClock(fps_cap=None)
+previous = cam.state()
+
 # ==========================================
 # Loop until the user closes the window
 # ==========================================
 while not glfw.window_should_close(window):
+    # the mouse callback turns the camera in poll_events, right away and not in the update steps
+    jaw, pitch = cam.jaw, cam.pitch
     glfw.poll_events()
-    do_movement()
+    previous = cam.turned_state(previous, jaw, pitch)
+    for _ in range(frame_clock.steps()):
+        previous = cam.state()
+        do_movement(frame_clock.step)
     glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
 
-    view = cam.get_view_matrix()
+    # between the last two update steps so the motion is smooth at any frame rate
+    view = cam.interpolated_view_matrix(previous, frame_clock.alpha)
     glUniformMatrix4fv(view_loc, 1, GL_FALSE, view)
 
     # Rotation
@@ -1,14 +1,26 @@
 import os
+import argparse
 import pyrr
 import pygame
 import numpy as np
 from math import sin
 from OpenGL.GL import *
 from libraries.Camera import Camera
+from libraries.Frame_Clock import FrameClock
 from libraries.OBJ_Loader import ObjLoader
 from libraries.Texture_Loader import load_texture_pygame
+from libraries.Instance_Grid import grid_offsets, setup_grid_program, GRID_GLSL
 from OpenGL.GL.shaders import compileProgram, compileShader
 
+# --instances shader puts no data per cube in any buffer, so the grid can be far bigger, e.g. --grid 200
+parser = argparse.ArgumentParser(description='Kelompok 5 - Instancing')
+parser.add_argument('--instances', choices=('buffer', 'shader'), default='buffer',
+                    help='buffer: the cube offsets in an instance VBO, '
+                         'shader: offsets computed from gl_InstanceID')
+parser.add_argument('--grid', type=int, default=50,
+                    help='cubes per side of the grid')
+args = parser.parse_args()
+
 # ==========================================
 # Vertex and fragment shader
 # ==========================================
@@ -22,16 +34,21 @@ vertex_src = """
     uniform mat4 model;
     uniform mat4 projection;
     uniform mat4 view;
-
+%s
     out vec2 texture_out;
 
     void main()
     {
-        vec3 final_pos = position_in + offset_in;
+#ifdef GRID_FROM_INSTANCE_ID
+        vec3 offset = grid_offset(gl_InstanceID);
+#else
+        vec3 offset = offset_in;
+#endif
+        vec3 final_pos = position_in + offset;
         gl_Position = projection * view * model * vec4(final_pos, 1.0);
         texture_out = texture_in;
     }
-"""
+""" % GRID_GLSL
 fragment_src = """
     # version 330
 
@@ -72,25 +89,27 @@ def mouse_look(xpos, ypos):
     cam.process_mouse_movement(xoffset, yoffset)
 
 
-def key_press():
-    # WASD Movement
+def key_press(dt):
+    # WASD Movement, speed * dt so it doesn't depend on the frame rate
+    velocity = cam.movement_speed * dt
+    turn = cam.turn_speed * dt
     keys_pressed = pygame.key.get_pressed()
     if keys_pressed[pygame.K_a]:
-        cam.process_keyboard("LEFT", 0.05)
+        cam.process_keyboard("LEFT", velocity)
     if keys_pressed[pygame.K_d]:
-        cam.process_keyboard("RIGHT", 0.05)
+        cam.process_keyboard("RIGHT", velocity)
     if keys_pressed[pygame.K_w]:
-        cam.process_keyboard("FORWARD", 0.05)
+        cam.process_keyboard("FORWARD", velocity)
     if keys_pressed[pygame.K_s]:
-        cam.process_keyboard("BACKWARD", 0.05)
+        cam.process_keyboard("BACKWARD", velocity)
     if keys_pressed[pygame.K_z]:
-        cam.process_keyboard("UP", 0.05)
+        cam.process_keyboard("UP", velocity)
     if keys_pressed[pygame.K_x]:
-        cam.process_keyboard("DOWN", 0.05)
+        cam.process_keyboard("DOWN", velocity)
     if keys_pressed[pygame.K_q]:
-        cam.process_keyboard("YAWL", 0.05)
+        cam.process_keyboard("YAWL", turn)
     if keys_pressed[pygame.K_e]:
-        cam.process_keyboard("YAWR", 0.05)
+        cam.process_keyboard("YAWR", turn)
 
 
 # Window init
@@ -151,6 +170,8 @@ cube_indices = np.array(cube_indices, dtype=np.uint32)
 floor_indices, floor_buffer = ObjLoader.load_model('object/floor.obj')
 
 # Make Shader Program
+if args.instances == 'shader':
+    vertex_src = vertex_src.replace('# version 330', '# version 330\n    #define GRID_FROM_INSTANCE_ID', 1)
 shader = compileProgram(compileShader(vertex_src, GL_VERTEX_SHADER),
                         compileShader(fragment_src, GL_FRAGMENT_SHADER))
 
@@ -163,8 +184,8 @@ EBO = glGenBuffers(1)
 glBindVertexArray(VAO)
 glBindBuffer(GL_ARRAY_BUFFER, VBO)
 glBufferData(GL_ARRAY_BUFFER, cube_buffer.nbytes, cube_buffer, GL_STATIC_DRAW)
-glBindBuffer(GL_ARRAY_BUFFER, EBO)
-glBufferData(GL_ARRAY_BUFFER, cube_indices.nbytes,
+glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, EBO)
+glBufferData(GL_ELEMENT_ARRAY_BUFFER, cube_indices.nbytes,
              cube_indices, GL_STATIC_DRAW)
 
 # Define Vertex and Texture Shader
@@ -179,32 +200,20 @@ glVertexAttribPointer(1, 2, GL_FLOAT, GL_FALSE,
 texture = glGenTextures(1)
 load_texture_pygame('textures/stone.png', texture)
 
-# instance VBO
-instance_array = []
-offset = 1
-
-for z in range(0, 100, 2):
-    for y in range(0, 100, 2):
-        for x in range(0, 100, 2):
-            translation = pyrr.Vector3([0.0, 0.0, 0.0])
-            translation.x = x + offset
-            translation.y = y + offset
-            translation.z = z + offset
-            instance_array.append(translation)
-
-# do this before you flatten the array
-len_of_instance_array = len(instance_array)
-instance_array = np.array(instance_array, np.float32).flatten()
-
-instanceVBO = glGenBuffers(1)
-glBindBuffer(GL_ARRAY_BUFFER, instanceVBO)
-glBufferData(GL_ARRAY_BUFFER, instance_array.nbytes,
-             instance_array, GL_STATIC_DRAW)
-
-glEnableVertexAttribArray(2)
-glVertexAttribPointer(2, 3, GL_FLOAT, GL_FALSE, 0, ctypes.c_void_p(0))
-# 1 means, every instance will have it's own translate
-glVertexAttribDivisor(2, 1)
+# instance VBO, a grid of cubes 2 apart, not needed when the shader computes them
+len_of_instance_array = args.grid ** 3
+if args.instances == 'buffer':
+    instance_array = grid_offsets(args.grid)
+
+    instanceVBO = glGenBuffers(1)
+    glBindBuffer(GL_ARRAY_BUFFER, instanceVBO)
+    glBufferData(GL_ARRAY_BUFFER, instance_array.nbytes,
+                 instance_array, GL_STATIC_DRAW)
+
+    glEnableVertexAttribArray(2)
+    glVertexAttribPointer(2, 3, GL_FLOAT, GL_FALSE, 0, ctypes.c_void_p(0))
+    # 1 means, every instance will have it's own translate
+    glVertexAttribDivisor(2, 1)
 
 # Using program shader
 glUseProgram(shader)
@@ -223,9 +232,15 @@ view_loc = glGetUniformLocation(shader, "view")
 
 glUniformMatrix4fv(proj_loc, 1, GL_FALSE, projection)
 glUniformMatrix4fv(model_loc, 1, GL_FALSE, cube_pos)
+if args.instances == 'shader':
+    setup_grid_program(shader, args.grid)
 
 running = True
 
+# Camera updates in fixed steps, at most 60 frames per second
+frame_clock = FrameClock(fps_cap=60)
+previous = cam.state()
+
 # ==========================================
 # Loop until the user closes the window
 # ==========================================
@@ -240,23 +255,27 @@ while running:
                 45, event.w/event.h, 0.1, 100)
             glUniformMatrix4fv(proj_loc, 1, GL_FALSE, projection)
 
-    # Movement key
-    key_press()
+    # Movement key, in the fixed steps of the frame clock
     mouse_pos = pygame.mouse.get_pos()
+    jaw, pitch = cam.jaw, cam.pitch
     mouse_look(mouse_pos[0], mouse_pos[1])
+    previous = cam.turned_state(previous, jaw, pitch)
+    for _ in range(frame_clock.steps()):
+        previous = cam.state()
+        key_press(frame_clock.step)
 
-    # 360° Look Around
-    if mouse_pos[0] <= 0:
-        cam.process_keyboard("YAWL", 0.05)
-    elif mouse_pos[0] >= WIDTH-1:
-        cam.process_keyboard("YAWR", 0.05)
+        # 360° Look Around
+        if mouse_pos[0] <= 0:
+            cam.process_keyboard("YAWL", cam.turn_speed * frame_clock.step)
+        elif mouse_pos[0] >= WIDTH-1:
+            cam.process_keyboard("YAWR", cam.turn_speed * frame_clock.step)
 
     # Counter
     counter = pygame.time.get_ticks() / 1000
     glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
 
-    # View Matrix
-    view = cam.get_view_matrix()
+    # View Matrix, between the last two update steps so the motion is smooth at any frame rate
+    view = cam.interpolated_view_matrix(previous, frame_clock.alpha)
     glUniformMatrix4fv(view_loc, 1, GL_FALSE, view)
 
     # Draw Cube
@@ -264,5 +283,6 @@ while running:
         cube_indices), GL_UNSIGNED_INT, None, len_of_instance_array)
 
     pygame.display.flip()
+    frame_clock.wait()
 
 pygame.quit()
@@ -1,11 +1,26 @@
+import argparse
 import glfw
 from OpenGL.GL import *
 from OpenGL.GL.shaders import compileProgram, compileShader
 import pyrr
 from libraries.Texture_Loader import load_texture
+from libraries.Stream_Buffer import StreamBuffer
+from libraries.Instance_Grid import grid_offsets, setup_grid_program, GRID_GLSL
 import numpy as np
 
 from libraries.Camera import Camera
+from libraries.Frame_Clock import FrameClock
+
+# uniform: static offsets and one move matrix for the whole grid, ring: every cube also waves, the offsets
+# are written by the CPU every frame (a stress test of the ring buffer), shader: the vertex shader computes them
+parser = argparse.ArgumentParser(description='Instancing with animated cubes')
+parser.add_argument('--instances', choices=('uniform', 'ring', 'shader'), default='uniform',
+                    help='uniform: static offsets moved by one matrix, '
+                         'ring: waving offsets written to a ring buffer every frame, '
+                         'shader: waving offsets computed from gl_InstanceID and the time')
+parser.add_argument('--grid', type=int, default=38,
+                    help='cubes per side of the grid')
+args = parser.parse_args()
 
 cam = Camera()
 WIDTH, HEIGHT = 1280, 720
@@ -38,16 +53,18 @@ def key_input_clb(window, key, scancode, action, mode):
         right = False
 
 
-# do the movement, call this function in the main loop
-def do_movement():
+# do the movement, call this function in the fixed steps of the main loop
+def do_movement(dt):
+    # speed * dt so it doesn't depend on the frame rate
+    velocity = cam.movement_speed * dt
     if left:
-        cam.process_keyboard("LEFT", 0.05)
+        cam.process_keyboard("LEFT", velocity)
     if right:
-        cam.process_keyboard("RIGHT", 0.05)
+        cam.process_keyboard("RIGHT", velocity)
     if forward:
-        cam.process_keyboard("FORWARD", 0.05)
+        cam.process_keyboard("FORWARD", velocity)
     if backward:
-        cam.process_keyboard("BACKWARD", 0.05)
+        cam.process_keyboard("BACKWARD", velocity)
 
 
 # the mouse position callback function
@@ -79,16 +96,24 @@ uniform mat4 model;
 uniform mat4 projection;
 uniform mat4 view;
 uniform mat4 move;
-
+uniform float time;
+%s
 out vec2 v_texture;
 
 void main()
 {
-    vec3 final_pos = a_position + a_offset;
+#ifdef GRID_FROM_INSTANCE_ID
+    vec3 offset = grid_offset(gl_InstanceID);
+    offset.y += grid_wave(offset, time);
+    offset.z += time * 8.0;
+#else
+    vec3 offset = a_offset;
+#endif
+    vec3 final_pos = a_position + offset;
     gl_Position =  projection * view * move * model * vec4(final_pos, 1.0f);
     v_texture = a_texture;
 }
-"""
+""" % GRID_GLSL
 
 fragment_src = """
 # version 330
@@ -184,6 +209,8 @@ cube_indices = [0,  1,  2,  2,  3,  0,
 
 cube_indices = np.array(cube_indices, dtype=np.uint32)
 
+if args.instances == 'shader':
+    vertex_src = vertex_src.replace('# version 330', '# version 330\n#define GRID_FROM_INSTANCE_ID', 1)
 shader = compileProgram(compileShader(
     vertex_src, GL_VERTEX_SHADER), compileShader(fragment_src, GL_FRAGMENT_SHADER))
 
@@ -214,32 +241,29 @@ glVertexAttribPointer(1, 2, GL_FLOAT, GL_FALSE,
 textures = glGenTextures(1)
 load_texture("textures/wood.jpeg", textures)
 
-# instance VBO
-instance_array = []
-offset = 1
-
-for z in range(0, 75, 2):
-    for y in range(0, 75, 2):
-        for x in range(0, 75, 2):
-            translation = pyrr.Vector3([0.0, 0.0, 0.0])
-            translation.x = x + offset
-            translation.y = y + offset
-            translation.z = z + offset
-            instance_array.append(translation)
-
-# do this before you flatten the array
-len_of_instance_array = len(instance_array)
-instance_array = np.array(instance_array, np.float32).flatten()
-
-instanceVBO = glGenBuffers(1)
-glBindBuffer(GL_ARRAY_BUFFER, instanceVBO)
-glBufferData(GL_ARRAY_BUFFER, instance_array.nbytes,
-             instance_array, GL_STATIC_DRAW)
-
-glEnableVertexAttribArray(2)
-glVertexAttribPointer(2, 3, GL_FLOAT, GL_FALSE, 0, ctypes.c_void_p(0))
-# 1 means, every instance will have it's own translate
-glVertexAttribDivisor(2, 1)
+# instance VBO, a grid of cubes 2 apart
+len_of_instance_array = args.grid ** 3
+instance_ring = None
+if args.instances == 'uniform':
+    # static instance VBO, the move matrix takes the whole grid towards the camera
+    instance_array = grid_offsets(args.grid)
+    instanceVBO = glGenBuffers(1)
+    glBindBuffer(GL_ARRAY_BUFFER, instanceVBO)
+    glBufferData(GL_ARRAY_BUFFER, instance_array.nbytes, instance_array, GL_STATIC_DRAW)
+elif args.instances == 'ring':
+    instance_array = grid_offsets(args.grid)
+    # every cube bobs up and down a little after the one next to it, like grid_wave()
+    wave_phase = (instance_array[:, 0] + instance_array[:, 2]) * 0.2
+
+    # instance VBO as a ring buffer, the animated offsets are written into it every frame
+    # while the GPU may still be drawing the last frames from the other regions
+    instance_ring = StreamBuffer(GL_ARRAY_BUFFER, (len_of_instance_array, 3))
+
+if args.instances != 'shader':
+    glEnableVertexAttribArray(2)
+    glVertexAttribPointer(2, 3, GL_FLOAT, GL_FALSE, 0, ctypes.c_void_p(0))
+    # 1 means, every instance will have it's own translate
+    glVertexAttribDivisor(2, 1)
 
 glUseProgram(shader)
 glClearColor(0, 0.1, 0.1, 1)
@@ -256,27 +280,55 @@ model_loc = glGetUniformLocation(shader, "model")
 proj_loc = glGetUniformLocation(shader, "projection")
 view_loc = glGetUniformLocation(shader, "view")
 move_loc = glGetUniformLocation(shader, "move")
+time_loc = glGetUniformLocation(shader, "time")
 
 glUniformMatrix4fv(proj_loc, 1, GL_FALSE, projection)
 glUniformMatrix4fv(model_loc, 1, GL_FALSE, cube_pos)
+# the ring and the shader move every cube themselves
+glUniformMatrix4fv(move_loc, 1, GL_FALSE, pyrr.matrix44.create_identity())
+if args.instances == 'shader':
+    setup_grid_program(shader, args.grid)
 
+# camera updates in fixed steps, the swap interval paces the frames
+frame_clock = FrameClock(fps_cap=None)
+previous = cam.state()
 
 # the main application loop
 while not glfw.window_should_close(window):
+    # the mouse callback turns the camera in poll_events, right away and not in the update steps
+    jaw, pitch = cam.jaw, cam.pitch
     glfw.poll_events()
-    # do_movement()
+    previous = cam.turned_state(previous, jaw, pitch)
+    for _ in range(frame_clock.steps()):
+        previous = cam.state()
+        do_movement(frame_clock.step)
 
     glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
 
-    move = pyrr.matrix44.create_from_translation(
-        pyrr.Vector3([0, 0, glfw.get_time()*8]))
-    glUniformMatrix4fv(move_loc, 1, GL_FALSE, move)
-
-    view = cam.get_view_matrix()
+    # the grid moves towards the camera, with one matrix or each cube with its own wave, written straight
+    # into the ring or left to the vertex shader
+    time = glfw.get_time()
+    glUniform1f(time_loc, time)
+    if args.instances == 'uniform':
+        move = pyrr.matrix44.create_from_translation(pyrr.Vector3([0, 0, time * 8]))
+        glUniformMatrix4fv(move_loc, 1, GL_FALSE, move)
+    if instance_ring:
+        offsets = instance_ring.begin()
+        np.copyto(offsets, instance_array)
+        offsets[:, 1] += np.sin(wave_phase + time * 2)
+        offsets[:, 2] += time * 8
+        instance_ring.commit()
+        glBindBuffer(GL_ARRAY_BUFFER, instance_ring.buffer)
+        glVertexAttribPointer(2, 3, GL_FLOAT, GL_FALSE, 0, ctypes.c_void_p(instance_ring.offset))
+
+    view = cam.interpolated_view_matrix(previous, frame_clock.alpha)
     glUniformMatrix4fv(view_loc, 1, GL_FALSE, view)
 
     glDrawElementsInstanced(GL_TRIANGLES, len(
         cube_indices), GL_UNSIGNED_INT, None, len_of_instance_array)
+    # the GPU is done with this region once it gets past here
+    if instance_ring:
+        instance_ring.end()
 
     glfw.swap_buffers(window)
 
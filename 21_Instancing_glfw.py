@@ -1,13 +1,25 @@
+import argparse
 import pyrr
 import glfw
 import numpy as np
 from math import sin
 from OpenGL.GL import *
 from libraries.Camera import Camera
+from libraries.Frame_Clock import FrameClock
 from libraries.OBJ_Loader import ObjLoader
 from libraries.Texture_Loader import load_texture
+from libraries.Instance_Grid import grid_offsets, setup_grid_program, GRID_GLSL
 from OpenGL.GL.shaders import compileProgram, compileShader
 
+# --instances shader puts no data per cube in any buffer, so the grid can be far bigger, e.g. --grid 200
+parser = argparse.ArgumentParser(description='Instancing (glfw)')
+parser.add_argument('--instances', choices=('buffer', 'shader'), default='buffer',
+                    help='buffer: the cube offsets in an instance VBO, '
+                         'shader: offsets computed from gl_InstanceID')
+parser.add_argument('--grid', type=int, default=38,
+                    help='cubes per side of the grid')
+args = parser.parse_args()
+
 # ==========================================
 # Vertex and fragment shader
 # ==========================================
@@ -21,16 +33,21 @@ vertex_src = """
     uniform mat4 model;
     uniform mat4 projection;
     uniform mat4 view;
-
+%s
     out vec2 texture_out;
 
     void main()
     {
-        vec3 final_pos = position_in + offset_in;
+#ifdef GRID_FROM_INSTANCE_ID
+        vec3 offset = grid_offset(gl_InstanceID);
+#else
+        vec3 offset = offset_in;
+#endif
+        vec3 final_pos = position_in + offset;
         gl_Position = projection * view * model * vec4(final_pos, 1.0);
         texture_out = texture_in;
     }
-"""
+""" % GRID_GLSL
 fragment_src = """
     # version 330
 
@@ -51,6 +68,7 @@ cam = Camera()
 WIDTH, HEIGHT = 640, 480
 lastX, lastY = WIDTH / 2, HEIGHT / 2
 first_mouse = True
+left, right, forward, backward = False, False, False, False
 
 
 def mouse_look_clb(window, xpos, ypos):
@@ -93,15 +111,17 @@ def key_input_clb(window, key, scancode, action, mode):
         right = False
 
 
-def do_movement():
+def do_movement(dt):
+    # speed * dt so it doesn't depend on the frame rate
+    velocity = cam.movement_speed * dt
     if left:
-        cam.process_keyboard("LEFT", 0.05)
+        cam.process_keyboard("LEFT", velocity)
     if right:
-        cam.process_keyboard("RIGHT", 0.05)
+        cam.process_keyboard("RIGHT", velocity)
     if forward:
-        cam.process_keyboard("FORWARD", 0.05)
+        cam.process_keyboard("FORWARD", velocity)
     if backward:
-        cam.process_keyboard("BACKWARD", 0.05)
+        cam.process_keyboard("BACKWARD", velocity)
 
 
 def window_resize_clb(window, width, height):
@@ -186,6 +206,8 @@ cube_buffer = np.array(cube_buffer, dtype=np.float32)
 cube_indices = np.array(cube_indices, dtype=np.uint32)
 
 # Make Shader Program
+if args.instances == 'shader':
+    vertex_src = vertex_src.replace('# version 330', '# version 330\n    #define GRID_FROM_INSTANCE_ID', 1)
 shader = compileProgram(compileShader(vertex_src, GL_VERTEX_SHADER),
                         compileShader(fragment_src, GL_FRAGMENT_SHADER))
 
@@ -197,8 +219,8 @@ EBO = glGenBuffers(1)
 glBindVertexArray(VAO)
 glBindBuffer(GL_ARRAY_BUFFER, VBO)
 glBufferData(GL_ARRAY_BUFFER, cube_buffer.nbytes, cube_buffer, GL_STATIC_DRAW)
-glBindBuffer(GL_ARRAY_BUFFER, EBO)
-glBufferData(GL_ARRAY_BUFFER, cube_indices.nbytes,
+glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, EBO)
+glBufferData(GL_ELEMENT_ARRAY_BUFFER, cube_indices.nbytes,
              cube_indices, GL_STATIC_DRAW)
 
 # Define Vertex and Texture Shader
@@ -213,31 +235,20 @@ glVertexAttribPointer(1, 2, GL_FLOAT, GL_FALSE,
 texture = glGenTextures(1)
 load_texture('textures/stone.png', texture)
 
-instance_array = []
-offset = 1
+# instance VBO, a grid of cubes 2 apart, not needed when the shader computes them
+len_of_instance_array = args.grid ** 3
+if args.instances == 'buffer':
+    instance_array = grid_offsets(args.grid)
 
-for z in range(0, 75, 2):
-    for y in range(0, 75, 2):
-        for x in range(0, 75, 2):
-            translation = pyrr.Vector3([0.0, 0.0, 0.0])
-            translation.x = x + offset
-            translation.y = y + offset
-            translation.z = z + offset
-            instance_array.append(translation)
+    instanceVBO = glGenBuffers(1)
+    glBindBuffer(GL_ARRAY_BUFFER, instanceVBO)
+    glBufferData(GL_ARRAY_BUFFER, instance_array.nbytes,
+                 instance_array, GL_STATIC_DRAW)
 
-# do this before you flatten the array
-len_of_instance_array = len(instance_array)
-instance_array = np.array(instance_array, np.float32).flatten()
-
-instanceVBO = glGenBuffers(1)
-glBindBuffer(GL_ARRAY_BUFFER, instanceVBO)
-glBufferData(GL_ARRAY_BUFFER, instance_array.nbytes,
-             instance_array, GL_STATIC_DRAW)
-
-glEnableVertexAttribArray(2)
-glVertexAttribPointer(2, 3, GL_FLOAT, GL_FALSE, 0, ctypes.c_void_p(0))
-# 1 means, every instance will have it's own translate
-glVertexAttribDivisor(2, 1)
+    glEnableVertexAttribArray(2)
+    glVertexAttribPointer(2, 3, GL_FLOAT, GL_FALSE, 0, ctypes.c_void_p(0))
+    # 1 means, every instance will have it's own translate
+    glVertexAttribDivisor(2, 1)
 
 # Using program shader
 glUseProgram(shader)
@@ -256,18 +267,29 @@ view_loc = glGetUniformLocation(shader, "view")
 
 glUniformMatrix4fv(proj_loc, 1, GL_FALSE, projection)
 glUniformMatrix4fv(model_loc, 1, GL_FALSE, cube_pos)
+if args.instances == 'shader':
+    setup_grid_program(shader, args.grid)
+
+# Camera updates in fixed steps, the swap interval paces the frames
+frame_clock = FrameClock(fps_cap=None)
+previous = cam.state()
 
 # ==========================================
 # Loop until the user closes the window
 # ==========================================
 while not glfw.window_should_close(window):
+    # the mouse callback turns the camera in poll_events, right away and not in the update steps
+    jaw, pitch = cam.jaw, cam.pitch
     glfw.poll_events()
-    # do_movement()
+    previous = cam.turned_state(previous, jaw, pitch)
+    for _ in range(frame_clock.steps()):
+        previous = cam.state()
+        do_movement(frame_clock.step)
 
     glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
 
     # View Matrix
-    view = cam.get_view_matrix()
+    view = cam.interpolated_view_matrix(previous, frame_clock.alpha)
     glUniformMatrix4fv(view_loc, 1, GL_FALSE, view)
 
     # Draw Cube
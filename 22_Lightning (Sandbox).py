@@ -4,6 +4,7 @@ import pygame
 import numpy as np
 from OpenGL.GL import *
 from libraries.Camera import Camera
+from libraries.Frame_Clock import FrameClock
 from libraries.OBJ_Loader import ObjLoader
 from libraries.Texture_Loader import load_texture_pygame
 from OpenGL.GL.shaders import compileProgram, compileShader
@@ -49,6 +50,7 @@ fragment_src = """
 
 # Camera settings
 cam = Camera()
+cam.movement_speed = 15.0  # units per second
 WIDTH, HEIGHT = 640, 480
 lastX, lastY = WIDTH / 2, HEIGHT / 2
 first_mouse = True
@@ -72,25 +74,27 @@ def mouse_look(xpos, ypos):
     cam.process_mouse_movement(xoffset, yoffset)
 
 
-def key_press():
-    # WASD Movement
+def key_press(dt):
+    # WASD Movement, speed * dt so it doesn't depend on the frame rate
+    velocity = cam.movement_speed * dt
+    turn = cam.turn_speed * dt
     keys_pressed = pygame.key.get_pressed()
     if keys_pressed[pygame.K_a]:
-        cam.process_keyboard("LEFT", 0.25)
+        cam.process_keyboard("LEFT", velocity)
     if keys_pressed[pygame.K_d]:
-        cam.process_keyboard("RIGHT", 0.25)
+        cam.process_keyboard("RIGHT", velocity)
     if keys_pressed[pygame.K_w]:
-        cam.process_keyboard("FORWARD", 0.25)
+        cam.process_keyboard("FORWARD", velocity)
     if keys_pressed[pygame.K_s]:
-        cam.process_keyboard("BACKWARD", 0.25)
+        cam.process_keyboard("BACKWARD", velocity)
     if keys_pressed[pygame.K_z]:
-        cam.process_keyboard("UP", 0.25)
+        cam.process_keyboard("UP", velocity)
     if keys_pressed[pygame.K_x]:
-        cam.process_keyboard("DOWN", 0.25)
+        cam.process_keyboard("DOWN", velocity)
     if keys_pressed[pygame.K_q]:
-        cam.process_keyboard("YAWL", 0.25)
+        cam.process_keyboard("YAWL", turn)
     if keys_pressed[pygame.K_e]:
-        cam.process_keyboard("YAWR", 0.25)
+        cam.process_keyboard("YAWR", turn)
 
 
 # Window init
@@ -338,6 +342,10 @@ glUniformMatrix4fv(proj_loc, 1, GL_FALSE, projection)
 
 running = True
 
+# Camera updates in fixed steps, at most 60 frames per second
+frame_clock = FrameClock(fps_cap=60)
+previous = cam.state()
+
 # ==========================================
 # Loop until the user closes the window
 # ==========================================
@@ -354,19 +362,23 @@ while running:
 
     glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
 
-    # Movement key
-    key_press()
+    # Movement key, in the fixed steps of the frame clock
     mouse_pos = pygame.mouse.get_pos()
+    jaw, pitch = cam.jaw, cam.pitch
     mouse_look(mouse_pos[0], mouse_pos[1])
-
-    # 360° Look Around
-    if mouse_pos[0] <= 0:
-        cam.process_keyboard("YAWL", 0.25)
-    elif mouse_pos[0] >= WIDTH-1:
-        cam.process_keyboard("YAWR", 0.25)
-
-    # View Matrix
-    view = cam.get_view_matrix()
+    previous = cam.turned_state(previous, jaw, pitch)
+    for _ in range(frame_clock.steps()):
+        previous = cam.state()
+        key_press(frame_clock.step)
+
+        # 360° Look Around
+        if mouse_pos[0] <= 0:
+            cam.process_keyboard("YAWL", cam.turn_speed * frame_clock.step)
+        elif mouse_pos[0] >= WIDTH-1:
+            cam.process_keyboard("YAWR", cam.turn_speed * frame_clock.step)
+
+    # View Matrix, between the last two update steps so the motion is smooth at any frame rate
+    view = cam.interpolated_view_matrix(previous, frame_clock.alpha)
     glUniformMatrix4fv(view_loc, 1, GL_FALSE, view)
 
     # Draw Sushi ✨
@@ -586,5 +598,6 @@ while running:
     glDrawArrays(GL_TRIANGLES, 0, len(wallBack_indices))
 
     pygame.display.flip()
+    frame_clock.wait()
 
 pygame.quit()
@@ -4,6 +4,9 @@ import pygame
 import numpy as np
 from OpenGL.GL import *
 from libraries.Camera import Camera
+from libraries.Clustered_Lighting import ClusteredLights, LIGHTING_GLSL
+from libraries.Camera_Uniforms import CameraUniforms, CAMERA_GLSL
+from libraries.Frame_Clock import FrameClock
 from libraries.OBJ_Loader import ObjLoader
 from libraries.Texture_Loader import load_texture_pygame
 from OpenGL.GL.shaders import compileProgram, compileShader
@@ -20,25 +23,30 @@ vertex_src = """
     layout(location = 3) in vec3 color_in;
     
     uniform mat4 model;
-    uniform mat4 projection;
-    uniform mat4 view;
-    
+%s
 
     out vec2 texture_out;
     out vec3 color_out;
+    out vec3 view_position;
+    out vec3 view_normal;
 
     void main()
     {
-        gl_Position = projection * view * model * (vec4(position_in, 1.0));
+        vec4 position = view * model * vec4(position_in, 1.0);
+        gl_Position = projection * position;
         texture_out = texture_in;
         color_out = color_in;
+        view_position = position.xyz;
+        view_normal = mat3(view * model) * normal_in;
     }
-"""
+""" % CAMERA_GLSL
 fragment_src = """
     # version 330
 
     in vec2 texture_out;
     in vec3 color_out;
+    in vec3 view_position;
+    in vec3 view_normal;
 
     uniform sampler2D texture_sampler;
     uniform int switcher;
@@ -46,20 +54,22 @@ fragment_src = """
     uniform vec3 lightColor;
 
     out vec4 color;
-
+%s
     void main()
     {
         if(switcher == 0){
             color = texture(texture_sampler, texture_out);
+            color.rgb = cluster_lighting(view_position, view_normal, color.rgb);
         }
         else{
             color = vec4(lightColor * objectColor, 1.0);
         }
     }
-"""
+""" % LIGHTING_GLSL
 
 # Camera settings
 cam = Camera()
+cam.movement_speed = 15.0  # units per second
 WIDTH, HEIGHT = 640, 480
 lastX, lastY = WIDTH / 2, HEIGHT / 2
 first_mouse = True
@@ -83,25 +93,27 @@ def mouse_look(xpos, ypos):
     cam.process_mouse_movement(xoffset, yoffset)
 
 
-def key_press():
-    # WASD Movement
+def key_press(dt):
+    # WASD Movement, speed * dt so it doesn't depend on the frame rate
+    velocity = cam.movement_speed * dt
+    turn = cam.turn_speed * dt
     keys_pressed = pygame.key.get_pressed()
     if keys_pressed[pygame.K_a]:
-        cam.process_keyboard("LEFT", 0.25)
+        cam.process_keyboard("LEFT", velocity)
     if keys_pressed[pygame.K_d]:
-        cam.process_keyboard("RIGHT", 0.25)
+        cam.process_keyboard("RIGHT", velocity)
     if keys_pressed[pygame.K_w]:
-        cam.process_keyboard("FORWARD", 0.25)
+        cam.process_keyboard("FORWARD", velocity)
     if keys_pressed[pygame.K_s]:
-        cam.process_keyboard("BACKWARD", 0.25)
+        cam.process_keyboard("BACKWARD", velocity)
     if keys_pressed[pygame.K_z]:
-        cam.process_keyboard("UP", 0.25)
+        cam.process_keyboard("UP", velocity)
     if keys_pressed[pygame.K_x]:
-        cam.process_keyboard("DOWN", 0.25)
+        cam.process_keyboard("DOWN", velocity)
     if keys_pressed[pygame.K_q]:
-        cam.process_keyboard("YAWL", 0.25)
+        cam.process_keyboard("YAWL", turn)
     if keys_pressed[pygame.K_e]:
-        cam.process_keyboard("YAWR", 0.25)
+        cam.process_keyboard("YAWR", turn)
 
 
 # Window init
@@ -158,9 +170,9 @@ cube_indices = np.array(cube_indices, dtype=np.uint32)
 sushi_indices, sushi_buffer = ObjLoader.load_model('object/sushi.obj')
 floor_indices, floor_buffer = ObjLoader.load_model('object/floor.obj')
 
-# Make Shader Program
+# Make Shader Program, not validated yet, the light samplers get their own units with setup_program()
 shader = compileProgram(compileShader(vertex_src, GL_VERTEX_SHADER),
-                        compileShader(fragment_src, GL_FRAGMENT_SHADER))
+                        compileShader(fragment_src, GL_FRAGMENT_SHADER), validate=False)
 
 VAO = glGenVertexArrays(3)
 VBO = glGenBuffers(3)
@@ -231,20 +243,37 @@ projection = pyrr.matrix44.create_perspective_projection(
 sushilb_pos = pyrr.matrix44.create_from_translation(
     pyrr.Vector3([0, 2, 0]))
 floor_pos = pyrr.matrix44.create_from_translation(pyrr.Vector3([0, 0, 0]))
-cube = pyrr.matrix44.create_from_translation(pyrr.Vector3([0, 10, 0]))
+
+# Ring of colored point lights going around the sushi, each one also drawn as a small cube
+LIGHT_COUNT = 32
+light_angles = np.linspace(0, 2 * np.pi, LIGHT_COUNT, endpoint=False)
+light_hues = np.stack([np.cos(light_angles + offset) for offset in (0, 2 * np.pi / 3, 4 * np.pi / 3)], axis=1)
+lights = ClusteredLights(np.zeros((LIGHT_COUNT, 3)), 0.6 + 0.6 * light_hues, np.full(LIGHT_COUNT, 6.0),
+                         ambient=(0.2, 0.2, 0.2))
+lights.set_projection(45, WIDTH/HEIGHT, 0.1, 100, WIDTH, HEIGHT)
+lights.bind()
+lights.setup_program(shader)
+light_cube_scale = pyrr.matrix44.create_from_scale(pyrr.Vector3([0.3, 0.3, 0.3]))
 
 glEnable(GL_LIGHTING)
 
 
 model_loc = glGetUniformLocation(shader, "model")
-proj_loc = glGetUniformLocation(shader, "projection")
-view_loc = glGetUniformLocation(shader, "view")
 switcher_loc = glGetUniformLocation(shader, "switcher")
+object_color_loc = glGetUniformLocation(shader, "objectColor")
+light_color_loc = glGetUniformLocation(shader, "lightColor")
 
-glUniformMatrix4fv(proj_loc, 1, GL_FALSE, projection)
+# Camera matrices come from the uniform buffer, filled once per frame
+camera_uniforms = CameraUniforms()
+camera_uniforms.setup_program(shader)
 
 running = True
 
+# Camera updates in fixed steps, at most 60 frames per second
+frame_clock = FrameClock(fps_cap=60)
+start_time = frame_clock.last
+previous = cam.state()
+
 # ==========================================
 # Loop until the user closes the window
 # ==========================================
@@ -257,25 +286,37 @@ while running:
             glViewport(0, 0, event.w, event.h)
             projection = pyrr.matrix44.create_perspective_projection(
                 45, event.w/event.h, 0.1, 100)
-            glUniformMatrix4fv(proj_loc, 1, GL_FALSE, projection)
+            lights.set_projection(45, event.w/event.h, 0.1, 100, event.w, event.h)
+            lights.setup_program(shader)
 
     glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
     glUniform1i(switcher_loc, 0)
 
-    # Movement key
-    key_press()
+    # Movement key, in the fixed steps of the frame clock
     mouse_pos = pygame.mouse.get_pos()
+    jaw, pitch = cam.jaw, cam.pitch
     mouse_look(mouse_pos[0], mouse_pos[1])
-
-    # 360° Look Around
-    if mouse_pos[0] <= 0:
-        cam.process_keyboard("YAWL", 0.25)
-    elif mouse_pos[0] >= WIDTH-1:
-        cam.process_keyboard("YAWR", 0.25)
-
-    # View Matrix
-    view = cam.get_view_matrix()
-    glUniformMatrix4fv(view_loc, 1, GL_FALSE, view)
+    previous = cam.turned_state(previous, jaw, pitch)
+    for _ in range(frame_clock.steps()):
+        previous = cam.state()
+        key_press(frame_clock.step)
+
+        # 360° Look Around
+        if mouse_pos[0] <= 0:
+            cam.process_keyboard("YAWL", cam.turn_speed * frame_clock.step)
+        elif mouse_pos[0] >= WIDTH-1:
+            cam.process_keyboard("YAWR", cam.turn_speed * frame_clock.step)
+
+    # View Matrix, between the last two update steps so the motion is smooth at any frame rate
+    view = cam.interpolated_view_matrix(previous, frame_clock.alpha)
+    seconds = frame_clock.last - start_time  # since the start, so every run begins with the same lights
+    camera_uniforms.update(view, projection, cam.camera_pos, seconds)
+
+    # Lights turn slowly around the sushi and go to their clusters for this view
+    light_turn = light_angles + seconds * 0.5
+    lights.positions[:] = np.column_stack((8 * np.cos(light_turn), np.full(LIGHT_COUNT, 1.5),
+                                           8 * np.sin(light_turn)))
+    lights.update(view)
 
     # Draw Sushi ✨
     glBindVertexArray(VAO[0])
@@ -289,12 +330,17 @@ while running:
     glUniformMatrix4fv(model_loc, 1, GL_FALSE, floor_pos)
     glDrawArrays(GL_TRIANGLES, 0, len(floor_indices))
 
-    # Draw Cube🟫
+    # Draw Light Cubes🟫 in the color of their light
     glBindVertexArray(VAO[2])
     glUniform1i(switcher_loc, 1)
-    glUniformMatrix4fv(model_loc, 1, GL_FALSE, cube)
-    glDrawElements(GL_TRIANGLES, len(cube_indices), GL_UNSIGNED_INT, None)
+    glUniform3f(object_color_loc, 1, 1, 1)
+    for position, light_color in zip(lights.positions, np.minimum(lights.colors, 1)):
+        cube = pyrr.matrix44.multiply(light_cube_scale, pyrr.matrix44.create_from_translation(position))
+        glUniform3f(light_color_loc, *light_color)
+        glUniformMatrix4fv(model_loc, 1, GL_FALSE, cube)
+        glDrawElements(GL_TRIANGLES, len(cube_indices), GL_UNSIGNED_INT, None)
 
     pygame.display.flip()
+    frame_clock.wait()
 
 pygame.quit()
@@ -1,10 +1,79 @@
 import os
+import time
+import functools
+import argparse
+from libraries import Headless, GL_Mode, Mesh_LOD
+
+# No arguments opens the window, --headless renders a camera path offscreen and writes the frames
+parser = argparse.ArgumentParser(description='Kelompok 5 - Restaurant')
+parser.add_argument('--scene', default='scenes/restaurant.json',
+                    help='scene description to load')
+parser.add_argument('--headless', choices=Headless.BACKENDS,
+                    help='render offscreen with EGL or OSMesa instead of a window')
+parser.add_argument('--camera-path', default='scenes/restaurant_camera.json',
+                    help='camera keyframes for the headless mode')
+parser.add_argument('--frames', type=int, default=120,
+                    help='number of headless frames')
+parser.add_argument('--output', default='frames',
+                    help='folder for the headless frames, empty to not save them')
+parser.add_argument('--profile', nargs='?', const='profile.csv',
+                    help='count and time the GL calls of every frame, written to this CSV file')
+parser.add_argument('--gpu-timer', action='store_true',
+                    help='also measure the GPU time of every frame with GL_TIME_ELAPSED queries')
+parser.add_argument('--stream', action='store_true',
+                    help='show the first frame at once and stream the models and textures in around the camera')
+parser.add_argument('--stream-distance', type=float, default=60,
+                    help='models and textures closer than this are loaded, the far ones can be evicted')
+parser.add_argument('--vram-budget', type=float, default=256,
+                    help='MB of streamed models and textures kept in GL before the least recently used go')
+parser.add_argument('--ram-budget', type=float, default=512,
+                    help='MB of loaded model and texture data kept in memory for a quick reupload')
+parser.add_argument('--lod-levels', type=int, default=len(Mesh_LOD.LOD_CELLS) + 1,
+                    choices=range(1, len(Mesh_LOD.LOD_CELLS) + 2),
+                    help='detail levels per model (the model and up to 3 simplified ones), 1 draws full detail')
+parser.add_argument('--draw-path', choices=('pool', 'batches'), default='pool',
+                    help='pool: all models in one buffer, drawn with one multi draw per texture, '
+                         'batches: a VAO and an instanced draw per mesh, texture and LOD')
+parser.add_argument('--texture-size', type=int, default=1024,
+                    help='put every texture in one texture array with layers of this size, '
+                         '0 keeps a texture each (one bind per texture)')
+parser.add_argument('--lighting', choices=('clustered', 'off'), default='clustered',
+                    help='light the scene with its point lights (clustered forward shading) or show plain textures')
+parser.add_argument('--occlusion', choices=('cpu', 'gpu', 'off'), default='cpu',
+                    help='hide the objects behind walls and tables, their depth rasterized with NumPy (cpu) '
+                         'or drawn by GL and read back (gpu)')
+parser.add_argument('--fps-cap', type=float, default=60,
+                    help='frames per second at most in the window, the rest of the frame time is slept, 0 for no cap')
+parser.add_argument('--vsync', action='store_true',
+                    help='wait for the vertical sync in the swap')
+parser.add_argument('--gl-mode', choices=GL_Mode.MODES, default='debug',
+                    help='release turns off the PyOpenGL error checking, logging and array size checks')
+parser.add_argument('--error-on-copy', action='store_true',
+                    help='in release mode, fail on every array PyOpenGL would have to convert')
+args = parser.parse_args()
+# must happen before OpenGL.GL is imported
+if args.headless:
+    Headless.setup_platform(args.headless)
+GL_Mode.setup_mode(args.gl_mode, args.error_on_copy)
+
 import pyrr
+import numpy as np
 import pygame
 from OpenGL.GL import *
 from libraries.Camera import Camera
-from libraries.OBJ_Loader import ObjLoader
-from libraries.Texture_Loader import load_texture_pygame
+from libraries.Frame_Clock import FrameClock
+from libraries.Scene_Loader import SceneLoader
+from libraries.Render_Queue import RenderQueue
+from libraries import Culling
+from libraries import Render_Queue, Geometry_Pool, Camera_Uniforms
+from libraries.Geometry_Pool import GeometryPool
+from libraries.Texture_Array import TextureArray
+from libraries.GL_Profiler import GLProfiler
+from libraries.Asset_Manager import AssetManager, nearest_distance, MB
+from libraries.Mesh_LOD import select_lods
+from libraries.Clustered_Lighting import ClusteredLights, LIGHTING_GLSL
+from libraries.Camera_Uniforms import CameraUniforms, CAMERA_GLSL
+from libraries.Occlusion_Culling import OcclusionCuller, world_triangles
 from OpenGL.GL.shaders import compileProgram, compileShader
 
 # ==========================================
@@ -16,38 +85,64 @@ vertex_src = """
     layout(location = 0) in vec3 position_in;
     layout(location = 1) in vec2 texture_in;
     layout(location = 2) in vec3 normal_in;
-    
-    uniform mat4 model;
-    uniform mat4 projection;
-    uniform mat4 view;
-    uniform mat4 scale;
-    uniform mat4 rotate;
+    // per instance model, scale and rotation composed on the CPU, a mat4 takes 4 attribute locations
+    layout(location = 3) in mat4 model;
+    // per instance texture array layer
+    layout(location = 7) in float layer_in;
 
+    // view, projection and view_projection of the camera uniform buffer, shared by every program
+%s
     out vec2 texture_out;
+    flat out float layer_out;
+    out vec3 view_position;
+    out vec3 view_normal;
 
     void main()
     {
-        gl_Position = projection * view * model * (vec4(position_in, 1.0) * scale * rotate);
+        gl_Position = view_projection * model * vec4(position_in, 1.0);
         texture_out = texture_in;
+        layer_out = layer_in;
+        // the scales are uniform, so the normal can go through the same matrix
+        view_position = (view * model * vec4(position_in, 1.0)).xyz;
+        view_normal = mat3(view * model) * normal_in;
     }
-"""
+""" % CAMERA_GLSL
 fragment_src = """
     # version 330
 
     in vec2 texture_out;
-    
+    flat in float layer_out;
+    in vec3 view_position;
+    in vec3 view_normal;
+
+#ifdef CLUSTERED_LIGHTING
+    // cluster_lighting() from Clustered_Lighting
+#endif
+
+#ifdef TEXTURE_ARRAY
+    uniform sampler2DArray texture_sampler;
+#else
     uniform sampler2D texture_sampler;
+#endif
 
     out vec4 color;
 
     void main()
     {
+#ifdef TEXTURE_ARRAY
+        color = texture(texture_sampler, vec3(texture_out, layer_out));
+#else
         color = texture(texture_sampler, texture_out);
+#endif
+#ifdef CLUSTERED_LIGHTING
+        color.rgb = cluster_lighting(view_position, view_normal, color.rgb);
+#endif
     }
 """
 
 # Camera settings
 cam = Camera()
+cam.movement_speed = 15.0  # units per second
 WIDTH, HEIGHT = 640, 480
 lastX, lastY = WIDTH / 2, HEIGHT / 2
 first_mouse = True
@@ -71,248 +166,388 @@ def mouse_look(xpos, ypos):
     cam.process_mouse_movement(xoffset, yoffset)
 
 
-def key_press():
-    # WASD Movement
+def key_press(dt):
+    # WASD Movement, speed * dt so it doesn't depend on the frame rate
+    velocity = cam.movement_speed * dt
+    turn = cam.turn_speed * dt
     keys_pressed = pygame.key.get_pressed()
     if keys_pressed[pygame.K_a]:
-        cam.process_keyboard("LEFT", 0.25)
+        cam.process_keyboard("LEFT", velocity)
     if keys_pressed[pygame.K_d]:
-        cam.process_keyboard("RIGHT", 0.25)
+        cam.process_keyboard("RIGHT", velocity)
     if keys_pressed[pygame.K_w]:
-        cam.process_keyboard("FORWARD", 0.25)
+        cam.process_keyboard("FORWARD", velocity)
     if keys_pressed[pygame.K_s]:
-        cam.process_keyboard("BACKWARD", 0.25)
+        cam.process_keyboard("BACKWARD", velocity)
     if keys_pressed[pygame.K_z]:
-        cam.process_keyboard("UP", 0.25)
+        cam.process_keyboard("UP", velocity)
     if keys_pressed[pygame.K_x]:
-        cam.process_keyboard("DOWN", 0.25)
+        cam.process_keyboard("DOWN", velocity)
     if keys_pressed[pygame.K_q]:
-        cam.process_keyboard("YAWL", 0.25)
+        cam.process_keyboard("YAWL", turn)
     if keys_pressed[pygame.K_e]:
-        cam.process_keyboard("YAWR", 0.25)
+        cam.process_keyboard("YAWR", turn)
 
 
-# Window init
-os.environ['SDL_VIDEO_WINDOW_POS'] = '200, 100'
-pygame.init()
-pygame.display.set_mode((WIDTH, HEIGHT), pygame.OPENGL |
-                        pygame.DOUBLEBUF | pygame.RESIZABLE)
-pygame.display.set_caption('Kelompok 5 - Restaurant')
-pygame.mouse.set_visible(False)
-pygame.event.set_grab(True)
+# Window init, or an offscreen context with its own framebuffer
+if args.headless:
+    context = Headless.HeadlessContext(WIDTH, HEIGHT, args.headless)
+else:
+    os.environ['SDL_VIDEO_WINDOW_POS'] = '200, 100'
+    pygame.init()
+    pygame.display.set_mode((WIDTH, HEIGHT), pygame.OPENGL |
+                            pygame.DOUBLEBUF | pygame.RESIZABLE, vsync=int(args.vsync))
+    pygame.display.set_caption('Kelompok 5 - Restaurant')
+    pygame.mouse.set_visible(False)
+    pygame.event.set_grab(True)
 
 
 # =============================================
 # Define Object, Shader, VBO, EBO, and VAO
 # =============================================
 
-# Define Object
-sushi_indices, sushi_buffer = ObjLoader.load_model('object/sushi.obj')
-plate_indices, plate_buffer = ObjLoader.load_model('object/plate.obj')
-table_indices, table_buffer = ObjLoader.load_model('object/table.obj')
-pot_indices, pot_buffer = ObjLoader.load_model('object/pot.obj')
-floor_indices, floor_buffer = ObjLoader.load_model('object/floor.obj')
-chair_indices, chair_buffer = ObjLoader.load_model('object/chair.obj')
-wallSide_indices, wallSide_buffer = ObjLoader.load_model(
-    'object/wall_side.obj')
-wallBack_indices, wallBack_buffer = ObjLoader.load_model(
-    'object/wall_back.obj')
-
-# Make Shader Program
+# Scene description: mesh, texture, scale, rotation and placement of every object
+scene = SceneLoader.load_scene(args.scene)
+
+# With the pool path every model goes into one VBO and EBO behind a single VAO
+geometry = GeometryPool() if args.draw_path == 'pool' else None
+
+# and every texture into a layer of one texture array, so no draw has to bind another texture
+texture_array = TextureArray(len(scene.textures), args.texture_size) if args.texture_size else None
+
+# Every mesh and texture is a handle right away, the data is loaded on worker threads
+assets = AssetManager(vram_budget=args.vram_budget * MB, ram_budget=args.ram_budget * MB, geometry=geometry,
+                      texture_array=texture_array)
+LOD_LEVELS = args.lod_levels
+mesh_lods = [[assets.mesh(path, lod) for lod in range(LOD_LEVELS)] for path in scene.meshes]
+meshes = [lods[0] for lods in mesh_lods]  # full detail, the culling bounds come from these
+textures = [assets.texture(path) for path in scene.textures]
+instance_positions = np.ascontiguousarray(scene.models[:, 3, :3])
+
+# World space box and sphere of every instance for frustum culling, a point until its mesh is in
+box_center, box_extent = instance_positions.copy(), np.zeros_like(instance_positions)
+sphere_center, sphere_radius = instance_positions.copy(), np.zeros(len(scene), dtype='float32')
+
+# instances are sorted by mesh, the instances of mesh i are mesh_first[i]:mesh_end[i]
+mesh_first = np.searchsorted(scene.mesh_ids, np.arange(len(meshes)))
+mesh_end = np.searchsorted(scene.mesh_ids, np.arange(len(meshes)), side='right')
+
+
+def MeshBounds(mesh):
+    # culling volumes of all the instances of a mesh that just arrived
+    global visible
+    first, end = mesh_first[mesh], mesh_end[mesh]
+    box_min, box_max, center, radius = meshes[mesh].bounds
+    transforms = scene.transforms[first:end]
+    box_center[first:end], box_extent[first:end] = Culling.world_boxes(
+        transforms, np.broadcast_to(box_min, (end - first, 3)), np.broadcast_to(box_max, (end - first, 3)))
+    sphere_center[first:end], sphere_radius[first:end] = Culling.world_spheres(
+        transforms, np.broadcast_to(center, (end - first, 3)), radius)
+    visible = None  # compact the instance VBO again
+
+
+# Occlusion culling, the occluders of the scene (walls, tables) go into a small depth buffer every frame.
+# Their full mesh and not a coarse LOD: the clustered vertices of a LOD can stick out past the real surface,
+# then it would hide instances that are visible
+occlusion = None
+if args.occlusion != 'off' and scene.occluders.any():
+    occlusion = OcclusionCuller(near=0.1, far=100, gpu=args.occlusion == 'gpu')
+OCCLUDER_LOD = 0
+occluder_meshes = [lods[OCCLUDER_LOD] for lods in mesh_lods]
+
+
+def OccluderMesh(mesh):
+    # world space triangles of the occluder instances of a mesh whose occluder LOD just arrived
+    first, end = mesh_first[mesh], mesh_end[mesh]
+    instances = np.flatnonzero(scene.occluders[first:end]) + first
+    if len(instances):
+        indices, buffer, _ = occluder_meshes[mesh].data
+        occlusion.set_occluders(mesh, world_triangles(indices, buffer, scene.transforms[instances]))
+
+
+def AssetsChanged():
+    # culling volumes and occluders of what was uploaded or evicted by the last asset update
+    for asset in assets.uploaded:
+        if asset in meshes:
+            MeshBounds(meshes.index(asset))
+        if occlusion and asset in occluder_meshes:
+            OccluderMesh(occluder_meshes.index(asset))
+    for asset in assets.evicted:
+        if occlusion and asset in occluder_meshes:
+            occlusion.remove_occluders(occluder_meshes.index(asset))
+
+
+def StreamAssets(camera_pos):
+    # request what is within the stream distance, nearest first, and upload a little of it every frame
+    mesh_distance = nearest_distance(instance_positions, scene.mesh_ids, len(meshes), camera_pos)
+    texture_distance = nearest_distance(instance_positions, scene.texture_ids, len(textures), camera_pos)
+    for asset_list, distances in ((mesh_lods, mesh_distance), (textures, texture_distance)):
+        for asset, distance in zip(asset_list, distances):
+            if distance <= args.stream_distance:
+                for lod in asset if isinstance(asset, list) else [asset]:
+                    assets.request(lod, distance)
+    assets.update()
+    AssetsChanged()
+    if assets.uploaded or assets.evicted:
+        queue.invalidate()  # the uploads bound other buffers and textures
+
+
+# Point lights of the scene, assigned to the clusters of the view frustum every frame
+lights = None
+if args.lighting == 'clustered' and len(scene.light_positions):
+    lights = ClusteredLights(scene.light_positions, scene.light_colors, scene.light_radii, ambient=(0.3, 0.3, 0.3))
+    lights.set_projection(45, WIDTH / HEIGHT, 0.1, 100, WIDTH, HEIGHT)
+    lights.bind()
+
+# Make Shader Program, the fragment shader samples the layer of the texture array when there is one
+# and adds up the lights of its cluster when there are lights
+defines = ['TEXTURE_ARRAY'] * (texture_array is not None) + ['CLUSTERED_LIGHTING'] * (lights is not None)
+fragment_src = fragment_src.replace('# version 330', '# version 330' + ''.join(
+    f'\n    #define {define}' for define in defines), 1)
+fragment_src = fragment_src.replace('    // cluster_lighting() from Clustered_Lighting\n', LIGHTING_GLSL, 1)
+# (no validation, every sampler is on unit 0 until setup_program gives the light tables their own units)
 shader = compileProgram(compileShader(vertex_src, GL_VERTEX_SHADER),
-                        compileShader(fragment_src, GL_FRAGMENT_SHADER))
-
-VAO = glGenVertexArrays(7)
-VBO = glGenBuffers(7)
-
-
-def Object(vao_vbo, buffer):
-    glBindVertexArray(VAO[vao_vbo])
-    glBindBuffer(GL_ARRAY_BUFFER, VBO[vao_vbo])
-    glBufferData(GL_ARRAY_BUFFER, buffer.nbytes,
-                 buffer, GL_STATIC_DRAW)
+                        compileShader(fragment_src, GL_FRAGMENT_SHADER), validate=lights is None)
+
+# Camera matrices in one uniform buffer, uploaded once per frame for all the programs
+camera_uniforms = CameraUniforms()
+camera_uniforms.setup_program(shader)
+start_time = time.perf_counter()
+
+# Instance VBO with the composed model matrix of every object,
+# each batch has a region per LOD in it, as big as the batch
+instance_data = scene.instance_data()
+instance_stride = instance_data.itemsize * 16
+lod_instance_data = np.zeros((len(scene) * LOD_LEVELS, 4, 4), dtype='float32')
+instanceVBO = glGenBuffers(1)
+glBindBuffer(GL_ARRAY_BUFFER, instanceVBO)
+glBufferData(GL_ARRAY_BUFFER, lod_instance_data.nbytes,
+             lod_instance_data, GL_DYNAMIC_DRAW)
+
+# and a second one with the texture array layer of every object, in the same order
+texture_layers = np.array([getattr(texture, 'layer', 0) for texture in textures], dtype='float32')
+instance_layers = texture_layers[scene.texture_ids]
+lod_instance_layers = np.zeros(len(scene) * LOD_LEVELS, dtype='float32')
+layerVBO = glGenBuffers(1)
+glBindBuffer(GL_ARRAY_BUFFER, layerVBO)
+glBufferData(GL_ARRAY_BUFFER, lod_instance_layers.nbytes,
+             lod_instance_layers, GL_DYNAMIC_DRAW)
+
+
+def Batch(vao, mesh, first):
+    # one VAO per mesh + texture group and LOD, reading its own slice of the instance VBO
+    glBindVertexArray(VAO[vao])
+    # the buffer names of a mesh stay the same, the data may come later
+    glBindBuffer(GL_ARRAY_BUFFER, mesh.vbo)
+    glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, mesh.ebo)
     # Define Vertex and Texture Shader
     glEnableVertexAttribArray(0)
     glVertexAttribPointer(0, 3, GL_FLOAT, GL_FALSE,
-                          buffer.itemsize * 8, ctypes.c_void_p(0))
+                          instance_data.itemsize * 8, ctypes.c_void_p(0))
     glEnableVertexAttribArray(1)
     glVertexAttribPointer(1, 2, GL_FLOAT, GL_FALSE,
-                          buffer.itemsize * 8, ctypes.c_void_p(12))
+                          instance_data.itemsize * 8, ctypes.c_void_p(12))
     glEnableVertexAttribArray(2)
     glVertexAttribPointer(2, 3, GL_FLOAT, GL_FALSE,
-                          buffer.itemsize * 8, ctypes.c_void_p(20))
-
-
-# Load Object to shader
-Object(0, sushi_buffer)
-Object(1, wallSide_buffer)
-Object(2, table_buffer)
-Object(3, floor_buffer)
-Object(4, pot_buffer)
-Object(5, chair_buffer)
-Object(6, wallBack_buffer)
-
-# load texture
-texture = glGenTextures(7)
-load_texture_pygame('textures/sushi.png', texture[0])
-load_texture_pygame('textures/mahogany.png', texture[1])
-load_texture_pygame('textures/floor.png', texture[2])
-load_texture_pygame('textures/pot.jpeg', texture[3])
-load_texture_pygame('textures/chair.png', texture[4])
-load_texture_pygame('textures/plafon.jpg', texture[5])
-load_texture_pygame('textures/wall_side.jpg', texture[6])
-
-# Using program shader
-glUseProgram(shader)
+                          instance_data.itemsize * 8, ctypes.c_void_p(20))
+    # model matrix columns, 1 means every instance has its own
+    glBindBuffer(GL_ARRAY_BUFFER, instanceVBO)
+    for column in range(4):
+        glEnableVertexAttribArray(3 + column)
+        glVertexAttribPointer(3 + column, 4, GL_FLOAT, GL_FALSE, instance_stride,
+                              ctypes.c_void_p(first * instance_stride + column * 16))
+        glVertexAttribDivisor(3 + column, 1)
+    glBindBuffer(GL_ARRAY_BUFFER, layerVBO)
+    glEnableVertexAttribArray(7)
+    glVertexAttribPointer(7, 1, GL_FLOAT, GL_FALSE, 4, ctypes.c_void_p(first * 4))
+    glVertexAttribDivisor(7, 1)
+
+
+if geometry is None:
+    # one VAO per batch and LOD
+    VAO = np.atleast_1d(glGenVertexArrays(len(scene.batches) * LOD_LEVELS))
+    for i, (mesh, tex, first, count) in enumerate(scene.batches):
+        for lod in range(LOD_LEVELS):
+            Batch(i * LOD_LEVELS + lod, mesh_lods[mesh][lod], first * LOD_LEVELS + lod * count)
+else:
+    # the pool VAO reads the instance VBO from the first matrix, every draw command picks its region
+    # with its base instance
+    geometry.set_instance_buffer(instanceVBO)
+    geometry.add_instance_attribute(7, layerVBO)
+    batch_slots = np.array([[mesh_lods[mesh][lod].slot for lod in range(LOD_LEVELS)]
+                            for mesh, tex, first, count in scene.batches], dtype='int64').reshape(-1, LOD_LEVELS)
+    batch_base_instances = np.array([[first * LOD_LEVELS + lod * count for lod in range(LOD_LEVELS)]
+                                     for mesh, tex, first, count in scene.batches],
+                                    dtype='int64').reshape(-1, LOD_LEVELS)
+    batch_textures = np.repeat([tex for mesh, tex, first, count in scene.batches], LOD_LEVELS).astype('int64')
+    texture_names = np.array([texture.texture for texture in textures], dtype='int64')
+
+# Without streaming everything is loaded before the first frame
+if not args.stream:
+    start = time.perf_counter()
+    for asset in sum(mesh_lods, []) + textures:
+        assets.request(asset)
+    assets.finish()
+    AssetsChanged()
+    print(f'loaded {assets.stats()} in {(time.perf_counter() - start) * 1000:.1f} ms')
+
+# Every bind goes through the render queue, it skips the ones that change nothing
+queue = RenderQueue(GL_TEXTURE_2D if texture_array is None else GL_TEXTURE_2D_ARRAY)
+queue.use_program(shader)
+if lights:
+    lights.setup_program(shader)
 glClearColor(0, 0, 0.1, 0)
 glEnable(GL_DEPTH_TEST)
 
 # Define projection, transform, and view array
 projection = pyrr.matrix44.create_perspective_projection(
     45, WIDTH/HEIGHT, 0.1, 100)
-# Table Position
-tablerf_pos = pyrr.matrix44.create_from_translation(pyrr.Vector3([10, 0, -10]))
-tablelf_pos = pyrr.matrix44.create_from_translation(
-    pyrr.Vector3([-30, 0, -10]))
-tablelb_pos = pyrr.matrix44.create_from_translation(pyrr.Vector3([-30, 0, 15]))
-tablemf_pos = pyrr.matrix44.create_from_translation(
-    pyrr.Vector3([-10, 0, -10]))
-tablemb_pos = pyrr.matrix44.create_from_translation(pyrr.Vector3([-10, 0, 15]))
-tablerb_pos = pyrr.matrix44.create_from_translation(pyrr.Vector3([10, 0, 15]))
-# Sushi Position
-sushirf_pos = pyrr.matrix44.create_from_translation(
-    pyrr.Vector3([10, 4.8, -10]))
-sushilf_pos = pyrr.matrix44.create_from_translation(
-    pyrr.Vector3([-10, 4.8, -10]))
-sushilb_pos = pyrr.matrix44.create_from_translation(
-    pyrr.Vector3([-10, 4.8, 15]))
-sushimf_pos = pyrr.matrix44.create_from_translation(
-    pyrr.Vector3([-30, 4.8, -10]))
-sushimb_pos = pyrr.matrix44.create_from_translation(
-    pyrr.Vector3([-30, 4.8, 15]))
-sushirb_pos = pyrr.matrix44.create_from_translation(
-    pyrr.Vector3([10, 4.8, 15]))
-# Chair 1 Position
-chair1mf_pos = pyrr.matrix44.create_from_translation(
-    pyrr.Vector3([-10, 0, -15]))
-chair1mb_pos = pyrr.matrix44.create_from_translation(
-    pyrr.Vector3([-10, 0, 10]))
-chair1lf_pos = pyrr.matrix44.create_from_translation(
-    pyrr.Vector3([-30, 0, -15]))
-chair1lb_pos = pyrr.matrix44.create_from_translation(
-    pyrr.Vector3([-30, 0, 10]))
-chair1rb_pos = pyrr.matrix44.create_from_translation(
-    pyrr.Vector3([10, 0, 10]))
-chair1rf_pos = pyrr.matrix44.create_from_translation(
-    pyrr.Vector3([10, 0, -15]))
-# Chair 2 Position
-chair2rf_pos = pyrr.matrix44.create_from_translation(
-    pyrr.Vector3([10, 0, -3]))
-chair2rb_pos = pyrr.matrix44.create_from_translation(pyrr.Vector3([10, 0, 22]))
-chair2mf_pos = pyrr.matrix44.create_from_translation(
-    pyrr.Vector3([-10, 0, -3]))
-chair2mb_pos = pyrr.matrix44.create_from_translation(
-    pyrr.Vector3([-10, 0, 22]))
-chair2lf_pos = pyrr.matrix44.create_from_translation(
-    pyrr.Vector3([-30, 0, -3]))
-chair2lb_pos = pyrr.matrix44.create_from_translation(
-    pyrr.Vector3([-30, 0, 22]))
-# Pot Position
-potlb_pos = pyrr.matrix44.create_from_translation(pyrr.Vector3([-40, 0, 23]))
-potlf_pos = pyrr.matrix44.create_from_translation(pyrr.Vector3([-40, 0, -23]))
-potmlb_pos = pyrr.matrix44.create_from_translation(pyrr.Vector3([-20, 0, 23]))
-potmlf_pos = pyrr.matrix44.create_from_translation(pyrr.Vector3([-20, 0, -23]))
-potmrb_pos = pyrr.matrix44.create_from_translation(pyrr.Vector3([0, 0, 23]))
-potmrf_pos = pyrr.matrix44.create_from_translation(pyrr.Vector3([0, 0, -23]))
-potrb_pos = pyrr.matrix44.create_from_translation(pyrr.Vector3([20, 0, 23]))
-potrf_pos = pyrr.matrix44.create_from_translation(pyrr.Vector3([20, 0, -23]))
-# Wall, Roof , Floor Position
-floor_pos = pyrr.matrix44.create_from_translation(pyrr.Vector3([0, 0, 0]))
-roof_pos = pyrr.matrix44.create_from_translation(pyrr.Vector3([0, 20, 0]))
-wallSideR_pos = pyrr.matrix44.create_from_translation(pyrr.Vector3([25, 0, 0]))
-wallSideL_pos = pyrr.matrix44.create_from_translation(
-    pyrr.Vector3([-45, 0, 0]))
-wallBack_pos = pyrr.matrix44.create_from_translation(pyrr.Vector3([0, 0, -26]))
-
-rotate = pyrr.matrix44.create_from_y_rotation(30)
-no_rotate = pyrr.matrix44.create_from_y_rotation(0)
-
-model_loc = glGetUniformLocation(shader, "model")
-proj_loc = glGetUniformLocation(shader, "projection")
-view_loc = glGetUniformLocation(shader, "view")
-scale_loc = glGetUniformLocation(shader, "scale")
-rotate_loc = glGetUniformLocation(shader, "rotate")
-
-table_scl = pyrr.matrix44.create_from_scale(pyrr.Vector3([0.7, 0.7, 0.7]))
-sushi_scl = pyrr.matrix44.create_from_scale(pyrr.Vector3([0.2, 0.2, 0.2]))
-chair_scl = pyrr.matrix44.create_from_scale(pyrr.Vector3([2.5, 2.5, 2.5]))
-pot_scl = pyrr.matrix44.create_from_scale(pyrr.Vector3([0.7, 0.7, 0.7]))
-floor_scl = pyrr.matrix44.create_from_scale(pyrr.Vector3([1, 1, 1]))
-
-glUniformMatrix4fv(proj_loc, 1, GL_FALSE, projection)
+
+# GL call tracing, the wrappers replace the entry points of this script and of the render queue
+profiler = None
+if args.profile:
+    profiler = GLProfiler(gpu_timer=args.gpu_timer, csv_path=args.profile)
+    profiler.install(globals(), Render_Queue, Geometry_Pool, Camera_Uniforms)
+    profiler_text = ''
+
+# instances get less detailed once their bounding radius / camera distance is below these
+LOD_SIZES = (0.1, 0.05, 0.025)
 
 running = True
+visible = None
+lods = None
+region_counts = np.zeros((len(scene.batches), LOD_LEVELS), dtype='int64')
 
 # ==========================================
 # Generate Draw Function
 # ==========================================
 
 
-def DrawObject(vao, pos, tex, ind, scl, rot=no_rotate):
-    glBindVertexArray(VAO[vao])
-    glBindTexture(GL_TEXTURE_2D, texture[tex])
-    glUniformMatrix4fv(model_loc, 1, GL_FALSE, pos)
-    glUniformMatrix4fv(scale_loc, 1, GL_FALSE, scl)
-    glUniformMatrix4fv(rotate_loc, 1, GL_FALSE, rot)
-    glDrawArrays(GL_TRIANGLES, 0, len(ind))
+def index_type(mesh):
+    # ObjLoader gives uint16 indices for small meshes and uint32 for big ones
+    return GL_UNSIGNED_SHORT if mesh.index_type == 'uint16' else GL_UNSIGNED_INT
 
 
-def Wall(vao, pos, tex=6, ind=wallSide_indices, scl=floor_scl, rot=no_rotate):
-    glBindVertexArray(VAO[vao])
-    glBindTexture(GL_TEXTURE_2D, texture[tex])
-    glUniformMatrix4fv(model_loc, 1, GL_FALSE, pos)
-    glUniformMatrix4fv(scale_loc, 1, GL_FALSE, scl)
-    glUniformMatrix4fv(rotate_loc, 1, GL_FALSE, rot)
-    glDrawArrays(GL_TRIANGLES, 0, len(ind))
+def DrawBatch(vao, tex, mesh, count):
+    queue.submit(shader, VAO[vao], textures[tex].texture, mesh.count, index_type(mesh), count)
 
 
-def Sushi(pos, vao=0, tex=0, scl=sushi_scl, ind=sushi_indices):
-    glBindVertexArray(VAO[vao])
-    glBindTexture(GL_TEXTURE_2D, texture[tex])
-    glUniformMatrix4fv(model_loc, 1, GL_FALSE, pos)
-    glUniformMatrix4fv(scale_loc, 1, GL_FALSE, scl)
-    glDrawArrays(GL_TRIANGLES, 0, len(ind))
+def DrawPool():
+    # the commands of every batch and LOD with instances to draw, grouped by texture,
+    # the pool VAO is bound once and every texture is one multi draw, with a texture array that is one for all
+    commands, keep = geometry.build_commands(batch_slots, region_counts, batch_base_instances)
+    command_textures = texture_names[batch_textures[keep]]
+    order = np.argsort(command_textures, kind='stable')
+    commands, command_textures = commands[order], command_textures[order]
+    geometry.upload_commands(commands)
 
+    starts = np.flatnonzero(np.diff(command_textures, prepend=-1))
+    ends = np.append(starts[1:], len(commands))
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        queue.submit(shader, geometry.vao, int(command_textures[start]), 0, GL_UNSIGNED_INT,
+                     draw=functools.partial(geometry.draw, start, end - start))
+    return int((commands['count'].astype('int64') // 3 * commands['instance_count']).sum())
 
-def Table(pos, vao=2, tex=1, scl=table_scl, ind=table_indices):
-    glBindVertexArray(VAO[vao])
-    glBindTexture(GL_TEXTURE_2D, texture[tex])
-    glUniformMatrix4fv(model_loc, 1, GL_FALSE, pos)
-    glUniformMatrix4fv(scale_loc, 1, GL_FALSE, scl)
-    glDrawArrays(GL_TRIANGLES, 0, len(ind))
 
+def RenderFrame(view):
+    # returns the visible, culled and occluded instance counts and the drawn triangles
+    global visible, lods, region_counts
 
-def Pot(pos, vao=4, tex=3, scl=pot_scl, ind=pot_indices):
-    glBindVertexArray(VAO[vao])
-    glBindTexture(GL_TEXTURE_2D, texture[tex])
-    glUniformMatrix4fv(model_loc, 1, GL_FALSE, pos)
-    glUniformMatrix4fv(scale_loc, 1, GL_FALSE, scl)
-    glDrawArrays(GL_TRIANGLES, 0, len(ind))
+    if profiler:
+        profiler.begin_frame()
+    if args.stream:
+        StreamAssets(cam.camera_pos)
+    glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
 
+    # Camera of this frame to the uniform buffer, every program reads it from there
+    view_projection = camera_uniforms.update(view, projection, cam.camera_pos, time.perf_counter() - start_time)
+    if lights:
+        lights.update(view)
+
+    # Frustum culling, the visible instances of each batch go to the front of its part of the instance VBO
+    # and each one goes to the region of its LOD
+    now_visible = Culling.visible_instances(Culling.frustum_planes(view_projection),
+                                            box_center, box_extent, sphere_center, sphere_radius)
+    # then the ones hidden behind the occluders, the occluders themselves are always drawn
+    occluded = np.zeros(len(scene), dtype=bool)
+    if occlusion:
+        occlusion.update(view_projection)
+        if occlusion.gpu:
+            queue.invalidate()  # the depth pre-pass used its own program, VAO and framebuffer
+        occluded = now_visible & ~scene.occluders & occlusion.occluded(view_projection, box_center, box_extent)
+        now_visible &= ~occluded
+    now_lods = select_lods(sphere_center, sphere_radius, cam.camera_pos, LOD_SIZES, LOD_LEVELS)
+    if visible is None or not np.array_equal(now_visible, visible) or not np.array_equal(now_lods, lods):
+        visible, lods = now_visible, now_lods
+        order, slots, region_counts = Culling.compact_lod_batches(scene.batches, visible, lods, LOD_LEVELS)
+        lod_instance_data[slots] = instance_data[order]
+        lod_instance_layers[slots] = instance_layers[order]
+        glBindBuffer(GL_ARRAY_BUFFER, instanceVBO)
+        glBufferSubData(GL_ARRAY_BUFFER, 0, lod_instance_data.nbytes,
+                        GL_Mode.gl_array(lod_instance_data))
+        glBindBuffer(GL_ARRAY_BUFFER, layerVBO)
+        glBufferSubData(GL_ARRAY_BUFFER, 0, lod_instance_layers.nbytes,
+                        GL_Mode.gl_array(lod_instance_layers))
+
+    # Draw every mesh + texture group and LOD of the scene with one instanced call ✨
+    # or all the ones with the same texture with one multi draw from the pool
+    triangles = 0
+    if geometry is not None:
+        triangles = DrawPool()
+    else:
+        for i, (mesh, tex, first, count) in enumerate(scene.batches):
+            for lod in range(LOD_LEVELS):
+                lod_mesh = mesh_lods[mesh][lod]
+                if region_counts[i, lod] and lod_mesh.count:
+                    DrawBatch(i * LOD_LEVELS + lod, tex, lod_mesh, region_counts[i, lod])
+                    triangles += lod_mesh.count // 3 * region_counts[i, lod]
+    queue.flush()
+    if profiler:
+        profiler.end_frame()
+
+    return int(visible.sum()), int(len(visible) - visible.sum() - occluded.sum()), int(occluded.sum()), \
+        int(triangles)
 
-def Chair(pos, rot=rotate, vao=5, tex=4, scl=chair_scl, ind=chair_indices):
-    glBindVertexArray(VAO[vao])
-    glBindTexture(GL_TEXTURE_2D, texture[tex])
-    glUniformMatrix4fv(model_loc, 1, GL_FALSE, pos)
-    glUniformMatrix4fv(rotate_loc, 1, GL_FALSE, rot)
-    glUniformMatrix4fv(scale_loc, 1, GL_FALSE, scl)
-    glDrawArrays(GL_TRIANGLES, 0, len(ind))
 
+# ==========================================
+# Headless: follow the camera path and save every frame
+# ==========================================
+if args.headless:
+    positions, yaws, pitches = Headless.load_camera_path(args.camera_path, args.frames)
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+
+    frame_times = []
+    for frame in range(args.frames):
+        cam.camera_pos = pyrr.Vector3(positions[frame])
+        cam.jaw, cam.pitch = yaws[frame], pitches[frame]
+        cam.update_camera_vectors()
+
+        start = time.perf_counter()
+        shown, culled, occluded, triangles = RenderFrame(cam.get_view_matrix())
+        glFinish()  # wait for the frame, so the time includes the rendering
+        frame_times.append(time.perf_counter() - start)
+
+        if args.output:
+            context.save_frame(os.path.join(args.output, f'frame_{frame:04d}.png'))
+        print(f'frame {frame:4d}  {frame_times[-1] * 1000:7.2f} ms  visible {shown:3d}  culled {culled:3d}  '
+              f'occluded {occluded:3d}  triangles {triangles:6d}'
+              + (f'  {assets.stats()}' if args.stream else ''))
+
+    frame_times = np.array(frame_times) * 1000
+    print(f'{args.frames} frames, mean {frame_times.mean():.2f} ms, '
+          f'median {np.median(frame_times):.2f} ms, max {frame_times.max():.2f} ms')
 
 # ==========================================
 # Loop until the user closes the window
 # ==========================================
-while running:
+# camera updates in fixed steps, frames capped by sleeping (or by the vsync)
+frame_clock = FrameClock(fps_cap=args.fps_cap)
+previous = cam.state()
+last_view = None
+redraw = True
+
+while running and not args.headless:
     # Event for close and resize window
     for event in pygame.event.get():
         if event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
@@ -321,77 +556,63 @@ while running:
             glViewport(0, 0, event.w, event.h)
             projection = pyrr.matrix44.create_perspective_projection(
                 45, event.w/event.h, 0.1, 100)
-            glUniformMatrix4fv(proj_loc, 1, GL_FALSE, projection)
-
-    glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
-
-    # Movement key
-    key_press()
+            if lights:
+                # the clusters follow the new frustum and window size
+                lights.set_projection(45, event.w / event.h, 0.1, 100, event.w, event.h)
+                lights.setup_program(shader)
+                queue.invalidate()
+        if event.type in (pygame.VIDEORESIZE, pygame.VIDEOEXPOSE, pygame.WINDOWSHOWN):
+            redraw = True
+
+    # Movement key, in the fixed steps of the frame clock
     mouse_pos = pygame.mouse.get_pos()
+    jaw, pitch = cam.jaw, cam.pitch
     mouse_look(mouse_pos[0], mouse_pos[1])
-
-    # 360° Look Around
-    if mouse_pos[0] <= 0:
-        cam.process_keyboard("YAWL", 0.25)
-    elif mouse_pos[0] >= WIDTH-1:
-        cam.process_keyboard("YAWR", 0.25)
-
-    # View Matrix
-    view = cam.get_view_matrix()
-    glUniformMatrix4fv(view_loc, 1, GL_FALSE, view)
-
-    # Draw Sushi ✨
-    DrawObject(0, sushilb_pos, 0, sushi_indices, sushi_scl)
-    DrawObject(0, sushilf_pos, 0, sushi_indices, sushi_scl)
-    DrawObject(0, sushimb_pos, 0, sushi_indices, sushi_scl)
-    DrawObject(0, sushimf_pos, 0, sushi_indices, sushi_scl)
-    DrawObject(0, sushirb_pos, 0, sushi_indices, sushi_scl)
-    DrawObject(0, sushirf_pos, 0, sushi_indices, sushi_scl)
-
-    # Draw Table ✨
-    DrawObject(2, tablelb_pos, 1, table_indices, table_scl)
-    DrawObject(2, tablelf_pos, 1, table_indices, table_scl)
-    DrawObject(2, tablemb_pos, 1, table_indices, table_scl)
-    DrawObject(2, tablemf_pos, 1, table_indices, table_scl)
-    DrawObject(2, tablerb_pos, 1, table_indices, table_scl)
-    DrawObject(2, tablerf_pos, 1, table_indices, table_scl)
-
-    # Draw Pot ✨
-    DrawObject(4, potlb_pos, 3, pot_indices, pot_scl)
-    DrawObject(4, potlf_pos, 3, pot_indices, pot_scl)
-    DrawObject(4, potmlb_pos, 3, pot_indices, pot_scl)
-    DrawObject(4, potmlf_pos, 3, pot_indices, pot_scl)
-    DrawObject(4, potmrb_pos, 3, pot_indices, pot_scl)
-    DrawObject(4, potmrf_pos, 3, pot_indices, pot_scl)
-    DrawObject(4, potrb_pos, 3, pot_indices, pot_scl)
-    DrawObject(4, potrf_pos, 3, pot_indices, pot_scl)
-
-    # Draw Chair ✨
-    DrawObject(5, chair1lb_pos, 4, chair_indices, chair_scl)
-    DrawObject(5, chair1lb_pos, 4, chair_indices, chair_scl)
-    DrawObject(5, chair1lf_pos, 4, chair_indices, chair_scl)
-    DrawObject(5, chair1mb_pos, 4, chair_indices, chair_scl)
-    DrawObject(5, chair1mf_pos, 4, chair_indices, chair_scl)
-    DrawObject(5, chair1rb_pos, 4, chair_indices, chair_scl)
-    DrawObject(5, chair1rf_pos, 4, chair_indices, chair_scl)
-    DrawObject(5, chair2lb_pos, 4, chair_indices, chair_scl, rot=rotate)
-    DrawObject(5, chair2lf_pos, 4, chair_indices, chair_scl, rot=rotate)
-    DrawObject(5, chair2mb_pos, 4, chair_indices, chair_scl, rot=rotate)
-    DrawObject(5, chair2mf_pos, 4, chair_indices, chair_scl, rot=rotate)
-    DrawObject(5, chair2rb_pos, 4, chair_indices, chair_scl, rot=rotate)
-    DrawObject(5, chair2rf_pos, 4, chair_indices, chair_scl, rot=rotate)
-
-    # Draw Floor 🟫
-    DrawObject(3, floor_pos, 2, floor_indices, floor_scl)
-
-    # Draw Roof
-    DrawObject(3, roof_pos, 5, floor_indices, floor_scl)
-
-    # Draw Wall
-    DrawObject(1, wallSideR_pos, 6, wallSide_indices, floor_scl)
-    DrawObject(1, wallSideL_pos, 6, wallSide_indices, floor_scl)
-    DrawObject(6, wallBack_pos, 6, wallBack_indices, floor_scl)
+    previous = cam.turned_state(previous, jaw, pitch)
+    for _ in range(frame_clock.steps()):
+        previous = cam.state()
+        key_press(frame_clock.step)
+
+        # 360° Look Around
+        if mouse_pos[0] <= 0:
+            cam.process_keyboard("YAWL", cam.turn_speed * frame_clock.step)
+        elif mouse_pos[0] >= WIDTH-1:
+            cam.process_keyboard("YAWR", cam.turn_speed * frame_clock.step)
+
+    # nothing moved and nothing is streaming in: the last frame is still on screen, just wait for input
+    view = cam.interpolated_view_matrix(previous, frame_clock.alpha)
+    if not redraw and np.array_equal(view, last_view) and not (args.stream and assets.busy()):
+        frame_clock.idle()
+        continue
+    last_view, redraw = view, False
+
+    shown, culled, occluded, triangles = RenderFrame(view)
+    caption = (f'Kelompok 5 - Restaurant | {frame_clock.fps:.0f} fps | visible {shown} culled {culled} '
+               f'occluded {occluded} triangles {triangles}')
+    if args.stream:
+        caption += f' | {assets.stats()}'
+    if profiler:
+        # refreshed every 30 frames, so the caption stays readable
+        if profiler.frame % 30 == 1:
+            profiler_text = profiler.summary()
+        caption += f' | {profiler_text}'
+    if caption != pygame.display.get_caption()[0]:
+        pygame.display.set_caption(caption)
 
     pygame.display.flip()
-
-pygame.quit()
+    frame_clock.wait()
+
+# How many binds and uploads the render queue saved
+for name, value in queue.total.items():
+    print(f'{name:<25} {value}')
+if profiler:
+    print(profiler.summary())
+    for name, value in profiler.totals.most_common():
+        print(f'{name:<25} {value}')
+    profiler.close()
+
+assets.close()
+if args.headless:
+    context.destroy()
+else:
+    pygame.quit()
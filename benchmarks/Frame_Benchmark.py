@@ -0,0 +1,439 @@
+# Frame time benchmark of the numbered demo scripts, rendered headless along the same scripted camera path
+# run from the project folder: python -m benchmarks.Frame_Benchmark [scripts] [--frames 300]
+# every script runs in its own process, so peak RSS and GL state of one script don't leak into the next
+import os
+import sys
+import glob
+import json
+import time
+import shlex
+import signal
+import argparse
+import tempfile
+import threading
+import subprocess
+from collections import Counter
+import numpy as np
+from libraries import Headless, GL_Mode
+
+try:
+    import resource
+except ImportError:
+    resource = None  # Windows, no peak RSS there
+
+FPS = 60  # the fake clock, glfw.get_time, pygame.time.get_ticks and the FrameClock advance 1/FPS per frame
+
+
+class BenchmarkDone(BaseException):
+    # BaseException, so "except Exception" in a script can't swallow it
+    pass
+
+
+class Recorder:
+    def __init__(self, frames):
+        self.frames = frames
+        self.frame = 0
+        self.globals = None  # the script namespace, the camera is looked up in there
+        self.context = None
+        self.finish = None  # the unwrapped glFinish
+
+        self.gl_calls = Counter()  # calls of the current frame
+        self.gl_totals = Counter()  # calls of all measured frames
+        self.setup_gl_calls = 0
+
+        self.loads = []  # (kind, function, path, seconds, thread)
+        self.load_depth = threading.local()
+
+        self.setup_seconds = None
+        self.cpu_ms = []
+        self.wall_ms = []
+        self.gl_calls_per_frame = []
+        self.loop_started = False
+        self.frame_cpu = self.frame_wall = None
+        self.start_wall = time.perf_counter()
+
+    def counted(self, name, function):
+        def call(*args, **kwargs):
+            self.gl_calls[name] += 1
+            return function(*args, **kwargs)
+        call.__name__ = name
+        call.__wrapped__ = function
+        return call
+
+    def count_namespace(self, namespace):
+        # wrap the gl* entry points of a module or globals() dict, like GL_Profiler.install()
+        namespace = namespace if isinstance(namespace, dict) else vars(namespace)
+        for name, value in list(namespace.items()):
+            if name[:2] == 'gl' and name[2:3].isupper() and callable(value) and not hasattr(value, '__wrapped__'):
+                namespace[name] = self.counted(name, value)
+
+    def start_loop(self):
+        # the first poll of the main loop, everything before it is setup and loading
+        if self.loop_started:
+            return
+        self.loop_started = True
+        # the modules and the script are all imported by now, they may have taken entry points from
+        # OpenGL.raw (glMultiDrawElementsIndirect of Geometry_Pool) that the OpenGL.GL wrappers don't see
+        for module in project_modules():
+            self.count_namespace(module)
+        if self.globals:
+            self.count_namespace(self.globals)
+        self.setup_seconds = time.perf_counter() - self.start_wall
+        self.setup_gl_calls = sum(self.gl_calls.values())
+        self.gl_calls.clear()
+        self.frame_cpu = time.process_time()
+        self.frame_wall = time.perf_counter()
+
+    def end_frame(self):
+        self.start_loop()
+        # llvmpipe renders on the CPU, wait for it like a swap with vsync off would
+        self.finish()
+        cpu = time.process_time()
+        wall = time.perf_counter()
+        self.cpu_ms.append((cpu - self.frame_cpu) * 1000)
+        self.wall_ms.append((wall - self.frame_wall) * 1000)
+        self.gl_calls_per_frame.append(sum(self.gl_calls.values()))
+        self.gl_totals.update(self.gl_calls)
+        self.gl_calls.clear()
+
+        self.frame += 1
+        if self.frame >= self.frames:
+            raise BenchmarkDone()
+        self.move_camera()
+
+        # the camera input is not part of the next frame
+        self.frame_cpu = time.process_time()
+        self.frame_wall = time.perf_counter()
+
+    def move_camera(self):
+        # the same path for every script: forward, turn right, strafe left while looking up, then back
+        cam = self.globals.get('cam') if self.globals else None
+        if cam is None or not hasattr(cam, 'process_keyboard'):
+            return
+        phase = 4 * self.frame // self.frames
+        if phase == 0:
+            cam.process_keyboard("FORWARD", 0.05)
+        elif phase == 1:
+            cam.process_mouse_movement(4, 0)
+        elif phase == 2:
+            cam.process_keyboard("LEFT", 0.05)
+            cam.process_mouse_movement(0, 1)
+        else:
+            cam.process_keyboard("BACKWARD", 0.05)
+            cam.process_mouse_movement(-4, -1)
+
+    def open_window(self, width, height, backend):
+        # the demos never ask for a core profile, so they get a compatibility context like from glfw/pygame
+        if self.context is None:
+            self.context = Headless.HeadlessContext(width, height, backend, profile='compatibility')
+        return self.context
+
+    def results(self):
+        cpu = np.array(self.cpu_ms)
+        return {
+            'frames': len(self.cpu_ms),
+            'setup_seconds': self.setup_seconds,
+            'cpu_ms': self.cpu_ms,
+            'wall_ms': self.wall_ms,
+            'cpu_ms_mean': float(cpu.mean()) if len(cpu) else None,
+            'cpu_ms_median': float(np.median(cpu)) if len(cpu) else None,
+            'cpu_ms_p95': float(np.percentile(cpu, 95)) if len(cpu) else None,
+            'gl_calls_setup': self.setup_gl_calls,
+            'gl_calls_per_frame': self.gl_calls_per_frame,
+            'gl_calls_by_function': dict(self.gl_totals.most_common()),
+            'loads': [{'kind': kind, 'function': function, 'path': path, 'seconds': seconds, 'thread': thread}
+                      for kind, function, path, seconds, thread in self.loads],
+            # summed over every thread, with load_many or the asset workers the loads overlap and the
+            # sum can be more than the wall time they took
+            'model_load_seconds': sum(load[3] for load in self.loads if load[0] == 'model'),
+            'texture_load_seconds': sum(load[3] for load in self.loads if load[0] == 'texture'),
+            'peak_rss_mb': peak_rss_mb(),
+        }
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS, None on Windows
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+def project_modules():
+    # the loaded modules of the libraries folder, imported as libraries.X or (16 and 17) as X
+    folder = os.path.abspath('libraries')
+    return [module for module in list(sys.modules.values())
+            if os.path.dirname(os.path.abspath(getattr(module, '__file__', None) or '')) == folder]
+
+
+def count_gl_calls(recorder):
+    # wrap every gl* entry point, the scripts pick the wrappers up with "from OpenGL.GL import *".
+    # start_loop() wraps the names the modules imported from elsewhere
+    import OpenGL.GL as GL
+
+    recorder.finish = GL.glFinish
+    recorder.count_namespace(GL)
+
+
+def time_loads(recorder):
+    # 16 and 17 import the loaders as top level modules, the rest through libraries
+    sys.path.insert(0, os.path.abspath('libraries'))
+    import OBJ_Loader
+    import Texture_Loader
+    import libraries.OBJ_Loader
+    import libraries.Texture_Loader
+    import libraries.Mesh_LOD
+    import libraries.Texture_Array
+    import libraries.Asset_Manager
+
+    def timed(kind, name, function):
+        def call(*args, **kwargs):
+            # only the outermost call, load_model_cached calls load_model_fast and so on
+            depth = getattr(recorder.load_depth, 'value', 0)
+            recorder.load_depth.value = depth + 1
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                recorder.load_depth.value = depth
+                if depth == 0:
+                    path = args[0] if args else None
+                    recorder.loads.append((kind, name, path if isinstance(path, str) else repr(path),
+                                           time.perf_counter() - start, threading.current_thread().name))
+        call.__name__ = name
+        return call
+
+    timers = {}  # original function -> timed one
+    for module in (OBJ_Loader, libraries.OBJ_Loader):
+        for name in ('load_model', 'load_model_fast', 'load_model_cached', 'load_many'):
+            function = getattr(module.ObjLoader, name, None)
+            if function is not None:
+                timers[function] = timed('model', name, function)
+                setattr(module.ObjLoader, name, staticmethod(timers[function]))
+    for name in ('load_lod', 'load_lods'):
+        function = getattr(libraries.Mesh_LOD, name)
+        timers[function] = timed('model', name, function)
+    for module in (Texture_Loader, libraries.Texture_Loader):
+        for name in ('load_texture', 'load_texture_pygame', 'load_texture_baked', 'load_textures',
+                     'upload_textures', 'upload_texture', 'decode_texture', 'map_baked_texture'):
+            function = getattr(module, name, None)
+            if function is not None:
+                timers[function] = timed('texture', name, function)
+    # the restaurant uploads into its texture array instead of upload_texture
+    libraries.Texture_Array.TextureArray.upload = timed('texture', 'TextureArray.upload',
+                                                        libraries.Texture_Array.TextureArray.upload)
+
+    # the functions are also imported by name into the other modules, Asset_Manager has map_baked_texture
+    # and load_lod, those names are swapped too
+    for module in (OBJ_Loader, Texture_Loader, libraries.OBJ_Loader, libraries.Texture_Loader,
+                   libraries.Mesh_LOD, libraries.Texture_Array, libraries.Asset_Manager):
+        namespace = vars(module)
+        for name, value in list(namespace.items()):
+            if callable(value) and value in timers:
+                namespace[name] = timers[value]
+
+
+def fake_glfw(recorder, backend):
+    import glfw
+
+    def create_window(width, height, title, monitor, share):
+        recorder.open_window(width, height, backend)
+        return 'window'
+
+    def window_should_close(window):
+        recorder.start_loop()
+        return False
+
+    def swap_buffers(window):
+        recorder.end_frame()
+
+    glfw.init = lambda: True
+    glfw.create_window = create_window
+    glfw.window_should_close = window_should_close
+    glfw.swap_buffers = swap_buffers
+    glfw.get_time = lambda: recorder.frame / FPS
+    for name in ('make_context_current', 'poll_events', 'terminate', 'set_window_pos', 'set_input_mode',
+                 'set_window_should_close', 'set_window_size_callback', 'set_key_callback',
+                 'set_cursor_pos_callback', 'set_mouse_button_callback', 'set_scroll_callback',
+                 'swap_interval', 'window_hint'):
+        setattr(glfw, name, lambda *args, **kwargs: None)
+
+
+def fake_pygame(recorder, backend):
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+    import pygame
+
+    class NoKeys:
+        def __getitem__(self, key):
+            return False
+
+    def set_mode(size=(0, 0), flags=0, *args, **kwargs):
+        recorder.open_window(int(size[0]), int(size[1]), backend)
+        return None
+
+    def get_events(*args, **kwargs):
+        recorder.start_loop()
+        return []
+
+    def flip():
+        recorder.end_frame()
+
+    pygame.display.set_mode = set_mode
+    pygame.display.flip = flip
+    pygame.event.get = get_events
+    pygame.event.set_grab = lambda *args: None
+    pygame.key.get_pressed = lambda: NoKeys()
+    pygame.mouse.get_pos = lambda: (0, 0)
+    pygame.mouse.set_visible = lambda *args: None
+    pygame.time.get_ticks = lambda: recorder.frame * 1000 // FPS
+
+
+def fake_frame_clock(recorder):
+    # the frame clock of the demos follows the fake time and never waits, every frame is measured as drawn
+    from libraries import Frame_Clock
+
+    Frame_Clock.clock = lambda: recorder.frame / FPS
+    Frame_Clock.FrameClock.wait = lambda self: None
+    Frame_Clock.FrameClock.idle = lambda self: None
+
+
+def run_script(script, frames, backend, gl_mode, script_args):
+    # runs inside the child process, returns the results of one script
+    Headless.setup_platform(backend)  # before the first OpenGL.GL import
+    GL_Mode.setup_mode(gl_mode)
+    recorder = Recorder(frames)
+    count_gl_calls(recorder)
+    time_loads(recorder)
+    fake_glfw(recorder, backend)
+    fake_pygame(recorder, backend)
+    fake_frame_clock(recorder)
+
+    with open(script, 'r') as f:
+        source = f.read()
+    recorder.globals = {'__name__': '__main__', '__file__': script}
+    sys.argv = [script] + script_args
+
+    error = None
+    try:
+        exec(compile(source, script, 'exec'), recorder.globals)
+    except BenchmarkDone:
+        pass
+    except SystemExit:
+        pass
+    except Exception as e:
+        error = f'{type(e).__name__}: {e}'
+
+    results = recorder.results()
+    results['script'] = script
+    results['gl_mode'] = gl_mode
+    results['error'] = error
+    if error is None and results['frames'] < frames:
+        results['error'] = f'the script stopped after {results["frames"]} of {frames} frames'
+    return results
+
+
+def run_child(script, frames, backend, gl_mode, script_args):
+    # a fresh interpreter per script, the results come back through a temporary file
+    with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as f:
+        result_file = f.name
+    command = [sys.executable, '-m', 'benchmarks.Frame_Benchmark', '--child', script, '--result', result_file,
+               '--frames', str(frames), '--backend', backend, '--gl-mode', gl_mode, '--script-args', shlex.join(script_args)]
+    try:
+        process = subprocess.run(command, capture_output=True, text=True)
+        try:
+            with open(result_file, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            # crashed before writing anything, e.g. a segfault in the driver
+            code = process.returncode
+            reason = signal.Signals(-code).name if code < 0 else f'exit code {code}'
+            return {'script': script, 'gl_mode': gl_mode, 'frames': 0, 'error': f'{reason}: {process.stderr.strip()[-500:]}'}
+    finally:
+        if os.path.exists(result_file):
+            os.remove(result_file)
+
+
+def parse_script_args(values):
+    # "23_Restaurant (Final).py=--scene scenes/other.json"
+    script_args = {}
+    for value in values:
+        script, _, arguments = value.partition('=')
+        script_args[script] = shlex.split(arguments)
+    return script_args
+
+
+def print_result(result):
+    script, mode = result['script'], result['gl_mode']
+    if result.get('error'):
+        print(f"{script:<34}{mode:>8}{result['frames']:>7}  {result['error'][:100]}")
+    if result['frames']:
+        gl_calls = np.mean(result['gl_calls_per_frame'])
+        rss = '-' if result['peak_rss_mb'] is None else f"{result['peak_rss_mb']:.0f}"
+        print(f"{script:<34}{mode:>8}{result['frames']:>7}{result['setup_seconds']:>9.2f}"
+              f"{result['cpu_ms_median']:>9.2f}{result['cpu_ms_p95']:>9.2f}{gl_calls:>10.0f}"
+              f"{result['model_load_seconds']:>10.3f}{result['texture_load_seconds']:>12.3f}"
+              f"{rss:>9}")
+
+
+def print_comparison(results):
+    # median CPU time per frame with the PyOpenGL checks and without them
+    print(f"\n{'script':<34}{'debug ms':>10}{'release ms':>12}{'speedup':>9}")
+    by_script = {}
+    for result in results:
+        if result['frames']:
+            by_script.setdefault(result['script'], {})[result['gl_mode']] = result['cpu_ms_median']
+    for script, times in by_script.items():
+        if len(times) == 2:
+            print(f"{script:<34}{times['debug']:>10.2f}{times['release']:>12.2f}"
+                  f"{times['debug'] / times['release']:>8.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='headless frame time benchmark of the demo scripts')
+    parser.add_argument('scripts', nargs='*', help='scripts to run, all numbered scripts when empty')
+    parser.add_argument('--frames', type=int, default=300, help='frames per script')
+    parser.add_argument('--backend', choices=Headless.BACKENDS, default='egl')
+    parser.add_argument('--gl-mode', choices=GL_Mode.MODES + ('both',), default='debug',
+                        help='PyOpenGL error checking on (debug) or off (release), both to compare them')
+    parser.add_argument('--output', default='benchmarks/results/frame_benchmark.json',
+                        help='JSON file for the results')
+    parser.add_argument('--script-args', action='append', default=[],
+                        help='extra command line of one script, "script=arguments"')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--result', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        arguments = shlex.split(args.script_args[0]) if args.script_args else []
+        results = run_script(args.child, args.frames, args.backend, args.gl_mode, arguments)
+        with open(args.result, 'w') as f:
+            json.dump(results, f)
+        # skip the interpreter shutdown, some scripts leave GL objects behind that crash on cleanup
+        os._exit(0)
+
+    scripts = args.scripts or sorted(glob.glob('[0-9][0-9]_*.py'))
+    script_args = parse_script_args(args.script_args)
+
+    modes = GL_Mode.MODES if args.gl_mode == 'both' else (args.gl_mode,)
+    print(f"{'script':<34}{'mode':>8}{'frames':>7}{'setup s':>9}{'cpu ms':>9}{'p95 ms':>9}"
+          f"{'GL/frame':>10}{'models s':>10}{'textures s':>12}{'RSS MB':>9}")
+    results = []
+    for script in scripts:
+        for mode in modes:
+            result = run_child(script, args.frames, args.backend, mode, script_args.get(script, []))
+            results.append(result)
+            print_result(result)
+
+    if len(modes) > 1:
+        print_comparison(results)
+
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump({'frames': args.frames, 'backend': args.backend, 'gl_modes': modes, 'fps': FPS,
+                   'results': results}, f, indent=1)
+    print(f'results written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
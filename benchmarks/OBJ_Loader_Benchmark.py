@@ -0,0 +1,100 @@
+# Compare ObjLoader.load_model with the NumPy loader ObjLoader.load_model_fast and its .npz cache
+# run from the project folder: python -m benchmarks.OBJ_Loader_Benchmark
+# the cold start is measured on copies of the models in a temporary folder, the caches in object/ are left alone
+import os
+import glob
+import time
+import shutil
+import tempfile
+import numpy as np
+from libraries.OBJ_Loader import ObjLoader
+
+REPEAT = 3
+
+
+def best_time(load, file):
+    best = None
+    result = None
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        result = load(file)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+# ObjLoader.load_model against the NumPy loader ObjLoader.load_model_fast
+def compare_loaders(files):
+    print(f"{'file':<30}{'faces':>8}{'load_model':>14}{'load_model_fast':>18}{'speedup':>10}  same")
+    for file in files:
+        fast_time, (fast_indices, fast_buffer) = best_time(ObjLoader.load_model_fast, file)
+
+        try:
+            old_time, (old_indices, old_buffer) = best_time(ObjLoader.load_model, file)
+        except ValueError:
+            # load_model can't read faces without texture coordinates (v//vn)
+            print(f"{file:<30}{len(fast_indices) // 3:>8}{'failed':>14}{fast_time * 1000:>16.2f}ms{'-':>10}  -")
+            continue
+
+        same = np.array_equal(old_indices, fast_indices) and np.array_equal(old_buffer, fast_buffer)
+        print(f"{file:<30}{len(fast_indices) // 3:>8}{old_time * 1000:>12.2f}ms{fast_time * 1000:>16.2f}ms"
+              f"{old_time / fast_time:>9.1f}x  {same}")
+
+
+# Vertex memory of the glDrawArrays buffer against the deduplicated glDrawElements buffer
+def compare_memory(files):
+    print()
+    print(f"{'file':<30}{'sorted verts':>14}{'indexed verts':>15}{'sorted KB':>11}{'indexed KB':>12}{'ratio':>8}")
+    for file in files:
+        _, sorted_buffer = ObjLoader.load_model_fast(file)
+        indexed_indices, indexed_buffer = ObjLoader.load_model_fast(file, sorted=False)
+        sorted_bytes = sorted_buffer.nbytes
+        indexed_bytes = indexed_buffer.nbytes + indexed_indices.nbytes
+        print(f"{file:<30}{len(sorted_buffer) // 8:>14}{len(indexed_buffer) // 8:>15}"
+              f"{sorted_bytes / 1024:>11.1f}{indexed_bytes / 1024:>12.1f}{sorted_bytes / indexed_bytes:>7.1f}x")
+
+
+# Cold start (parse and write the .npz cache) against warm start (memory-map the cache)
+def compare_cache(files):
+    print()
+    print(f"{'file':<30}{'cold':>12}{'warm':>12}{'speedup':>10}")
+    with tempfile.TemporaryDirectory() as folder:
+        for source in files:
+            # a copy has no cache yet, the cache is written next to it
+            file = shutil.copy(source, folder)
+            start = time.perf_counter()
+            ObjLoader.load_model_cached(file, sorted=False)
+            cold_time = time.perf_counter() - start
+            warm_time, _ = best_time(lambda f: ObjLoader.load_model_cached(f, sorted=False), file)
+            print(f"{source:<30}{cold_time * 1000:>10.2f}ms{warm_time * 1000:>10.2f}ms{cold_time / warm_time:>9.1f}x")
+
+
+# All models one after the other against ObjLoader.load_many, the pools can only win with several cores
+def compare_load_many(files):
+    print()
+    print(f'{os.cpu_count()} CPUs')
+    start = time.perf_counter()
+    serial = [ObjLoader.load_model_fast(file, sorted=False) for file in files]
+    print(f"{'serial load_model_fast':<40}{(time.perf_counter() - start) * 1000:>10.2f}ms")
+    for processes in (False, True):
+        start = time.perf_counter()
+        parallel = ObjLoader.load_many(files, sorted=False, load=ObjLoader.load_model_fast, processes=processes)
+        elapsed = time.perf_counter() - start
+        same = all(np.array_equal(a[0], b[0]) and np.array_equal(a[1], b[1]) for a, b in zip(serial, parallel))
+        name = 'load_many (processes)' if processes else 'load_many (threads)'
+        print(f"{name:<40}{elapsed * 1000:>10.2f}ms  {same}")
+
+
+def main():
+    files = sorted(glob.glob('object/*.obj'))
+    compare_loaders(files)
+    compare_memory(files)
+    compare_cache(files)
+    compare_load_many(files)
+
+
+# the process pool of load_many imports this module again in every worker with the spawn start method
+# (Windows, macOS), the benchmark must not run then
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+# Checks that the occlusion culling of the restaurant only skips what can't be seen: every frame of the camera
+# paths is rendered headless with --occlusion off, cpu and gpu, the frames with culling have to be the same
+# as the ones without. The default path stays inside the room above the tables, the low one looks along the
+# rows of tables from chair height (the first table hides the sushi on the others), the outside one looks
+# through the side wall.
+# run from the project folder: python -m benchmarks.Occlusion_Check [--frames 60]
+import re
+import sys
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+from PIL import Image
+
+SCRIPT = '23_Restaurant (Final).py'
+PATHS = ('scenes/restaurant_camera.json', 'scenes/restaurant_camera_low.json',
+         'scenes/restaurant_camera_outside.json')
+MODES = ('cpu', 'gpu')
+
+
+def render(folder, camera_path, mode, frames, backend, extra):
+    # the occluded instances of every frame, the frames go into folder
+    command = [sys.executable, SCRIPT, '--headless', backend, '--camera-path', camera_path, '--frames', str(frames),
+               '--occlusion', mode, '--output', folder] + extra
+    process = subprocess.run(command, capture_output=True, text=True)
+    if process.returncode:
+        raise RuntimeError(f'{mode} on {camera_path} failed: {process.stderr.strip()[-500:]}')
+    return [int(count) for count in re.findall(r'occluded\s+(\d+)', process.stdout)]
+
+
+def load_frame(folder, frame):
+    return np.asarray(Image.open(f'{folder}/frame_{frame:04d}.png'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='frames with and without occlusion culling have to match')
+    parser.add_argument('--frames', type=int, default=60, help='frames per camera path')
+    parser.add_argument('--backend', default='egl')
+    parser.add_argument('--stream', action='store_true', help='stream the assets and pick the LODs by distance')
+    args = parser.parse_args()
+    extra = ['--stream'] * args.stream
+
+    print(f"{'camera path':<40}{'mode':>6}{'occluded':>10}{'frames':>8}{'differ':>8}{'max pixels':>12}")
+    failed = False
+    for camera_path in PATHS:
+        with tempfile.TemporaryDirectory() as folder:
+            render(f'{folder}/off', camera_path, 'off', args.frames, args.backend, extra)
+            for mode in MODES:
+                occluded = render(f'{folder}/{mode}', camera_path, mode, args.frames, args.backend, extra)
+                pixels = [int((load_frame(f'{folder}/off', frame) != load_frame(f'{folder}/{mode}', frame))
+                              .any(axis=2).sum()) for frame in range(args.frames)]
+                differ = sum(count > 0 for count in pixels)
+                failed |= differ > 0
+                print(f'{camera_path:<40}{mode:>6}{sum(occluded):>10}{args.frames:>8}{differ:>8}{max(pixels):>12}')
+
+    print('frames differ, visible instances were culled' if failed else 'all frames match')
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
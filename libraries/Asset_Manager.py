@@ -0,0 +1,233 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from OpenGL.GL import glGenBuffers, glGenTextures, glBindBuffer, glBufferData, glBindVertexArray, \
+    GL_ARRAY_BUFFER, GL_ELEMENT_ARRAY_BUFFER, GL_STATIC_DRAW
+from libraries.OBJ_Loader import ObjLoader
+from libraries.Mesh_LOD import load_lod
+from libraries.Texture_Loader import map_baked_texture, decode_texture, upload_texture
+
+# Streams meshes and textures in the background. mesh() and texture() return a handle at once, with GL names
+# that never change, so VAOs can be set up before anything is loaded. Until the data is in, a mesh draws
+# nothing (count 0) and a texture is a 1x1 grey pixel. Loading runs on worker threads, the GL uploads
+# happen in update() on the GL thread, at most upload_budget bytes per frame.
+# With a GeometryPool the meshes get a slot in its shared buffers instead of a VBO and EBO each,
+# with a TextureArray the textures get a layer of it.
+
+PLACEHOLDER_LEVELS = [(1, 1, bytes((128, 128, 128, 255)))]
+
+MB = 1 << 20
+
+
+class Asset:
+    def __init__(self, path):
+        self.path = path
+        self.future = None  # background load in flight
+        self.data = None  # loaded CPU copy, kept (under the RAM budget) so an evicted asset comes back fast
+        self.resident = False  # uploaded to GL
+        self.nbytes = 0
+        self.priority = 0.0  # lower uploads first, e.g. the camera distance
+        self.last_used = -1  # frame of the last touch, for the LRU eviction
+
+
+class MeshAsset(Asset):
+    def __init__(self, path, lod=0, geometry=None):
+        super().__init__(path)
+        self.lod = lod  # 0 is the model itself, see Mesh_LOD
+        # either own buffers or a slot in a shared GeometryPool
+        self.geometry = geometry
+        if geometry is None:
+            self.vbo, self.ebo = glGenBuffers(2)
+        else:
+            self.slot = geometry.register()
+        self.count = 0  # index count, 0 while not resident
+        self.index_type = None  # dtype of the indices
+        self.bounds = None  # (box_min, box_max, center, radius), kept after eviction
+
+    def load(self):
+        # worker thread, no GL here
+        indices, buffer = load_lod(self.path, self.lod)
+        return indices, buffer, ObjLoader.bounding_volumes(buffer)
+
+    def measure(self):
+        indices, buffer, _ = self.data
+        return indices.nbytes + buffer.nbytes
+
+    def upload(self):
+        indices, buffer, self.bounds = self.data
+        self.count = len(indices)
+        if self.geometry is not None:
+            self.geometry.add(self.slot, indices, buffer)
+            self.index_type = np.dtype('uint32')
+            return
+        glBindVertexArray(0)  # don't change the element buffer of a VAO
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        glBufferData(GL_ARRAY_BUFFER, buffer.nbytes, buffer, GL_STATIC_DRAW)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.ebo)
+        glBufferData(GL_ELEMENT_ARRAY_BUFFER, indices.nbytes, indices, GL_STATIC_DRAW)
+        self.index_type = indices.dtype
+
+    def unload(self):
+        # keep the buffer names, just free the storage
+        self.count = 0
+        if self.geometry is not None:
+            self.geometry.remove(self.slot)
+            return
+        glBindVertexArray(0)
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        glBufferData(GL_ARRAY_BUFFER, 0, None, GL_STATIC_DRAW)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.ebo)
+        glBufferData(GL_ELEMENT_ARRAY_BUFFER, 0, None, GL_STATIC_DRAW)
+
+
+class TextureAsset(Asset):
+    def __init__(self, path, baked=True, array=None):
+        super().__init__(path)
+        self.baked = baked
+        # either an own texture or a layer of a shared TextureArray, scaled to its size
+        self.array = array
+        if array is None:
+            self.texture = glGenTextures(1)
+            upload_texture(self.texture, PLACEHOLDER_LEVELS)
+        else:
+            self.texture = array.texture
+            self.layer = array.register()
+
+    def load(self):
+        size = None if self.array is None else self.array.size
+        levels, channels, _ = map_baked_texture(self.path, size) if self.baked else decode_texture(self.path, size)
+        return levels, channels
+
+    def measure(self):
+        levels, channels = self.data
+        return sum(width * height * channels for width, height, _ in levels)
+
+    def upload(self):
+        if self.array is not None:
+            self.array.upload(self.layer, *self.data)
+        else:
+            upload_texture(self.texture, *self.data)
+
+    def unload(self):
+        if self.array is not None:
+            self.array.clear(self.layer)
+        else:
+            upload_texture(self.texture, PLACEHOLDER_LEVELS)
+
+
+class AssetManager:
+    def __init__(self, workers=2, upload_budget=4 * MB, vram_budget=256 * MB, ram_budget=512 * MB, baked=True,
+                 geometry=None, texture_array=None):
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.upload_budget = upload_budget  # bytes uploaded per update, at least one asset
+        self.vram_budget = vram_budget  # bytes of resident meshes and textures
+        self.ram_budget = ram_budget  # bytes of loaded CPU copies
+        self.baked = baked
+        self.geometry = geometry  # a GeometryPool to put all the meshes in, None for a VBO and EBO each
+        self.texture_array = texture_array  # a TextureArray with a layer per texture, None for a texture each
+        self.assets = OrderedDict()  # path (and LOD of a mesh) -> asset
+        self.frame = 0
+        # what the last update changed, e.g. to refresh culling bounds, both rebind GL buffers and textures
+        self.uploaded = []
+        self.evicted = []
+
+    def mesh(self, path, lod=0):
+        if (path, lod) not in self.assets:
+            self.assets[(path, lod)] = MeshAsset(path, lod, self.geometry)
+        return self.assets[(path, lod)]
+
+    def texture(self, path):
+        if path not in self.assets:
+            self.assets[path] = TextureAsset(path, self.baked, self.texture_array)
+        return self.assets[path]
+
+    def request(self, asset, priority=0.0):
+        # needed soon, load it in the background unless it is there already
+        asset.priority = priority
+        asset.last_used = self.frame
+        if not asset.resident and asset.data is None and asset.future is None:
+            asset.future = self.pool.submit(asset.load)
+
+    def collect(self):
+        for asset in self.assets.values():
+            if asset.future is not None and asset.future.done():
+                asset.data = asset.future.result()
+                asset.nbytes = asset.measure()
+                asset.future = None
+
+    def upload(self, budget):
+        # nearest first, stop once the budget is used up
+        # only what was requested this frame, a load that finished after the camera moved away waits in RAM
+        waiting = sorted((asset for asset in self.assets.values()
+                          if not asset.resident and asset.data is not None and asset.last_used >= self.frame),
+                         key=lambda asset: asset.priority)
+        uploaded = 0
+        for asset in waiting:
+            if budget is not None and uploaded and uploaded >= budget:
+                break
+            asset.upload()
+            asset.resident = True
+            uploaded += asset.nbytes
+            self.uploaded.append(asset)
+
+    def evict(self):
+        # least recently used first, never what was used this frame
+        lru = sorted(self.assets.values(), key=lambda asset: asset.last_used)
+        resident = sum(asset.nbytes for asset in lru if asset.resident)
+        for asset in lru:
+            if resident <= self.vram_budget or asset.last_used >= self.frame:
+                break
+            if asset.resident:
+                asset.unload()
+                asset.resident = False
+                resident -= asset.nbytes
+                self.evicted.append(asset)
+
+        in_ram = sum(asset.nbytes for asset in lru if asset.data is not None)
+        for asset in lru:
+            if in_ram <= self.ram_budget or asset.last_used >= self.frame:
+                break
+            if asset.data is not None:
+                asset.data = None
+                in_ram -= asset.nbytes
+
+    def update(self):
+        # once per frame on the GL thread
+        self.uploaded = []
+        self.evicted = []
+        self.collect()
+        self.upload(self.upload_budget)
+        self.evict()
+        self.frame += 1
+
+    def finish(self):
+        # wait for everything requested so far and upload it all, for loading before the first frame
+        self.uploaded = []
+        for asset in self.assets.values():
+            if asset.future is not None:
+                asset.future.result()
+        self.collect()
+        self.upload(None)
+
+    def busy(self):
+        # still loading something, or holding something that was requested but is not uploaded yet
+        return any(asset.future is not None or (asset.data is not None and not asset.resident
+                                                and asset.last_used >= self.frame - 1)
+                   for asset in self.assets.values())
+
+    def stats(self):
+        resident = [asset for asset in self.assets.values() if asset.resident]
+        loading = sum(asset.future is not None for asset in self.assets.values())
+        vram = sum(asset.nbytes for asset in resident) / MB
+        return f'{len(resident)}/{len(self.assets)} assets, {loading} loading, {vram:.1f} MB'
+
+    def close(self):
+        self.pool.shutdown(wait=True, cancel_futures=True)
+
+
+# the smallest distance from pos to an instance of every id, ids are the mesh_ids or texture_ids of a scene
+def nearest_distance(positions, ids, count, pos):
+    distance = np.linalg.norm(positions - np.asarray(pos, dtype='float32'), axis=1)
+    nearest = np.full(count, np.inf, dtype='float32')
+    np.minimum.at(nearest, ids, distance)
+    return nearest
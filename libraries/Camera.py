@@ -10,12 +10,39 @@ class Camera:
         self.camera_right = Vector3([1.0, 0.0, 0.0])
 
         self.mouse_sensitivity = 0.5
+        self.movement_speed = 3.0  # units per second
+        self.turn_speed = 30.0  # degrees per second for YAWL and YAWR
         self.jaw = -90
         self.pitch = 0
 
     def get_view_matrix(self):
         return matrix44.create_look_at(self.camera_pos, self.camera_pos + self.camera_front, self.camera_up)
 
+    def state(self):
+        # position and angles after an update step, see interpolated_view_matrix
+        return Vector3(self.camera_pos), self.jaw, self.pitch
+
+    def turned_state(self, previous, jaw, pitch):
+        # previous state() turned as much as the camera turned since it was at (jaw, pitch). The mouse look
+        # is applied once per frame outside the update steps, it has to move both states or alpha blends it
+        position, previous_jaw, previous_pitch = previous
+        return position, previous_jaw + self.jaw - jaw, previous_pitch + self.pitch - pitch
+
+    def interpolated_view_matrix(self, previous, alpha):
+        # the view between the previous state() (alpha 0) and now (alpha 1), alpha comes from the FrameClock
+        position, jaw, pitch = previous
+        position = position + (self.camera_pos - position) * alpha
+        front = self.front_vector(jaw + (self.jaw - jaw) * alpha, pitch + (self.pitch - pitch) * alpha)
+        return matrix44.create_look_at(position, position + front, Vector3([0.0, 1.0, 0.0]))
+
+    @staticmethod
+    def front_vector(jaw, pitch):
+        front = Vector3([0.0, 0.0, 0.0])
+        front.x = cos(radians(jaw)) * cos(radians(pitch))
+        front.y = sin(radians(pitch))
+        front.z = sin(radians(jaw)) * cos(radians(pitch))
+        return vector.normalise(front)
+
     def process_mouse_movement(self, xoffset, yoffset, constrain_pitch=True):
         xoffset *= self.mouse_sensitivity
         yoffset *= self.mouse_sensitivity
@@ -32,12 +59,7 @@ class Camera:
         self.update_camera_vectors()
 
     def update_camera_vectors(self):
-        front = Vector3([0.0, 0.0, 0.0])
-        front.x = cos(radians(self.jaw)) * cos(radians(self.pitch))
-        front.y = sin(radians(self.pitch))
-        front.z = sin(radians(self.jaw)) * cos(radians(self.pitch))
-
-        self.camera_front = vector.normalise(front)
+        self.camera_front = self.front_vector(self.jaw, self.pitch)
         self.camera_right = vector.normalise(vector3.cross(
             self.camera_front, Vector3([0.0, 1.0, 0.0])))
         self.camera_up = vector.normalise(
@@ -45,7 +67,8 @@ class Camera:
         self.camera_yaw = vector.normalise(
             vector3.cross(self.camera_front, self.camera_up))
 
-    # Camera method for the WASD movement
+    # Camera method for the WASD movement, velocity is the distance of this step (speed * dt),
+    # degrees for YAWL and YAWR
     def process_keyboard(self, direction, velocity):
         if direction == "FORWARD":
             self.camera_pos += self.camera_front * velocity
@@ -60,8 +83,8 @@ class Camera:
         if direction == "DOWN":
             self.camera_pos -= self.camera_up * velocity
         if direction == "YAWL":
-            self.jaw -= 0.5
-            self.update_camera_vectors
+            self.jaw -= velocity
+            self.update_camera_vectors()
         if direction == "YAWR":
-            self.jaw += 0.5
-            self.update_camera_vectors
+            self.jaw += velocity
+            self.update_camera_vectors()
@@ -0,0 +1,57 @@
+import numpy as np
+from OpenGL.GL import glGenBuffers, glBindBuffer, glBufferData, glBufferSubData, glBindBufferBase, \
+    glGetUniformBlockIndex, glUniformBlockBinding, GL_UNIFORM_BUFFER, GL_DYNAMIC_DRAW, GL_INVALID_INDEX
+from libraries import Transform
+
+# The per frame camera data of every shader program in one uniform buffer (std140 layout), filled from a
+# NumPy struct array with one glBufferSubData per frame and bound once to CAMERA_BINDING. A program only
+# has to point its Camera block at that binding (setup_program), after that more programs cost nothing
+# per frame. CAMERA_GLSL goes into the shaders in place of the projection and view uniforms.
+
+CAMERA_BINDING = 0
+
+CAMERA_GLSL = """
+    layout(std140) uniform Camera
+    {
+        mat4 view;
+        mat4 projection;
+        mat4 view_projection;  // projection * view
+        vec3 camera_position;  // world space
+        float time;  // seconds
+    };
+"""
+
+# the std140 offsets of the block: mat4 is 4 vec4 columns, the vec3 is 16 aligned and the float fills it up.
+# The pyrr matrices are stored as they are, uploaded with GL_FALSE they are the column major GLSL ones too
+CAMERA_BLOCK = np.dtype([('view', '<f4', (4, 4)), ('projection', '<f4', (4, 4)),
+                         ('view_projection', '<f4', (4, 4)), ('camera_position', '<f4', 3), ('time', '<f4')])
+
+
+class CameraUniforms:
+    def __init__(self, binding=CAMERA_BINDING):
+        self.binding = binding
+        self.data = np.zeros(1, dtype=CAMERA_BLOCK)
+
+        self.buffer = glGenBuffers(1)
+        glBindBuffer(GL_UNIFORM_BUFFER, self.buffer)
+        glBufferData(GL_UNIFORM_BUFFER, self.data.nbytes, self.data, GL_DYNAMIC_DRAW)
+        # the binding point keeps the buffer, binding other uniform buffers to the target doesn't change it
+        glBindBufferBase(GL_UNIFORM_BUFFER, binding, self.buffer)
+
+    def setup_program(self, program):
+        # once per program, programs without the Camera block are left alone
+        index = glGetUniformBlockIndex(program, 'Camera')
+        if index != GL_INVALID_INDEX:
+            glUniformBlockBinding(program, index, self.binding)
+
+    def update(self, view, projection, camera_position, time=0.0):
+        # once per frame, returns the view projection matrix for the culling on the CPU
+        block = self.data[0]
+        block['view'] = view
+        block['projection'] = projection
+        block['view_projection'] = Transform.view_projection(view, projection)
+        block['camera_position'] = camera_position
+        block['time'] = time
+        glBindBuffer(GL_UNIFORM_BUFFER, self.buffer)
+        glBufferSubData(GL_UNIFORM_BUFFER, 0, self.data.nbytes, self.data)
+        return block['view_projection'].copy()
@@ -0,0 +1,154 @@
+import math
+import numpy as np
+from OpenGL.GL import glGenBuffers, glGenTextures, glBindBuffer, glBufferData, glBindTexture, glTexBuffer, \
+    glActiveTexture, glGetUniformLocation, glUniform1i, glUniform2f, glUniform3f, glUseProgram, \
+    GL_TEXTURE_BUFFER, GL_TEXTURE0, GL_STREAM_DRAW, GL_RGBA32F, GL_RG32UI, GL_R32UI
+
+# Clustered forward shading for many point lights. The view frustum is split into CLUSTERS tiles on screen
+# and exponential depth slices, every frame the lights are tested against the box of every cluster with
+# NumPy and the result goes to the GPU as three buffer textures (GL 3.1, fine with "# version 330"):
+#   light_data     2 RGBA32F texels per light, view space position + radius, color + 0
+#   cluster_grid   RG32UI (first, count) per cluster, into light_indices
+#   light_indices  R32UI light numbers, the lights of cluster 0, then of cluster 1, ...
+# A fragment only loops over the lights of its own cluster, so the cost follows how many lights are near,
+# not how many there are. LIGHTING_GLSL goes into the fragment shader, see cluster_lighting().
+
+CLUSTERS = (16, 9, 24)  # x tiles, y tiles, depth slices
+
+LIGHTING_GLSL = """
+    uniform samplerBuffer light_data;
+    uniform usamplerBuffer cluster_grid;
+    uniform usamplerBuffer light_indices;
+    uniform vec2 cluster_screen;  // viewport size in pixels
+    uniform vec2 cluster_depth;  // near plane, depth slices / log(far / near)
+    uniform vec3 ambient_light;
+
+    const ivec3 CLUSTERS = ivec3(%d, %d, %d);
+
+    // diffuse light of the lights in the cluster of this fragment, position and normal in view space
+    vec3 cluster_lighting(vec3 view_position, vec3 view_normal, vec3 albedo)
+    {
+        float slice = log(max(-view_position.z, cluster_depth.x) / cluster_depth.x) * cluster_depth.y;
+        ivec3 cell = ivec3(ivec2(gl_FragCoord.xy / cluster_screen * vec2(CLUSTERS.xy)), int(slice));
+        cell = clamp(cell, ivec3(0), CLUSTERS - 1);
+        int cluster = (cell.z * CLUSTERS.y + cell.y) * CLUSTERS.x + cell.x;
+        uvec2 range = texelFetch(cluster_grid, cluster).xy;
+
+        vec3 normal = normalize(view_normal);
+        vec3 light = ambient_light;
+        for (uint i = 0u; i < range.y; i++)
+        {
+            int index = int(texelFetch(light_indices, int(range.x + i)).x);
+            vec4 position_radius = texelFetch(light_data, 2 * index);
+            vec3 to_light = position_radius.xyz - view_position;
+            float distance = length(to_light);
+            // smooth falloff that reaches 0 at the radius, past it the light is in no cluster
+            float falloff = clamp(1.0 - distance * distance / (position_radius.w * position_radius.w), 0.0, 1.0);
+            light += texelFetch(light_data, 2 * index + 1).rgb * falloff * falloff
+                     * max(dot(normal, to_light / max(distance, 1e-4)), 0.0);
+        }
+        return albedo * light;
+    }
+""" % CLUSTERS
+
+
+# view space box (center, half extent) of every cluster, in the order of the shader's cluster index
+def cluster_boxes(fov, aspect, near, far, clusters=CLUSTERS):
+    tiles_x, tiles_y, slices = clusters
+    tan_y = math.tan(math.radians(fov) / 2)
+    depth = near * (far / near) ** (np.arange(slices + 1) / slices)  # distance of the slice planes
+    ndc_x = np.linspace(-1, 1, tiles_x + 1)
+    ndc_y = np.linspace(-1, 1, tiles_y + 1)
+
+    # the tile edges at the near and the far depth of each slice, the box has to hold both
+    z, y, x = np.meshgrid(np.arange(slices), np.arange(tiles_y), np.arange(tiles_x), indexing='ij')
+    z, y, x = z.ravel(), y.ravel(), x.ravel()
+    corners_x = np.stack([ndc_x[x] * depth[z], ndc_x[x + 1] * depth[z],
+                          ndc_x[x] * depth[z + 1], ndc_x[x + 1] * depth[z + 1]]) * tan_y * aspect
+    corners_y = np.stack([ndc_y[y] * depth[z], ndc_y[y + 1] * depth[z],
+                          ndc_y[y] * depth[z + 1], ndc_y[y + 1] * depth[z + 1]]) * tan_y
+    box_min = np.column_stack((corners_x.min(axis=0), corners_y.min(axis=0), -depth[z + 1]))
+    box_max = np.column_stack((corners_x.max(axis=0), corners_y.max(axis=0), -depth[z]))
+    return ((box_min + box_max) / 2).astype('float32'), ((box_max - box_min) / 2).astype('float32')
+
+
+# which lights touch which cluster: (first, count) per cluster and the light numbers they point to
+def assign_lights(box_center, box_extent, light_positions, light_radii, clusters=CLUSTERS):
+    # squared distance from each light to each box, per axis only the part outside the box counts.
+    # x of a box only depends on its tile column and slice, y on its row and slice, z on its slice,
+    # so each axis is done on its own and the three are added up on the whole grid
+    tiles_x, tiles_y, slices = clusters
+    center = box_center.reshape(slices, tiles_y, tiles_x, 3)
+    extent = box_extent.reshape(slices, tiles_y, tiles_x, 3)
+    squared = []
+    for axis, grid_index in ((0, np.s_[:, :1, :, None]), (1, np.s_[:, :, :1, None]), (2, np.s_[:, :1, :1, None])):
+        outside = np.maximum(np.abs(light_positions[:, axis] - center[..., axis][grid_index])
+                             - extent[..., axis][grid_index], 0)
+        squared.append(outside * outside)
+    touches = (squared[0] + squared[1] + squared[2] <= light_radii * light_radii).reshape(-1, len(light_radii))
+
+    cluster, lights = np.nonzero(touches)  # sorted by cluster
+    counts = np.bincount(cluster, minlength=len(box_center))
+    grid = np.column_stack((np.cumsum(counts) - counts, counts)).astype('uint32')
+    return grid, lights.astype('uint32')
+
+
+class ClusteredLights:
+    def __init__(self, positions, colors, radii, ambient=(0.15, 0.15, 0.15), first_unit=1):
+        # world space lights, colors can go above 1 for bright ones
+        self.positions = np.asarray(positions, dtype='float32').reshape(-1, 3)
+        self.colors = np.asarray(colors, dtype='float32').reshape(-1, 3)
+        self.radii = np.asarray(radii, dtype='float32').ravel()
+        self.ambient = ambient
+        self.first_unit = first_unit  # texture units first_unit .. first_unit + 2, unit 0 stays for the model
+        self.box_center = self.box_extent = None
+        self.screen = self.depth = None
+
+        self.buffers = glGenBuffers(3)
+        self.textures = glGenTextures(3)
+        for buffer, texture, texture_format in zip(self.buffers, self.textures, (GL_RGBA32F, GL_RG32UI, GL_R32UI)):
+            glBindBuffer(GL_TEXTURE_BUFFER, buffer)
+            glBufferData(GL_TEXTURE_BUFFER, 16, None, GL_STREAM_DRAW)
+            glBindTexture(GL_TEXTURE_BUFFER, texture)
+            glTexBuffer(GL_TEXTURE_BUFFER, texture_format, buffer)
+
+    def set_projection(self, fov, aspect, near, far, width, height):
+        # again after every resize, same values as create_perspective_projection
+        self.box_center, self.box_extent = cluster_boxes(fov, aspect, near, far)
+        self.screen = (width, height)
+        self.depth = (near, CLUSTERS[2] / math.log(far / near))
+
+    def setup_program(self, program):
+        # sampler units and the frustum of the clusters, the program is left in use
+        glUseProgram(program)
+        for offset, name in enumerate(('light_data', 'cluster_grid', 'light_indices')):
+            glUniform1i(glGetUniformLocation(program, name), self.first_unit + offset)
+        glUniform2f(glGetUniformLocation(program, 'cluster_screen'), *self.screen)
+        glUniform2f(glGetUniformLocation(program, 'cluster_depth'), *self.depth)
+        glUniform3f(glGetUniformLocation(program, 'ambient_light'), *self.ambient)
+
+    def bind(self):
+        # the buffer textures to their units, they stay there, other units are not touched
+        for offset, texture in enumerate(self.textures):
+            glActiveTexture(GL_TEXTURE0 + self.first_unit + offset)
+            glBindTexture(GL_TEXTURE_BUFFER, texture)
+        glActiveTexture(GL_TEXTURE0)
+
+    def upload(self, index, data):
+        glBindBuffer(GL_TEXTURE_BUFFER, self.buffers[index])
+        # a new store every time, the GPU may still read the last one
+        glBufferData(GL_TEXTURE_BUFFER, max(data.nbytes, 16), data if data.nbytes else None, GL_STREAM_DRAW)
+
+    def update(self, view):
+        # once per frame with the pyrr view matrix (row vectors), the lights go to view space
+        view = np.asarray(view, dtype='float32')
+        view_positions = self.positions @ view[:3, :3] + view[3, :3]
+        grid, indices = assign_lights(self.box_center, self.box_extent, view_positions, self.radii)
+
+        light_data = np.zeros((len(self.positions), 2, 4), dtype='float32')
+        light_data[:, 0, :3] = view_positions
+        light_data[:, 0, 3] = self.radii
+        light_data[:, 1, :3] = self.colors
+        self.upload(0, light_data)
+        self.upload(1, grid)
+        self.upload(2, indices)
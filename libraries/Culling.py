@@ -0,0 +1,60 @@
+import numpy as np
+
+
+# Matrices are in the pyrr layout used everywhere else: row vectors, clip = [x, y, z, 1] @ model @ view_projection.
+
+
+# the six planes (a, b, c, d) of the view frustum, a point is inside when a*x + b*y + c*z + d >= 0 for all of them
+def frustum_planes(view_projection):
+    m = np.asarray(view_projection, dtype='float32')
+    planes = np.array([m[:, 3] + m[:, 0],   # left
+                       m[:, 3] - m[:, 0],   # right
+                       m[:, 3] + m[:, 1],   # bottom
+                       m[:, 3] - m[:, 1],   # top
+                       m[:, 3] + m[:, 2],   # near
+                       m[:, 3] - m[:, 2]])  # far
+    return planes / np.linalg.norm(planes[:, :3], axis=1, keepdims=True)
+
+
+# world space boxes (center, half extents) of local boxes moved by (N, 4, 4) transforms
+def world_boxes(transforms, box_min, box_max):
+    center = (box_min + box_max) / 2
+    extent = (box_max - box_min) / 2
+    world_center = np.einsum('ni,nij->nj', center, transforms[:, :3, :3]) + transforms[:, 3, :3]
+    world_extent = np.einsum('ni,nij->nj', extent, np.abs(transforms[:, :3, :3]))
+    return world_center, world_extent
+
+
+# world space spheres, the radius grows with the largest scale of the transform
+def world_spheres(transforms, center, radius):
+    world_center = np.einsum('ni,nij->nj', center, transforms[:, :3, :3]) + transforms[:, 3, :3]
+    scale = np.linalg.norm(transforms[:, :3, :3], axis=2).max(axis=1)
+    return world_center, radius * scale
+
+
+# test every instance against the six planes at once, sphere first and then the tighter box
+def visible_instances(planes, box_center, box_extent, sphere_center, sphere_radius):
+    sphere_distance = sphere_center @ planes[:, :3].T + planes[:, 3]
+    visible = (sphere_distance >= -sphere_radius[:, None]).all(axis=1)
+    box_distance = box_center @ planes[:, :3].T + planes[:, 3]
+    box_radius = box_extent @ np.abs(planes[:, :3]).T
+    return visible & (box_distance >= -box_radius).all(axis=1)
+
+
+# reorder the visible instances by batch and LOD: every batch gets `levels` regions of its own size in the
+# instance buffer, one per LOD, so a VAO per (batch, LOD) can point at a fixed offset.
+# returns the visible instances, their slot in that buffer and the (batches, levels) count of every region
+def compact_lod_batches(batches, visible, lods, levels):
+    counts = np.array([count for _, _, _, count in batches], dtype='int64')
+    batch_index = np.repeat(np.arange(len(batches)), counts)
+    firsts = np.repeat([first for _, _, first, _ in batches], counts)
+    sizes = np.repeat(counts, counts)
+
+    shown = np.flatnonzero(visible)
+    order = shown[np.lexsort((lods[shown], batch_index[shown]))]
+    group = batch_index[order] * levels + lods[order]
+    rank = np.arange(len(order)) - np.searchsorted(group, group)
+
+    slots = firsts[order] * levels + lods[order] * sizes[order] + rank
+    region_counts = np.bincount(group, minlength=len(batches) * levels).reshape(len(batches), levels)
+    return order, slots, region_counts
@@ -0,0 +1,65 @@
+import time
+
+# Frame timing for the main loops. The simulation (camera movement) runs in fixed steps of 1 / update_rate
+# seconds however fast the frames are, so the speed doesn't depend on the frame rate, and the frame renders
+# in between two steps with alpha. A frame cap sleeps away the rest of the frame instead of spinning at
+# 100% CPU, with vsync the swap does that and the cap can be off.
+
+clock = time.perf_counter  # the frame benchmark swaps in its fake clock
+sleep = time.sleep
+
+SPIN = 0.001  # the last part of a wait is spun, sleep can oversleep by about a millisecond
+
+
+class FrameClock:
+    def __init__(self, update_rate=120, fps_cap=60, max_frame_time=0.25):
+        self.step = 1 / update_rate  # seconds per update step, pass it as dt
+        self.frame_time = 1 / fps_cap if fps_cap else 0
+        # after a hitch (loading, dragging the window) don't run hundreds of steps to catch up
+        self.max_frame_time = max_frame_time
+        self.last = clock()
+        self.next_frame = self.last
+        self.accumulator = 0.0
+        self.alpha = 0.0  # how far the frame is between the last two update steps, 0 to 1
+        self.dt = 0.0  # real seconds of the last frame
+        self.fps = 0.0  # frames per second over the last half second, for a caption
+        self.fps_frames = 0
+        self.fps_start = self.last
+
+    def steps(self):
+        # once per frame, the number of update steps to run
+        now = clock()
+        self.dt = min(now - self.last, self.max_frame_time)
+        self.last = now
+        self.fps_frames += 1
+        if now - self.fps_start >= 0.5:
+            self.fps = self.fps_frames / (now - self.fps_start)
+            self.fps_frames, self.fps_start = 0, now
+        self.accumulator += self.dt
+        steps = int(self.accumulator / self.step)
+        self.accumulator -= steps * self.step
+        self.alpha = self.accumulator / self.step
+        return steps
+
+    def idle(self):
+        # in place of wait() for a frame that was skipped because nothing changed. Nothing is swapped then,
+        # so with the cap off the vsync doesn't block either, sleep until the next update step is due
+        if self.frame_time:
+            self.wait()
+        else:
+            sleep(self.step - self.accumulator)
+
+    def wait(self):
+        # after the swap, sleep until the next frame is due
+        if not self.frame_time:
+            return
+        self.next_frame += self.frame_time
+        remaining = self.next_frame - clock()
+        if remaining <= 0:
+            # late, start again from now instead of rushing the next frames
+            self.next_frame = max(self.next_frame, clock() - self.frame_time)
+            return
+        if remaining > SPIN:
+            sleep(remaining - SPIN)
+        while clock() < self.next_frame:
+            pass
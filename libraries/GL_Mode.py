@@ -0,0 +1,25 @@
+import numpy as np
+
+# PyOpenGL defaults are for development: glGetError after every call, call logging and
+# silent copies of arrays that are not already the right type and layout.
+# setup_mode has to run before anything imports OpenGL.GL, the flags are read on first import.
+
+MODES = ('debug', 'release')
+
+
+def setup_mode(mode, error_on_copy=False):
+    import OpenGL
+
+    if mode not in MODES:
+        raise ValueError(f'unknown GL mode {mode!r}, use one of {MODES}')
+    if mode == 'release':
+        OpenGL.ERROR_CHECKING = False
+        OpenGL.ERROR_LOGGING = False
+        OpenGL.ARRAY_SIZE_CHECKING = False
+        # raise instead of copying, to find the arrays that still get converted on every call
+        OpenGL.ERROR_ON_COPY = error_on_copy
+
+
+def gl_array(data, dtype='float32'):
+    # contiguous and already the GL type, so PyOpenGL can pass the pointer without a copy
+    return np.ascontiguousarray(data, dtype=dtype)
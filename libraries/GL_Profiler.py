@@ -0,0 +1,123 @@
+import csv
+import time
+import ctypes
+from collections import Counter, deque
+import numpy as np
+from OpenGL.GL import glGenQueries, glDeleteQueries, glBeginQuery, glEndQuery, glGetQueryObjectiv, \
+    GL_TIME_ELAPSED, GL_QUERY_RESULT, GL_QUERY_RESULT_AVAILABLE
+from OpenGL.raw.GL.VERSION.GL_3_3 import glGetQueryObjectui64v
+
+# Counts and times the GL calls of every frame. install() swaps the entry points in a script or module
+# namespace for timed wrappers, the scripts got them with "from OpenGL.GL import *" so patching
+# OpenGL.GL itself would be too late.
+
+TRACED = ('glDrawArrays', 'glDrawElements', 'glDrawArraysInstanced', 'glDrawElementsInstanced',
+          'glDrawElementsInstancedBaseVertex', 'glMultiDrawElementsIndirect',
+          'glUniformMatrix4fv', 'glUniform1i', 'glUniform3fv', 'glBindTexture', 'glBindVertexArray',
+          'glBindBuffer', 'glBufferData', 'glBufferSubData', 'glUseProgram', 'glClear', 'glViewport')
+
+QUERIES = 3  # GPU timer queries in flight, the result of frame n is read in frame n + 2
+
+
+class GLProfiler:
+    def __init__(self, names=TRACED, gpu_timer=False, csv_path=None, history=120):
+        self.names = names
+        self.calls = Counter()  # calls of the current frame
+        self.gl_seconds = 0.0  # time spent inside the traced calls this frame
+        self.frame = 0
+        self.frame_start = None
+        self.installed = []  # (namespace, name, original)
+
+        # last frames for the overlay, (frame, cpu_ms, gl_ms, gpu_ms, calls)
+        self.history = deque(maxlen=history)
+        self.totals = Counter()
+
+        self.queries = np.atleast_1d(glGenQueries(QUERIES)) if gpu_timer else None
+        self.gpu_ms = None  # latest finished GPU frame
+        self.first_query = True
+
+        self.csv_file = None
+        if csv_path:
+            self.csv_file = open(csv_path, 'w', newline='')
+            self.csv = csv.writer(self.csv_file)
+            self.csv.writerow(['frame', 'cpu_ms', 'gl_ms', 'gpu_ms', 'calls'] + list(names))
+
+    def wrap(self, name, function):
+        def call(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.gl_seconds += time.perf_counter() - start
+                self.calls[name] += 1
+        call.__name__ = name
+        call.__wrapped__ = function
+        return call
+
+    def install(self, *namespaces):
+        # modules or globals() dicts, only the traced names that are there get wrapped
+        for namespace in namespaces:
+            namespace = namespace if isinstance(namespace, dict) else vars(namespace)
+            for name in self.names:
+                # skip what is wrapped already, the render queue and the script may share a namespace
+                if name in namespace and not hasattr(namespace[name], '__wrapped__'):
+                    self.installed.append((namespace, name, namespace[name]))
+                    namespace[name] = self.wrap(name, namespace[name])
+
+    def uninstall(self):
+        for namespace, name, original in reversed(self.installed):
+            namespace[name] = original
+        self.installed = []
+
+    def begin_frame(self):
+        self.frame_start = time.perf_counter()
+        self.gl_seconds = 0.0
+        self.calls.clear()
+        if self.queries is not None:
+            glBeginQuery(GL_TIME_ELAPSED, self.queries[self.frame % QUERIES])
+
+    def read_query(self, query):
+        # never wait for the GPU, an unfinished query just leaves the last value
+        if not glGetQueryObjectiv(query, GL_QUERY_RESULT_AVAILABLE):
+            return
+        result = ctypes.c_uint64()
+        glGetQueryObjectui64v(int(query), GL_QUERY_RESULT, ctypes.byref(result))
+        if self.first_query:
+            self.first_query = False  # llvmpipe gives garbage for the very first one
+            return
+        self.gpu_ms = result.value / 1e6
+
+    def end_frame(self):
+        cpu_ms = (time.perf_counter() - self.frame_start) * 1000
+        if self.queries is not None:
+            glEndQuery(GL_TIME_ELAPSED)
+            if self.frame >= QUERIES - 1:
+                self.read_query(self.queries[(self.frame + 1) % QUERIES])
+
+        calls = sum(self.calls.values())
+        self.history.append((self.frame, cpu_ms, self.gl_seconds * 1000, self.gpu_ms, calls))
+        self.totals.update(self.calls)
+        if self.csv_file:
+            self.csv.writerow([self.frame, f'{cpu_ms:.3f}', f'{self.gl_seconds * 1000:.3f}',
+                               '' if self.gpu_ms is None else f'{self.gpu_ms:.3f}', calls]
+                              + [self.calls[name] for name in self.names])
+            self.csv_file.flush()
+        self.frame += 1
+
+    def summary(self):
+        # one line for the window caption, averaged over the history
+        if not self.history:
+            return ''
+        frames = np.array([row[1:3] + (row[4],) for row in self.history], dtype='float64')
+        cpu_ms, gl_ms, calls = frames.mean(axis=0)
+        text = f'cpu {cpu_ms:.2f} ms  gl {gl_ms:.2f} ms  {calls:.0f} calls'
+        if self.gpu_ms is not None:
+            text += f'  gpu {self.gpu_ms:.2f} ms'
+        return text
+
+    def close(self):
+        self.uninstall()
+        if self.queries is not None:
+            glDeleteQueries(len(self.queries), self.queries)
+        if self.csv_file:
+            self.csv_file.close()
@@ -0,0 +1,222 @@
+import ctypes
+import numpy as np
+from OpenGL.GL import glGenBuffers, glDeleteBuffers, glGenVertexArrays, glBindVertexArray, glBindBuffer, \
+    glBufferData, glBufferSubData, glCopyBufferSubData, glEnableVertexAttribArray, glVertexAttribPointer, \
+    glVertexAttribDivisor, glGetIntegerv, glDrawElementsInstancedBaseVertex, \
+    GL_ARRAY_BUFFER, GL_ELEMENT_ARRAY_BUFFER, GL_COPY_READ_BUFFER, GL_COPY_WRITE_BUFFER, GL_DRAW_INDIRECT_BUFFER, \
+    GL_STATIC_DRAW, GL_STREAM_DRAW, GL_FLOAT, GL_FALSE, GL_TRIANGLES, GL_UNSIGNED_INT, \
+    GL_MAJOR_VERSION, GL_MINOR_VERSION
+from OpenGL.raw.GL.VERSION.GL_4_3 import glMultiDrawElementsIndirect
+
+# Every mesh in one interleaved VBO and one uint32 EBO behind a single VAO. A mesh is a slot with an index
+# range and a base vertex, so the indices stay as they were loaded. A frame is a NumPy array of indirect
+# commands drawn with glMultiDrawElementsIndirect (GL 4.3), the per instance matrices come from
+# base_instance. Without 4.3 every command is a glDrawElementsInstancedBaseVertex with the instance
+# attributes moved to the command's first instance.
+
+# DrawElementsIndirectCommand of the GL spec
+DRAW_COMMAND = np.dtype([('count', '<u4'), ('instance_count', '<u4'), ('first_index', '<u4'),
+                         ('base_vertex', '<i4'), ('base_instance', '<u4')])
+
+# the (index count, first index, base vertex, vertex count) of every slot, count 0 while not in the pool
+SLOT = np.dtype([('count', '<u4'), ('first_index', '<u4'), ('base_vertex', '<i4'), ('vertex_count', '<u4')])
+
+VERTEX_SIZE = 8 * 4  # x, y, z, u, v, nx, ny, nz as float32
+INDEX_SIZE = 4
+INSTANCE_SIZE = 16 * 4  # one mat4
+
+
+class RangeAllocator:
+    # first fit over a list of free (offset, size) ranges, neighbours merge again when released
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.free = [(0, capacity)]
+
+    def allocate(self, size):
+        for i, (offset, free_size) in enumerate(self.free):
+            if free_size >= size:
+                if free_size == size:
+                    del self.free[i]
+                else:
+                    self.free[i] = (offset + size, free_size - size)
+                return offset
+        return None
+
+    def release(self, offset, size):
+        self.free.append((offset, size))
+        self.free.sort()
+        merged = [self.free[0]]
+        for offset, size in self.free[1:]:
+            last_offset, last_size = merged[-1]
+            if last_offset + last_size == offset:
+                merged[-1] = (last_offset, last_size + size)
+            else:
+                merged.append((offset, size))
+        self.free = merged
+
+    def grow(self, capacity):
+        self.release(self.capacity, capacity - self.capacity)
+        self.capacity = capacity
+
+
+class GeometryPool:
+    def __init__(self, vertex_capacity=1 << 16, index_capacity=1 << 18, multi_draw_indirect=None):
+        self.vertices = RangeAllocator(vertex_capacity)
+        self.indices = RangeAllocator(index_capacity)
+        self.vbo = self.create_buffer(GL_ARRAY_BUFFER, vertex_capacity * VERTEX_SIZE)
+        self.ebo = self.create_buffer(GL_ELEMENT_ARRAY_BUFFER, index_capacity * INDEX_SIZE)
+        self.slots = np.zeros(0, dtype=SLOT)
+
+        self.vao = glGenVertexArrays(1)
+        self.instance_vbo = None
+        self.instance_location = None
+        self.instance_attributes = []  # more per instance floats, (location, buffer, size)
+        self.bind_attributes()
+
+        if multi_draw_indirect is None:
+            version = (glGetIntegerv(GL_MAJOR_VERSION), glGetIntegerv(GL_MINOR_VERSION))
+            multi_draw_indirect = version >= (4, 3) and bool(glMultiDrawElementsIndirect)
+        self.multi_draw_indirect = multi_draw_indirect
+        self.indirect_buffer = glGenBuffers(1) if multi_draw_indirect else None
+        self.commands = np.zeros(0, dtype=DRAW_COMMAND)
+
+    @staticmethod
+    def create_buffer(target, nbytes):
+        buffer = glGenBuffers(1)
+        glBindVertexArray(0)  # don't change the element buffer of a VAO
+        glBindBuffer(target, buffer)
+        glBufferData(target, nbytes, None, GL_STATIC_DRAW)
+        return buffer
+
+    def bind_attributes(self):
+        glBindVertexArray(self.vao)
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.ebo)
+        for location, size, offset in ((0, 3, 0), (1, 2, 12), (2, 3, 20)):
+            glEnableVertexAttribArray(location)
+            glVertexAttribPointer(location, size, GL_FLOAT, GL_FALSE, VERTEX_SIZE, ctypes.c_void_p(offset))
+        if self.instance_vbo is not None:
+            self.bind_instances(0)
+        glBindVertexArray(0)
+
+    def bind_instances(self, first_instance):
+        # model matrix columns, 1 means every instance has its own
+        glBindBuffer(GL_ARRAY_BUFFER, self.instance_vbo)
+        for column in range(4):
+            location = self.instance_location + column
+            glEnableVertexAttribArray(location)
+            glVertexAttribPointer(location, 4, GL_FLOAT, GL_FALSE, INSTANCE_SIZE,
+                                  ctypes.c_void_p(first_instance * INSTANCE_SIZE + column * 16))
+            glVertexAttribDivisor(location, 1)
+        for location, buffer, size in self.instance_attributes:
+            glBindBuffer(GL_ARRAY_BUFFER, buffer)
+            glEnableVertexAttribArray(location)
+            glVertexAttribPointer(location, size, GL_FLOAT, GL_FALSE, size * 4,
+                                  ctypes.c_void_p(first_instance * size * 4))
+            glVertexAttribDivisor(location, 1)
+
+    def set_instance_buffer(self, instance_vbo, location=3):
+        # the mat4 per instance at location, location + 1, ... location + 3
+        self.instance_vbo = instance_vbo
+        self.instance_location = location
+        self.bind_attributes()
+
+    def add_instance_attribute(self, location, buffer, size=1):
+        # a tightly packed float vector per instance in its own buffer, in the same order as the matrices
+        self.instance_attributes.append((location, buffer, size))
+        self.bind_attributes()
+
+    def register(self):
+        # a new empty slot, its number never changes
+        self.slots = np.append(self.slots, np.zeros(1, dtype=SLOT))
+        return len(self.slots) - 1
+
+    def grow(self, target, buffer, allocator, size, item_size):
+        # a bigger buffer with the old contents copied on the GPU
+        capacity = allocator.capacity
+        while capacity < allocator.capacity + size:
+            capacity *= 2
+        new_buffer = self.create_buffer(target, capacity * item_size)
+        glBindBuffer(GL_COPY_READ_BUFFER, buffer)
+        glBindBuffer(GL_COPY_WRITE_BUFFER, new_buffer)
+        glCopyBufferSubData(GL_COPY_READ_BUFFER, GL_COPY_WRITE_BUFFER, 0, 0, allocator.capacity * item_size)
+        glDeleteBuffers(1, [buffer])
+        allocator.grow(capacity)
+        return new_buffer
+
+    def allocate(self, vertex_count, index_count):
+        base_vertex = self.vertices.allocate(vertex_count)
+        if base_vertex is None:
+            self.vbo = self.grow(GL_ARRAY_BUFFER, self.vbo, self.vertices, vertex_count, VERTEX_SIZE)
+            base_vertex = self.vertices.allocate(vertex_count)
+        first_index = self.indices.allocate(index_count)
+        if first_index is None:
+            self.ebo = self.grow(GL_ELEMENT_ARRAY_BUFFER, self.ebo, self.indices, index_count, INDEX_SIZE)
+            first_index = self.indices.allocate(index_count)
+        self.bind_attributes()  # the buffers may be new
+        return base_vertex, first_index
+
+    def add(self, slot, indices, buffer):
+        # upload a mesh into the pool, indices stay relative to its first vertex
+        if self.slots[slot]['count']:
+            self.remove(slot)
+        buffer = np.ascontiguousarray(buffer, dtype='float32')
+        indices = np.ascontiguousarray(indices, dtype='uint32')
+        vertex_count = len(buffer) * 4 // VERTEX_SIZE
+        base_vertex, first_index = self.allocate(vertex_count, len(indices))
+
+        glBindVertexArray(0)
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        glBufferSubData(GL_ARRAY_BUFFER, base_vertex * VERTEX_SIZE, buffer.nbytes, buffer)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.ebo)
+        glBufferSubData(GL_ELEMENT_ARRAY_BUFFER, first_index * INDEX_SIZE, indices.nbytes, indices)
+        self.slots[slot] = (len(indices), first_index, base_vertex, vertex_count)
+
+    def remove(self, slot):
+        count, first_index, base_vertex, vertex_count = self.slots[slot].tolist()
+        if count:
+            self.vertices.release(base_vertex, vertex_count)
+            self.indices.release(first_index, count)
+        self.slots[slot] = (0, 0, 0, 0)
+
+    def build_commands(self, slots, instance_counts, base_instances):
+        # one command for every slot that is in the pool and has instances to draw
+        slots = np.asarray(slots).ravel()
+        instance_counts = np.asarray(instance_counts).ravel()
+        base_instances = np.asarray(base_instances).ravel()
+        meshes = self.slots[slots]
+        keep = (meshes['count'] > 0) & (instance_counts > 0)
+
+        commands = np.zeros(int(keep.sum()), dtype=DRAW_COMMAND)
+        commands['count'] = meshes['count'][keep]
+        commands['instance_count'] = instance_counts[keep]
+        commands['first_index'] = meshes['first_index'][keep]
+        commands['base_vertex'] = meshes['base_vertex'][keep]
+        commands['base_instance'] = base_instances[keep]
+        return commands, keep
+
+    def upload_commands(self, commands):
+        # once per frame, draw() then picks ranges out of it, unchanged commands are not uploaded again
+        if np.array_equal(commands, self.commands):
+            return
+        self.commands = commands
+        if self.multi_draw_indirect and len(commands):
+            glBindBuffer(GL_DRAW_INDIRECT_BUFFER, self.indirect_buffer)
+            glBufferData(GL_DRAW_INDIRECT_BUFFER, commands.nbytes, commands, GL_STREAM_DRAW)
+
+    def draw(self, first=0, count=None):
+        # the pool VAO has to be bound
+        count = len(self.commands) - first if count is None else count
+        if not count:
+            return
+        if self.multi_draw_indirect:
+            glBindBuffer(GL_DRAW_INDIRECT_BUFFER, self.indirect_buffer)
+            glMultiDrawElementsIndirect(GL_TRIANGLES, GL_UNSIGNED_INT,
+                                        ctypes.c_void_p(first * DRAW_COMMAND.itemsize), count, 0)
+            return
+        for command in self.commands[first:first + count].tolist():
+            index_count, instance_count, first_index, base_vertex, base_instance = command
+            self.bind_instances(base_instance)
+            glDrawElementsInstancedBaseVertex(GL_TRIANGLES, index_count, GL_UNSIGNED_INT,
+                                              ctypes.c_void_p(first_index * INDEX_SIZE), instance_count,
+                                              base_vertex)
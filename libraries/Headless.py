@@ -0,0 +1,151 @@
+import os
+import json
+import ctypes
+import numpy as np
+
+# Offscreen OpenGL without a window, for servers without a GPU or a display (Mesa llvmpipe).
+# setup_platform has to run before anything imports OpenGL.GL, PyOpenGL picks its platform on first import.
+
+BACKENDS = ('egl', 'osmesa')
+
+
+def setup_platform(backend):
+    if backend not in BACKENDS:
+        raise ValueError(f'unknown headless backend {backend!r}, use one of {BACKENDS}')
+    os.environ['PYOPENGL_PLATFORM'] = backend
+    if backend == 'egl':
+        # no X or Wayland server, let Mesa pick a surfaceless display
+        os.environ.setdefault('EGL_PLATFORM', 'surfaceless')
+        # PyOpenGL can't build the EGL bindings once OpenGL.ERROR_CHECKING is off (GL_Mode release),
+        # load them now, this doesn't import OpenGL.GL yet
+        import OpenGL.EGL  # noqa: F401
+
+
+class HeadlessContext:
+    # profile 'core' gives the 3.3 core profile the shaders are written for,
+    # 'compatibility' also runs the fixed function demos (glVertexPointer, glRotatef, ...)
+    def __init__(self, width, height, backend='egl', profile='core'):
+        self.width = width
+        self.height = height
+        self.backend = backend
+        self.profile = profile
+        if backend == 'egl':
+            self.create_egl_context()
+        else:
+            self.create_osmesa_context()
+        self.create_framebuffer()
+
+    def create_egl_context(self):
+        from OpenGL import EGL
+
+        self.display = EGL.eglGetDisplay(EGL.EGL_DEFAULT_DISPLAY)
+        major, minor = EGL.EGLint(), EGL.EGLint()
+        if not EGL.eglInitialize(self.display, ctypes.pointer(major), ctypes.pointer(minor)):
+            raise RuntimeError('EGL can not be initialized!')
+
+        config_attribs = [EGL.EGL_SURFACE_TYPE, EGL.EGL_PBUFFER_BIT,
+                          EGL.EGL_RENDERABLE_TYPE, EGL.EGL_OPENGL_BIT,
+                          EGL.EGL_NONE]
+        config = EGL.EGLConfig()
+        count = EGL.EGLint()
+        EGL.eglChooseConfig(self.display, (EGL.EGLint * len(config_attribs))(*config_attribs),
+                            ctypes.pointer(config), 1, ctypes.pointer(count))
+        if count.value < 1:
+            raise RuntimeError('no EGL config for desktop OpenGL')
+
+        EGL.eglBindAPI(EGL.EGL_OPENGL_API)
+        if self.profile == 'core':
+            context_attribs = [EGL.EGL_CONTEXT_MAJOR_VERSION, 3,
+                               EGL.EGL_CONTEXT_MINOR_VERSION, 3,
+                               EGL.EGL_CONTEXT_OPENGL_PROFILE_MASK, EGL.EGL_CONTEXT_OPENGL_CORE_PROFILE_BIT,
+                               EGL.EGL_NONE]
+        else:
+            context_attribs = [EGL.EGL_CONTEXT_OPENGL_PROFILE_MASK, EGL.EGL_CONTEXT_OPENGL_COMPATIBILITY_PROFILE_BIT,
+                               EGL.EGL_NONE]
+        self.context = EGL.eglCreateContext(self.display, config, EGL.EGL_NO_CONTEXT,
+                                            (EGL.EGLint * len(context_attribs))(*context_attribs))
+        if not self.context:
+            raise RuntimeError('EGL context can not be created!')
+        # surfaceless, everything is drawn into our own framebuffer object
+        EGL.eglMakeCurrent(self.display, EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE, self.context)
+
+    def create_osmesa_context(self):
+        from OpenGL import osmesa, arrays
+        from OpenGL.GL import GL_UNSIGNED_BYTE
+
+        attribs = [osmesa.OSMESA_FORMAT, osmesa.OSMESA_RGBA,
+                   osmesa.OSMESA_DEPTH_BITS, 24]
+        if self.profile == 'core':
+            attribs += [osmesa.OSMESA_PROFILE, osmesa.OSMESA_CORE_PROFILE,
+                        osmesa.OSMESA_CONTEXT_MAJOR_VERSION, 3,
+                        osmesa.OSMESA_CONTEXT_MINOR_VERSION, 3]
+        else:
+            attribs += [osmesa.OSMESA_PROFILE, osmesa.OSMESA_COMPAT_PROFILE]
+        attribs.append(0)
+        self.context = osmesa.OSMesaCreateContextAttribs(arrays.GLintArray.asArray(attribs), None)
+        if not self.context:
+            raise RuntimeError('OSMesa context can not be created!')
+        # OSMesa wants a buffer of its own even though we draw into the framebuffer object
+        self.osmesa_buffer = arrays.GLubyteArray.zeros((self.height, self.width, 4))
+        osmesa.OSMesaMakeCurrent(self.context, self.osmesa_buffer, GL_UNSIGNED_BYTE, self.width, self.height)
+
+    def create_framebuffer(self):
+        from OpenGL.GL import glGenFramebuffers, glBindFramebuffer, glGenRenderbuffers, glBindRenderbuffer, \
+            glRenderbufferStorage, glFramebufferRenderbuffer, glCheckFramebufferStatus, glViewport, \
+            GL_FRAMEBUFFER, GL_RENDERBUFFER, GL_RGBA8, GL_DEPTH_COMPONENT24, GL_COLOR_ATTACHMENT0, \
+            GL_DEPTH_ATTACHMENT, GL_FRAMEBUFFER_COMPLETE
+
+        self.fbo = glGenFramebuffers(1)
+        glBindFramebuffer(GL_FRAMEBUFFER, self.fbo)
+        self.color, self.depth = glGenRenderbuffers(2)
+        glBindRenderbuffer(GL_RENDERBUFFER, self.color)
+        glRenderbufferStorage(GL_RENDERBUFFER, GL_RGBA8, self.width, self.height)
+        glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_RENDERBUFFER, self.color)
+        glBindRenderbuffer(GL_RENDERBUFFER, self.depth)
+        glRenderbufferStorage(GL_RENDERBUFFER, GL_DEPTH_COMPONENT24, self.width, self.height)
+        glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_DEPTH_ATTACHMENT, GL_RENDERBUFFER, self.depth)
+        if glCheckFramebufferStatus(GL_FRAMEBUFFER) != GL_FRAMEBUFFER_COMPLETE:
+            raise RuntimeError('offscreen framebuffer is not complete')
+        glViewport(0, 0, self.width, self.height)
+
+    def read_pixels(self):
+        # the rendered frame as a (height, width, 4) uint8 array, top row first
+        from OpenGL.GL import glReadPixels, glPixelStorei, GL_PACK_ALIGNMENT, GL_RGBA, GL_UNSIGNED_BYTE
+
+        glPixelStorei(GL_PACK_ALIGNMENT, 1)
+        data = glReadPixels(0, 0, self.width, self.height, GL_RGBA, GL_UNSIGNED_BYTE)
+        return np.frombuffer(data, dtype='uint8').reshape(self.height, self.width, 4)[::-1]
+
+    def save_frame(self, path):
+        from PIL import Image
+
+        # RGB like the window shows it, the alpha left by the clear color would make the background transparent
+        Image.fromarray(np.ascontiguousarray(self.read_pixels()[:, :, :3]), 'RGB').save(path)
+
+    def destroy(self):
+        if self.backend == 'egl':
+            from OpenGL import EGL
+
+            EGL.eglMakeCurrent(self.display, EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE, EGL.EGL_NO_CONTEXT)
+            EGL.eglDestroyContext(self.display, self.context)
+            EGL.eglTerminate(self.display)
+        else:
+            from OpenGL import osmesa
+
+            osmesa.OSMesaDestroyContext(self.context)
+
+
+# camera path file: a list of keyframes {"position": [x, y, z], "yaw": degrees, "pitch": degrees},
+# returns the position, yaw and pitch of every frame, linearly interpolated between the keyframes
+def load_camera_path(file, frames):
+    with open(file, 'r') as f:
+        keyframes = json.load(f)
+
+    positions = np.array([key['position'] for key in keyframes], dtype='float32')
+    yaws = np.array([key.get('yaw', -90) for key in keyframes], dtype='float32')
+    pitches = np.array([key.get('pitch', 0) for key in keyframes], dtype='float32')
+
+    keys = np.linspace(0, 1, len(keyframes))
+    t = np.linspace(0, 1, frames)
+    positions = np.stack([np.interp(t, keys, positions[:, axis]) for axis in range(3)], axis=1)
+    return positions, np.interp(t, keys, yaws), np.interp(t, keys, pitches)
@@ -0,0 +1,38 @@
+import numpy as np
+from OpenGL.GL import glGetUniformLocation, glUniform1i, glUniform1f
+
+# The cube grids of the instancing demos. grid_offsets builds the offsets at once with NumPy (x fastest,
+# then y, then z, like the old nested loops). GRID_GLSL computes the same offset in the vertex shader from
+# gl_InstanceID, then nothing per instance is stored or uploaded and the count is only limited by the GPU.
+
+GRID_GLSL = """
+    uniform int grid_size;  // cubes per side
+    uniform float grid_step;  // distance between the cubes
+    uniform float grid_start;  // offset of the first cube on every axis
+
+    vec3 grid_offset(int instance)
+    {
+        ivec3 cell = ivec3(instance % grid_size, (instance / grid_size) % grid_size,
+                           instance / (grid_size * grid_size));
+        return vec3(cell) * grid_step + grid_start;
+    }
+
+    // up and down, each cube a little after the one next to it
+    float grid_wave(vec3 offset, float time)
+    {
+        return sin((offset.x + offset.z) * 0.2 + time * 2.0);
+    }
+"""
+
+
+# (size ** 3, 3) float32 offsets, the same as grid_offset() of every gl_InstanceID
+def grid_offsets(size, step=2, start=1):
+    z, y, x = np.mgrid[0:size, 0:size, 0:size].reshape(3, -1)
+    return (np.column_stack((x, y, z)) * step + start).astype(np.float32)
+
+
+# the uniforms of GRID_GLSL, the program has to be in use
+def setup_grid_program(program, size, step=2, start=1):
+    glUniform1i(glGetUniformLocation(program, 'grid_size'), size)
+    glUniform1f(glGetUniformLocation(program, 'grid_step'), step)
+    glUniform1f(glGetUniformLocation(program, 'grid_start'), start)
@@ -0,0 +1,133 @@
+import sys
+import time
+import numpy as np
+from libraries.OBJ_Loader import ObjLoader
+
+# Lower detail versions of the indexed (indices, buffer) meshes from ObjLoader, by quadric vertex clustering:
+# all the vertices in one grid cell move to the point with the smallest quadric error of their faces.
+# Vertices of a cell with different texture coordinates (seams) stay apart, they just share that point.
+# Vectorized with NumPy like the loader, a 7.8k face model takes a few tens of milliseconds.
+
+LOD_CELLS = (48, 24, 12)  # grid cells along the longest side of the model for LOD 1, 2, 3
+
+
+# the area weighted plane quadric (4x4) of every triangle
+def face_quadrics(positions, triangles):
+    p0, p1, p2 = positions[triangles[:, 0]], positions[triangles[:, 1]], positions[triangles[:, 2]]
+    normal = np.cross(p1 - p0, p2 - p0)
+    double_area = np.linalg.norm(normal, axis=1, keepdims=True)
+    normal = normal / np.maximum(double_area, 1e-12)
+    plane = np.hstack((normal, -(normal * p0).sum(axis=1, keepdims=True)))
+    return plane[:, :, None] * plane[:, None, :] * (double_area[:, :, None] / 2)
+
+
+# merge the vertices of every cell, returns the new (indices, buffer), same layout as the input
+def simplify_mesh(indices, buffer, cells):
+    vertices = np.asarray(buffer, dtype='float32').reshape(-1, 8).astype('float64')
+    triangles = np.asarray(indices, dtype='int64').reshape(-1, 3)
+    positions = vertices[:, :3]
+
+    box_min = positions.min(axis=0)
+    cell_size = max((positions.max(axis=0) - box_min).max() / cells, 1e-9)
+    cell = np.floor((positions - box_min) / cell_size).astype('int64')
+    _, cluster = np.unique(cell, axis=0, return_inverse=True)
+    cluster = cluster.ravel()
+    clusters = cluster.max() + 1
+
+    # the output vertices: one per cell and texture coordinate bin
+    uv_bin = np.floor(vertices[:, 3:5] * cells).astype('int64')
+    _, vertex = np.unique(np.column_stack((cluster, uv_bin)), axis=0, return_inverse=True)
+    vertex = vertex.ravel()
+    vertex_count = vertex.max() + 1
+
+    # the error quadric of a cluster is the sum over the faces around its vertices
+    quadrics = np.zeros((clusters, 4, 4))
+    faces = face_quadrics(positions, triangles)
+    for corner in range(3):
+        np.add.at(quadrics, cluster[triangles[:, corner]], faces)
+
+    # the average position of every cell, replaced by the quadric optimum where it is well defined
+    point = np.zeros((clusters, 3))
+    np.add.at(point, cluster, positions)
+    point /= np.bincount(cluster, minlength=clusters)[:, None]
+
+    a, b = quadrics[:, :3, :3], -quadrics[:, :3, 3]
+    solvable = np.abs(np.linalg.det(a)) > 1e-12 * cell_size ** 6
+    if solvable.any():
+        optimum = np.linalg.solve(a[solvable], b[solvable][:, :, None])[:, :, 0]
+        # a flat or thin cluster can have an optimum far outside its cell, keep the average then
+        cell_min = box_min + cell[np.unique(cluster, return_index=True)[1]][solvable] * cell_size
+        inside = ((optimum >= cell_min - cell_size) & (optimum <= cell_min + 2 * cell_size)).all(axis=1)
+        rows = np.flatnonzero(solvable)[inside]
+        point[rows] = optimum[inside]
+
+    # texture coordinates and normals are averaged per output vertex
+    merged = np.zeros((vertex_count, 8))
+    np.add.at(merged, vertex, vertices)
+    merged /= np.bincount(vertex, minlength=vertex_count)[:, None]
+    merged[vertex, :3] = point[cluster]
+    normals = merged[:, 5:8]
+    merged[:, 5:8] = normals / np.maximum(np.linalg.norm(normals, axis=1, keepdims=True), 1e-12)
+
+    # drop the triangles that collapsed to a line or a point and the ones that now exist twice
+    cells_of = cluster[triangles]
+    keep = ((cells_of[:, 0] != cells_of[:, 1]) & (cells_of[:, 1] != cells_of[:, 2])
+            & (cells_of[:, 0] != cells_of[:, 2]))
+    triangles = vertex[triangles][keep]
+    _, first = np.unique(np.sort(triangles, axis=1), axis=0, return_index=True)
+    triangles = triangles[np.sort(first)]
+
+    # only the vertices that are still used
+    used, remap = np.unique(triangles, return_inverse=True)
+    index_type = 'uint16' if len(used) <= 65536 else 'uint32'
+    return remap.ravel().astype(index_type), merged[used].astype('float32').ravel()
+
+
+def lod_cache_path(file, lod):
+    # next to the model cache, e.g. object/sushi.obj.lod2.npz
+    return f'{file}.lod{lod}.npz'
+
+
+# LOD 0 is the model itself, the others are simplified once and cached like the model
+def load_lod(file, lod):
+    if lod == 0:
+        return ObjLoader.load_model_cached(file, sorted=False)
+    cache = lod_cache_path(file, lod)
+    cached = ObjLoader.read_cache(cache, file)
+    if cached is not None:
+        return cached
+
+    header = ObjLoader.file_header(file)
+    indices, buffer = ObjLoader.load_model_cached(file, sorted=False)
+    lod_indices, lod_buffer = simplify_mesh(indices, buffer, LOD_CELLS[lod - 1])
+    if len(lod_indices) == 0:
+        lod_indices, lod_buffer = indices, buffer  # too small to simplify, nothing would be left
+    try:
+        ObjLoader.write_cache(cache, header, lod_indices, lod_buffer)
+    except OSError:
+        pass
+    return lod_indices, lod_buffer
+
+
+def load_lods(file, levels=len(LOD_CELLS) + 1):
+    return [load_lod(file, lod) for lod in range(levels)]
+
+
+# LOD of every instance from how big it is seen from the camera: bounding radius / distance,
+# LOD k is used once that drops below thresholds[k - 1]
+def select_lods(centers, radii, camera_pos, thresholds, levels):
+    distance = np.linalg.norm(centers - np.asarray(camera_pos, dtype='float32'), axis=1)
+    size = radii / np.maximum(distance, 1e-6)
+    lods = (size[:, None] < np.asarray(thresholds, dtype='float32')[None, :levels - 1]).sum(axis=1)
+    return lods.astype('int32')
+
+
+# generate and cache the LODs ahead of time: python -m libraries.Mesh_LOD object/sushi.obj object/chair.obj
+if __name__ == '__main__':
+    for model in sys.argv[1:]:
+        base_faces = len(ObjLoader.load_model_cached(model, sorted=False)[0]) // 3
+        for level in range(1, len(LOD_CELLS) + 1):
+            start = time.perf_counter()
+            lod_faces = len(load_lod(model, level)[0]) // 3
+            print(f'{model:<30} LOD {level}  {base_faces:6d} -> {lod_faces:6d} faces  '
+                  f'{(time.perf_counter() - start) * 1000:7.1f} ms')
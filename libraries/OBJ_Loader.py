@@ -1,9 +1,14 @@
+import os
+import re
+import struct
+import hashlib
+import zipfile
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 import numpy as np
 
 
 class ObjLoader:
-    buffer = []
-
     @staticmethod
     def search_data(data_values, coordinates, skip, data_type):
         for d in data_values:
@@ -16,40 +21,47 @@ class ObjLoader:
 
     @staticmethod  # sorted vertex buffer for use with glDrawArrays function
     def create_sorted_vertex_buffer(indices_data, vertices, textures, normals):
+        buffer = []  # local to this call, so several models can be loaded at the same time
         for i, ind in enumerate(indices_data):
             if i % 3 == 0:  # sort the vertex coordinates
                 start = ind * 3
                 end = start + 3
-                ObjLoader.buffer.extend(vertices[start:end])
+                buffer.extend(vertices[start:end])
             elif i % 3 == 1:  # sort the texture coordinates
                 start = ind * 2
                 end = start + 2
-                ObjLoader.buffer.extend(textures[start:end])
+                buffer.extend(textures[start:end])
             elif i % 3 == 2:  # sort the normal vectors
                 start = ind * 3
                 end = start + 3
-                ObjLoader.buffer.extend(normals[start:end])
+                buffer.extend(normals[start:end])
+        return buffer
 
-    @staticmethod  # TODO unsorted vertex buffer for use with glDrawElements function
-    def create_unsorted_vertex_buffer(indices_data, vertices, textures, normals):
-        num_verts = len(vertices) // 3
+    @staticmethod  # indexed vertex buffer for use with glDrawElements function
+    def create_unsorted_vertex_buffer(all_indices, vertices, textures, normals):
+        # one vertex for every unique (v, vt, vn) triplet, packed in a single int64 key
+        all_indices = np.asarray(all_indices, dtype='int64').reshape(-1, 3)
+        vertices = np.asarray(vertices, dtype='float32').reshape(-1, 3)
+        textures = np.asarray(textures, dtype='float32').reshape(-1, 2)
+        normals = np.asarray(normals, dtype='float32').reshape(-1, 3)
 
-        for i1 in range(num_verts):
-            start = i1 * 3
-            end = start + 3
-            ObjLoader.buffer.extend(vertices[start:end])
+        # shift by one so the missing index (-1) becomes 0
+        keys = ((all_indices[:, 0] * (len(textures) + 1) + all_indices[:, 1] + 1)
+                * (len(normals) + 1) + all_indices[:, 2] + 1)
+        _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
 
-            for i2, data in enumerate(indices_data):
-                if i2 % 3 == 0 and data == i1:
-                    start = indices_data[i2 + 1] * 2
-                    end = start + 2
-                    ObjLoader.buffer.extend(textures[start:end])
+        # keep the vertices in the order they first appear in the faces
+        order = np.argsort(first)
+        remap = np.empty_like(order)
+        remap[order] = np.arange(len(order))
+        unique = all_indices[first[order]]
 
-                    start = indices_data[i2 + 2] * 3
-                    end = start + 3
-                    ObjLoader.buffer.extend(normals[start:end])
+        buffer = np.hstack((vertices[unique[:, 0]],
+                            textures[unique[:, 1]],
+                            normals[unique[:, 2]]))
 
-                    break
+        index_type = 'uint16' if len(unique) <= 65536 else 'uint32'
+        return remap[inverse.ravel()].astype(index_type), buffer.ravel()
 
     @staticmethod
     def show_buffer_data(buffer):
@@ -85,19 +97,161 @@ class ObjLoader:
 
                 line = f.readline()
 
-        if sorted:
-            # use with glDrawArrays
-            ObjLoader.create_sorted_vertex_buffer(
-                all_indices, vert_coords, tex_coords, norm_coords)
-        else:
-            # use with glDrawElements
-            ObjLoader.create_unsorted_vertex_buffer(
+        if not sorted:
+            # use with glDrawElements, returns the element indices and the compact buffer
+            return ObjLoader.create_unsorted_vertex_buffer(
                 all_indices, vert_coords, tex_coords, norm_coords)
 
-        # ObjLoader.show_buffer_data(ObjLoader.buffer)
+        # use with glDrawArrays
+        buffer = ObjLoader.create_sorted_vertex_buffer(
+            all_indices, vert_coords, tex_coords, norm_coords)
 
-        # create a local copy of the buffer list, otherwise it will overwrite the static field buffer
-        buffer = ObjLoader.buffer.copy()
-        ObjLoader.buffer = []  # after copy, make sure to set it back to an empty list
+        # ObjLoader.show_buffer_data(buffer)
 
         return np.array(indices, dtype='uint32'), np.array(buffer, dtype='float32')
+
+    @staticmethod
+    def search_block(text, tag):
+        # all the data of one record type joined in a single string
+        return ' '.join(re.findall(r'^' + tag + r'\s+(.*)$', text, re.MULTILINE))
+
+    @staticmethod
+    def parse_model(file):
+        # read the whole file in one go instead of line by line
+        with open(file, 'r') as f:
+            text = f.read()
+
+        vert_coords = np.fromstring(ObjLoader.search_block(text, 'v'), dtype='float32', sep=' ')
+        tex_coords = np.fromstring(ObjLoader.search_block(text, 'vt'), dtype='float32', sep=' ')
+        norm_coords = np.fromstring(ObjLoader.search_block(text, 'vn'), dtype='float32', sep=' ')
+
+        # an extra zero row at the end, missing texture or normal indices (-1) will point to it
+        vert_coords = vert_coords.reshape(-1, 3)
+        tex_coords = np.vstack((tex_coords.reshape(-1, 2), np.zeros((1, 2), dtype='float32')))
+        norm_coords = np.vstack((norm_coords.reshape(-1, 3), np.zeros((1, 3), dtype='float32')))
+
+        faces = ObjLoader.search_block(text, 'f')
+        first = faces.split(' ', 1)[0]
+        stride = first.count('/') + 1  # v, v/vt, v//vn or v/vt/vn
+        faces = faces.replace('//', '/0/').replace('/', ' ')
+        all_indices = np.fromstring(faces, dtype='int64', sep=' ').reshape(-1, stride) - 1
+
+        if stride < 3:
+            missing = np.full((len(all_indices), 3 - stride), -1, dtype='int64')
+            all_indices = np.hstack((all_indices, missing))
+
+        return vert_coords, tex_coords, norm_coords, all_indices
+
+    @staticmethod  # NumPy version of load_model, returns the same (indices, buffer) tuple
+    def load_model_fast(file, sorted=True):
+        vert_coords, tex_coords, norm_coords, all_indices = ObjLoader.parse_model(file)
+
+        if not sorted:
+            return ObjLoader.create_unsorted_vertex_buffer(
+                all_indices, vert_coords, tex_coords, norm_coords)
+
+        buffer = np.hstack((vert_coords[all_indices[:, 0]],
+                            tex_coords[all_indices[:, 1]],
+                            norm_coords[all_indices[:, 2]]))
+
+        return all_indices[:, 0].astype('uint32'), buffer.ravel()
+
+    @staticmethod
+    def file_header(file):
+        # modification time, size and hash of the source file
+        stat = os.stat(file)
+        with open(file, 'rb') as f:
+            sha1 = hashlib.sha1(f.read()).hexdigest()
+        return stat.st_mtime_ns, stat.st_size, sha1
+
+    @staticmethod
+    def cache_path(file, sorted=True):
+        # the cache is written next to the model, e.g. object/sushi.obj.indexed.npz
+        return file + ('.sorted.npz' if sorted else '.indexed.npz')
+
+    @staticmethod
+    def write_cache(cache, header, indices, buffer):
+        mtime, size, sha1 = header
+        # uncompressed, so the arrays can be memory-mapped straight from the archive
+        # write to a temporary file first, an old cache may still be mapped somewhere
+        temp = cache + '.tmp'
+        with open(temp, 'wb') as f:
+            np.savez(f, indices=indices, buffer=buffer, mtime=np.int64(mtime),
+                     size=np.int64(size), sha1=np.str_(sha1))
+        os.replace(temp, cache)
+
+    @staticmethod
+    def map_cache_array(cache, archive, name):
+        # find where the .npy member starts inside the zip and memory-map its data
+        info = archive.getinfo(name + '.npy')
+        with open(cache, 'rb') as f:
+            f.seek(info.header_offset)
+            local_header = f.read(30)
+            name_length, extra_length = struct.unpack('<HH', local_header[26:30])
+            f.seek(info.header_offset + 30 + name_length + extra_length)
+            if np.lib.format.read_magic(f) == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            offset = f.tell()
+        if not shape or 0 in shape:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(cache, dtype=dtype, mode='r', offset=offset, shape=shape,
+                         order='F' if fortran_order else 'C')
+
+    @staticmethod
+    def read_cache(cache, file):
+        # returns None when the cache is missing or older than the model
+        if not os.path.exists(cache):
+            return None
+        try:
+            with np.load(cache) as data:
+                mtime, size, sha1 = int(data['mtime']), int(data['size']), str(data['sha1'])
+                stat = os.stat(file)
+                if (mtime, size) != (stat.st_mtime_ns, stat.st_size):
+                    # touched but maybe not changed (e.g. a fresh checkout), compare the content
+                    header = ObjLoader.file_header(file)
+                    if sha1 != header[2]:
+                        return None
+                    # the same model, store the new mtime and size so the next loads don't hash it again
+                    try:
+                        ObjLoader.write_cache(cache, header, data['indices'], data['buffer'])
+                    except OSError:
+                        pass  # read-only folder, it is hashed every time then
+            with zipfile.ZipFile(cache) as archive:
+                return (ObjLoader.map_cache_array(cache, archive, 'indices'),
+                        ObjLoader.map_cache_array(cache, archive, 'buffer'))
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+            return None  # broken cache, it will be written again
+
+    @staticmethod  # load_model_fast with a binary cache, the model is parsed only when it changed
+    def load_model_cached(file, sorted=True):
+        cache = ObjLoader.cache_path(file, sorted)
+        cached = ObjLoader.read_cache(cache, file)
+        if cached is not None:
+            return cached
+
+        header = ObjLoader.file_header(file)
+        indices, buffer = ObjLoader.load_model_fast(file, sorted)
+        try:
+            ObjLoader.write_cache(cache, header, indices, buffer)
+        except OSError:
+            pass  # read-only folder, just use the parsed model
+        return indices, buffer
+
+    @staticmethod  # load several models in parallel, the results keep the order of files
+    def load_many(files, sorted=True, workers=4, load=None, processes=False):
+        # processes avoid the GIL for the Python parts of the parser, threads avoid copying the results
+        load = partial(load or ObjLoader.load_model_cached, sorted=sorted)
+        executor = ProcessPoolExecutor if processes else ThreadPoolExecutor
+        with executor(max_workers=workers) as pool:
+            return list(pool.map(load, files))
+
+    @staticmethod  # axis-aligned box and bounding sphere of an interleaved (x, y, z, u, v, nx, ny, nz) buffer
+    def bounding_volumes(buffer):
+        positions = np.asarray(buffer, dtype='float32').reshape(-1, 8)[:, :3]
+        box_min = positions.min(axis=0)
+        box_max = positions.max(axis=0)
+        center = (box_min + box_max) / 2
+        radius = np.sqrt(((positions - center) ** 2).sum(axis=1).max())
+        return box_min, box_max, center, radius
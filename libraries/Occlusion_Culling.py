@@ -0,0 +1,265 @@
+import ctypes
+import numpy as np
+from OpenGL.GL import glGenFramebuffers, glBindFramebuffer, glGenTextures, glBindTexture, glTexImage2D, \
+    glTexParameteri, glFramebufferTexture2D, glGenVertexArrays, glBindVertexArray, glGenBuffers, glBindBuffer, \
+    glBufferData, glEnableVertexAttribArray, glVertexAttribPointer, glUseProgram, glGetUniformLocation, \
+    glUniformMatrix4fv, glViewport, glClear, glColorMask, glDrawArrays, glReadPixels, glGetIntegerv, \
+    glDrawBuffer, glReadBuffer, GL_FRAMEBUFFER, GL_DRAW_FRAMEBUFFER_BINDING, GL_READ_FRAMEBUFFER_BINDING, \
+    GL_READ_FRAMEBUFFER, GL_DRAW_FRAMEBUFFER, GL_VIEWPORT, GL_TEXTURE_2D, GL_DEPTH_COMPONENT32F, \
+    GL_DEPTH_COMPONENT, GL_DEPTH_ATTACHMENT, GL_FLOAT, GL_NEAREST, GL_TEXTURE_MIN_FILTER, GL_TEXTURE_MAG_FILTER, \
+    GL_DEPTH_BUFFER_BIT, GL_ARRAY_BUFFER, GL_STATIC_DRAW, GL_FALSE, GL_TRUE, GL_TRIANGLES, GL_NONE, \
+    GL_VERTEX_SHADER, GL_FRAGMENT_SHADER
+from OpenGL.GL.shaders import compileProgram, compileShader
+
+# Occlusion culling against a hierarchical depth buffer (Hi-Z). The big occluders of a scene (walls, tables)
+# go into a small depth buffer, either rasterized here with NumPy (no GPU work and no waiting for it) or
+# drawn by GL and read back. The depth is the view distance (clip w), every pixel of the pyramid above it
+# holds the farthest depth of the 2x2 pixels under it. An instance is hidden when the nearest corner of its
+# box is behind the farthest depth of the pixels its box covers on screen, with the level picked so those
+# are at most 2x2 texels. Only pixel centers are covered by the rasterizer, so the depth is grown by a
+# pixel (the farthest of every 3x3) before the pyramid, a box peeking past an occluder edge stays visible.
+
+HIZ_SIZE = (128, 96)  # depth buffer pixels, about the shape of the window
+
+DEPTH_VERTEX_GLSL = """
+    # version 330
+
+    layout(location = 0) in vec3 position_in;
+
+    uniform mat4 view_projection;
+
+    void main()
+    {
+        gl_Position = view_projection * vec4(position_in, 1.0);
+    }
+"""
+DEPTH_FRAGMENT_GLSL = """
+    # version 330
+
+    void main()
+    {
+    }
+"""
+
+
+# world space triangles (T, 3, 3) of a mesh at every (N, 4, 4) transform, for the occluders
+def world_triangles(indices, buffer, transforms):
+    positions = np.asarray(buffer, dtype='float32').reshape(-1, 8)[:, :3]
+    triangles = positions[np.asarray(indices, dtype='int64').reshape(-1, 3)]
+    world = np.einsum('tvi,nij->ntvj', triangles, transforms[:, :3, :3]) + transforms[:, None, None, 3, :3]
+    return np.ascontiguousarray(world.reshape(-1, 3, 3), dtype='float32')
+
+
+# clip space (T, 3, 4) triangles cut at w = near, the parts in front are kept
+def clip_near(clip, near):
+    inside = clip[:, :, 3] >= near
+    count = inside.sum(axis=1)
+    kept = [clip[count == 3]]
+    # a triangle through the near plane becomes a triangle or a quad (two triangles), only a few do
+    for triangle, corner_inside in zip(clip[(count == 1) | (count == 2)], inside[(count == 1) | (count == 2)]):
+        polygon = []
+        for i in range(3):
+            a, b = triangle[i], triangle[(i + 1) % 3]
+            if corner_inside[i]:
+                polygon.append(a)
+            if corner_inside[i] != corner_inside[(i + 1) % 3]:
+                t = (near - a[3]) / (b[3] - a[3])
+                polygon.append(a + (b - a) * t)
+        kept.append(np.array([[polygon[0], polygon[i], polygon[i + 1]] for i in range(1, len(polygon) - 1)],
+                             dtype='float32').reshape(-1, 3, 4))
+    return np.concatenate(kept)
+
+
+# rasterize world space triangles into a (height, width) buffer of view distances, inf where nothing is
+def rasterize_depth(triangles, view_projection, size=HIZ_SIZE, near=0.1):
+    width, height = size
+    depth = np.full((height, width), np.inf, dtype='float32')
+    if not len(triangles):
+        return depth
+    clip = np.concatenate((triangles, np.ones(triangles.shape[:2] + (1,), dtype='float32')), axis=2)
+    clip = clip_near(clip @ np.asarray(view_projection, dtype='float32'), near)
+    w = clip[:, :, 3]
+    x = (clip[:, :, 0] / w * 0.5 + 0.5) * width  # pixel coordinates, pixel i has its center at i + 0.5
+    y = (clip[:, :, 1] / w * 0.5 + 0.5) * height
+
+    # the pixel centers in the bounding rectangle of every triangle on screen
+    x0 = np.clip(np.ceil(x.min(axis=1) - 0.5), 0, width).astype('int64')
+    x1 = np.clip(np.floor(x.max(axis=1) - 0.5), -1, width - 1).astype('int64')
+    y0 = np.clip(np.ceil(y.min(axis=1) - 0.5), 0, height).astype('int64')
+    y1 = np.clip(np.floor(y.max(axis=1) - 0.5), -1, height - 1).astype('int64')
+    area = (x[:, 1] - x[:, 0]) * (y[:, 2] - y[:, 0]) - (x[:, 2] - x[:, 0]) * (y[:, 1] - y[:, 0])
+    columns, rows = np.maximum(x1 - x0 + 1, 0), np.maximum(y1 - y0 + 1, 0)
+    sizes = np.where(np.abs(area) > 1e-12, columns * rows, 0)
+    if not sizes.sum():
+        return depth
+
+    triangle = np.repeat(np.arange(len(sizes)), sizes)
+    local = np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    px = x0[triangle] + local % columns[triangle]
+    py = y0[triangle] + local // columns[triangle]
+    cx, cy = px + 0.5, py + 0.5
+
+    # barycentric weights of every pixel center, all >= 0 inside, either winding
+    tx, ty, tw = x[triangle], y[triangle], w[triangle]
+    weights = np.stack([(tx[:, (i + 1) % 3] - cx) * (ty[:, (i + 2) % 3] - cy)
+                        - (tx[:, (i + 2) % 3] - cx) * (ty[:, (i + 1) % 3] - cy) for i in range(3)], axis=1)
+    weights /= area[triangle][:, None]
+    inside = (weights >= 0).all(axis=1)
+
+    # 1 / w is linear on screen, the depth at the pixel center is the view distance there
+    distance = 1 / (weights[inside] / tw[inside]).sum(axis=1)
+    np.minimum.at(depth, (py[inside], px[inside]), distance.astype('float32'))
+    return depth
+
+
+# the farthest depth of every 3x3 pixels, so a pixel only keeps its depth when it is covered all around
+def grow_depth(depth):
+    padded = np.pad(depth, 1, mode='edge')
+    height, width = depth.shape
+    return np.max([padded[i:i + height, j:j + width] for i in range(3) for j in range(3)], axis=0)
+
+
+# level 0 is the depth, every next level the farthest of 2x2 texels, down to 1x1
+def hiz_pyramid(depth):
+    levels = [depth]
+    while levels[-1].shape != (1, 1):
+        level = levels[-1]
+        level = np.pad(level, ((0, level.shape[0] % 2), (0, level.shape[1] % 2)), mode='edge')
+        height, width = level.shape[0] // 2, level.shape[1] // 2
+        levels.append(level.reshape(height, 2, width, 2).max(axis=(1, 3)))
+    return levels
+
+
+# true for the (center, half extent) world boxes hidden behind the pyramid, boxes through the near plane
+# or off screen are not hidden here (the frustum culling has the off screen ones)
+def occluded_instances(pyramid, view_projection, box_center, box_extent, near=0.1):
+    height, width = pyramid[0].shape
+    signs = np.array([[x, y, z] for x in (-1, 1) for y in (-1, 1) for z in (-1, 1)], dtype='float32')
+    corners = box_center[:, None, :] + box_extent[:, None, :] * signs
+    clip = np.concatenate((corners, np.ones(corners.shape[:2] + (1,), dtype='float32')), axis=2) @ \
+        np.asarray(view_projection, dtype='float32')
+    w = clip[:, :, 3]
+    testable = (w >= near).all(axis=1)
+    w = np.where(testable[:, None], w, 1)
+    x = (clip[:, :, 0] / w * 0.5 + 0.5) * width
+    y = (clip[:, :, 1] / w * 0.5 + 0.5) * height
+    testable &= (x.max(axis=1) >= 0) & (x.min(axis=1) < width) & (y.max(axis=1) >= 0) & (y.min(axis=1) < height)
+
+    x0 = np.clip(np.floor(x.min(axis=1)), 0, width - 1).astype('int64')
+    x1 = np.clip(np.floor(x.max(axis=1)), 0, width - 1).astype('int64')
+    y0 = np.clip(np.floor(y.min(axis=1)), 0, height - 1).astype('int64')
+    y1 = np.clip(np.floor(y.max(axis=1)), 0, height - 1).astype('int64')
+    # the level where the rectangle covers at most 2x2 texels
+    span = np.maximum(x1 - x0, y1 - y0) + 1
+    level = np.minimum(np.ceil(np.log2(span)).astype('int64'), len(pyramid) - 1)
+
+    farthest = np.full(len(box_center), np.inf, dtype='float32')
+    for number in np.unique(level[testable]):
+        texels = pyramid[number]
+        chosen = np.flatnonzero(testable & (level == number))
+        columns = [np.minimum(x0[chosen] >> number, texels.shape[1] - 1),
+                   np.minimum(x1[chosen] >> number, texels.shape[1] - 1)]
+        rows = [np.minimum(y0[chosen] >> number, texels.shape[0] - 1),
+                np.minimum(y1[chosen] >> number, texels.shape[0] - 1)]
+        farthest[chosen] = np.max([texels[row, column] for row in rows for column in columns], axis=0)
+    return testable & (w.min(axis=1) > farthest)
+
+
+class OcclusionCuller:
+    def __init__(self, size=HIZ_SIZE, near=0.1, far=100, gpu=False):
+        self.size = size
+        self.near, self.far = near, far
+        self.occluders = {}  # key (e.g. the mesh) -> world space triangles
+        self.triangles = np.zeros((0, 3, 3), dtype='float32')
+        self.pyramid = None
+        self.gpu = gpu
+        if gpu:
+            self.setup_gl()
+
+    def set_occluders(self, key, triangles):
+        self.occluders[key] = triangles
+        self.update_occluders()
+
+    def remove_occluders(self, key):
+        if self.occluders.pop(key, None) is not None:
+            self.update_occluders()
+
+    def update_occluders(self):
+        triangles = list(self.occluders.values())
+        self.triangles = np.concatenate(triangles) if triangles else np.zeros((0, 3, 3), dtype='float32')
+        if self.gpu:
+            glBindVertexArray(0)
+            glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+            glBufferData(GL_ARRAY_BUFFER, max(self.triangles.nbytes, 4), self.triangles if len(self.triangles)
+                         else None, GL_STATIC_DRAW)
+
+    def setup_gl(self):
+        # a depth only framebuffer of the Hi-Z size and the occluder triangles in a VBO of their own
+        width, height = self.size
+        self.depth_texture = glGenTextures(1)
+        glBindTexture(GL_TEXTURE_2D, self.depth_texture)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+        glTexImage2D(GL_TEXTURE_2D, 0, GL_DEPTH_COMPONENT32F, width, height, 0, GL_DEPTH_COMPONENT, GL_FLOAT, None)
+
+        draw_framebuffer = glGetIntegerv(GL_DRAW_FRAMEBUFFER_BINDING)
+        read_framebuffer = glGetIntegerv(GL_READ_FRAMEBUFFER_BINDING)
+        self.framebuffer = glGenFramebuffers(1)
+        glBindFramebuffer(GL_FRAMEBUFFER, self.framebuffer)
+        glFramebufferTexture2D(GL_FRAMEBUFFER, GL_DEPTH_ATTACHMENT, GL_TEXTURE_2D, self.depth_texture, 0)
+        glDrawBuffer(GL_NONE)
+        glReadBuffer(GL_NONE)
+        glBindFramebuffer(GL_DRAW_FRAMEBUFFER, draw_framebuffer)
+        glBindFramebuffer(GL_READ_FRAMEBUFFER, read_framebuffer)
+
+        self.program = compileProgram(compileShader(DEPTH_VERTEX_GLSL, GL_VERTEX_SHADER),
+                                      compileShader(DEPTH_FRAGMENT_GLSL, GL_FRAGMENT_SHADER))
+        self.view_projection_loc = glGetUniformLocation(self.program, 'view_projection')
+        self.vao = glGenVertexArrays(1)
+        self.vbo = glGenBuffers(1)
+        glBindVertexArray(self.vao)
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        glBufferData(GL_ARRAY_BUFFER, 4, None, GL_STATIC_DRAW)
+        glEnableVertexAttribArray(0)
+        glVertexAttribPointer(0, 3, GL_FLOAT, GL_FALSE, 12, ctypes.c_void_p(0))
+        glBindVertexArray(0)
+
+    def render_gl(self, view_projection):
+        # the occluders drawn into the small depth buffer and read back (a wait for the GPU, 48 KB),
+        # the framebuffer, viewport, program and VAO are changed, invalidate a RenderQueue afterwards
+        width, height = self.size
+        draw_framebuffer = glGetIntegerv(GL_DRAW_FRAMEBUFFER_BINDING)
+        read_framebuffer = glGetIntegerv(GL_READ_FRAMEBUFFER_BINDING)
+        viewport = glGetIntegerv(GL_VIEWPORT)
+
+        glBindFramebuffer(GL_FRAMEBUFFER, self.framebuffer)
+        glViewport(0, 0, width, height)
+        glClear(GL_DEPTH_BUFFER_BIT)
+        glColorMask(GL_FALSE, GL_FALSE, GL_FALSE, GL_FALSE)
+        glUseProgram(self.program)
+        glUniformMatrix4fv(self.view_projection_loc, 1, GL_FALSE, view_projection)
+        glBindVertexArray(self.vao)
+        glDrawArrays(GL_TRIANGLES, 0, len(self.triangles) * 3)
+        glColorMask(GL_TRUE, GL_TRUE, GL_TRUE, GL_TRUE)
+        window_depth = np.frombuffer(glReadPixels(0, 0, width, height, GL_DEPTH_COMPONENT, GL_FLOAT),
+                                     dtype='float32').reshape(height, width)
+
+        glBindFramebuffer(GL_DRAW_FRAMEBUFFER, draw_framebuffer)
+        glBindFramebuffer(GL_READ_FRAMEBUFFER, read_framebuffer)
+        glViewport(*viewport)
+
+        # window depth back to the view distance of the perspective projection, the far plane is empty
+        ndc = window_depth * 2 - 1
+        distance = 2 * self.near * self.far / ((self.far + self.near) - ndc * (self.far - self.near))
+        return np.where(window_depth < 1, distance, np.inf).astype('float32')
+
+    def update(self, view_projection):
+        # once per frame, before the tests
+        if self.gpu:
+            depth = self.render_gl(view_projection)
+        else:
+            depth = rasterize_depth(self.triangles, view_projection, self.size, self.near)
+        self.pyramid = hiz_pyramid(grow_depth(depth))
+
+    def occluded(self, view_projection, box_center, box_extent):
+        return occluded_instances(self.pyramid, view_projection, box_center, box_extent, self.near)
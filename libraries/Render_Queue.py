@@ -0,0 +1,97 @@
+from collections import namedtuple
+import numpy as np
+from OpenGL.GL import glUseProgram, glBindVertexArray, glBindTexture, glUniformMatrix4fv, \
+    glDrawElementsInstanced, GL_TEXTURE_2D, GL_TRIANGLES, GL_FALSE
+
+# one draw, uniforms is a tuple of (location, mat4) set right before it,
+# draw replaces the glDrawElementsInstanced call, e.g. for a multi draw from a GeometryPool
+DrawCommand = namedtuple('DrawCommand', 'program vao texture count index_type instances uniforms draw',
+                         defaults=(None,))
+
+STAT_NAMES = ('draws', 'program_binds', 'vao_binds', 'texture_binds', 'uniform_uploads',
+              'skipped_program_binds', 'skipped_vao_binds', 'skipped_texture_binds', 'skipped_uniform_uploads')
+
+
+class RenderQueue:
+    def __init__(self, texture_target=GL_TEXTURE_2D):
+        self.commands = []
+        self.texture_target = texture_target  # e.g. GL_TEXTURE_2D_ARRAY when the textures are array layers
+
+        # what is bound right now, so the same bind is never issued twice
+        self.program = None
+        self.vao = None
+        self.texture = None
+        self.uniforms = {}  # (program, location) -> last uploaded value
+
+        self.stats = dict.fromkeys(STAT_NAMES, 0)  # counts of the last flush
+        self.total = dict.fromkeys(STAT_NAMES, 0)  # counts since the queue was created
+
+    def invalidate(self):
+        # call after binding things without the queue, the next binds will all be issued
+        self.program = None
+        self.vao = None
+        self.texture = None
+        self.uniforms = {}
+
+    def use_program(self, program):
+        if program == self.program:
+            self.stats['skipped_program_binds'] += 1
+            return
+        glUseProgram(program)
+        self.program = program
+        self.stats['program_binds'] += 1
+
+    def bind_vertex_array(self, vao):
+        if vao == self.vao:
+            self.stats['skipped_vao_binds'] += 1
+            return
+        glBindVertexArray(vao)
+        self.vao = vao
+        self.stats['vao_binds'] += 1
+
+    def bind_texture(self, texture):
+        if texture == self.texture:
+            self.stats['skipped_texture_binds'] += 1
+            return
+        glBindTexture(self.texture_target, texture)
+        self.texture = texture
+        self.stats['texture_binds'] += 1
+
+    def uniform_matrix(self, program, location, value):
+        # uniforms belong to a program, so it has to be the current one
+        self.use_program(program)
+        key = (program, location)
+        last = self.uniforms.get(key)
+        if last is not None and np.array_equal(last, value):
+            self.stats['skipped_uniform_uploads'] += 1
+            return
+        glUniformMatrix4fv(location, 1, GL_FALSE, value)
+        self.uniforms[key] = np.array(value, dtype='float32')
+        self.stats['uniform_uploads'] += 1
+
+    def submit(self, program, vao, texture, count, index_type, instances=1, uniforms=(), draw=None):
+        self.commands.append(DrawCommand(program, vao, texture, count, index_type, instances, tuple(uniforms),
+                                         draw))
+
+    def flush(self):
+        # sorted by program, then VAO, then texture, so equal state ends up next to each other
+        self.commands.sort(key=lambda command: (command.program, command.vao, command.texture))
+        for command in self.commands:
+            self.use_program(command.program)
+            self.bind_vertex_array(command.vao)
+            self.bind_texture(command.texture)
+            for location, value in command.uniforms:
+                self.uniform_matrix(command.program, location, value)
+            if command.draw is not None:
+                command.draw()
+            else:
+                glDrawElementsInstanced(GL_TRIANGLES, command.count, command.index_type, None, command.instances)
+            self.stats['draws'] += 1
+        self.commands = []
+
+        # hand back the counts of this frame and start the next one from zero
+        stats = self.stats
+        for name, value in stats.items():
+            self.total[name] += value
+        self.stats = dict.fromkeys(STAT_NAMES, 0)
+        return stats
@@ -0,0 +1,131 @@
+import json
+import os
+import numpy as np
+from pyrr import matrix44
+from libraries import Transform
+
+
+class Scene:
+    def __init__(self):
+        self.meshes = []  # unique mesh paths, mesh_ids index this list
+        self.textures = []  # unique texture paths, texture_ids index this list
+
+        # one entry per object instance
+        self.names = []
+        self.mesh_ids = np.zeros(0, dtype='int32')
+        self.texture_ids = np.zeros(0, dtype='int32')
+        self.occluders = np.zeros(0, dtype=bool)  # big solid objects (walls, tables) that hide what is behind
+        self.models = np.zeros((0, 4, 4), dtype='float32')  # translation of every instance
+        self.scales = np.zeros((0, 4, 4), dtype='float32')
+        self.rotations = np.zeros((0, 4, 4), dtype='float32')
+        self.transforms = np.zeros((0, 4, 4), dtype='float32')  # model, scale and rotation in one matrix
+
+        # instances are sorted by mesh and texture, one (mesh_id, texture_id, first, count) per run
+        self.batches = []
+
+        # point lights, color already multiplied by the intensity
+        self.light_positions = np.zeros((0, 3), dtype='float32')
+        self.light_colors = np.zeros((0, 3), dtype='float32')
+        self.light_radii = np.zeros(0, dtype='float32')
+
+    def __len__(self):
+        return len(self.mesh_ids)
+
+    def instance_data(self, first=0, count=None):
+        # the composed matrix of every instance, (N, 4, 4) float32 for an instance VBO
+        end = len(self) if count is None else first + count
+        return self.transforms[first:end]
+
+
+class SceneLoader:
+    @staticmethod
+    def grid_positions(grid):
+        # origin + step * (i, j, k) for every cell of the count[0] x count[1] x count[2] grid
+        origin = np.asarray(grid['origin'], dtype='float32')
+        step = np.asarray(grid.get('step', [0, 0, 0]), dtype='float32')
+        count = grid.get('count', [1, 1, 1])
+        cells = np.indices(count, dtype='float32').reshape(3, -1).T
+        return origin + cells * step
+
+    @staticmethod
+    def object_positions(entry):
+        if 'grid' in entry:
+            return SceneLoader.grid_positions(entry['grid'])
+        return np.asarray(entry['positions'], dtype='float32').reshape(-1, 3)
+
+    @staticmethod
+    def add_path(paths, path):
+        if path not in paths:
+            paths.append(path)
+        return paths.index(path)
+
+    @staticmethod
+    def check_paths(file, entry):
+        # a missing mesh or texture fails here with the entry named, not later in a loader thread
+        for key in ('mesh', 'texture'):
+            if not os.path.exists(entry[key]):
+                raise FileNotFoundError(f"{file}: {key} '{entry[key]}' of object "
+                                        f"'{entry.get('name', entry['mesh'])}' does not exist")
+
+    @staticmethod
+    def load_scene(file):
+        # each object lists its mesh, texture, scale, y rotation (radians, like pyrr)
+        # and either explicit positions or a grid pattern, "occluder": true for the ones that hide others
+        with open(file, 'r') as f:
+            description = json.load(f)
+
+        scene = Scene()
+        names, mesh_ids, texture_ids, occluders, positions, scales, rotations = [], [], [], [], [], [], []
+        for entry in description['objects']:
+            SceneLoader.check_paths(file, entry)
+            entry_positions = SceneLoader.object_positions(entry)
+            count = len(entry_positions)
+
+            scale = np.broadcast_to(np.asarray(entry.get('scale', 1.0), dtype='float32'), (3,))
+            rotate = matrix44.create_from_y_rotation(entry.get('rotate_y', 0), dtype='float32')
+
+            names += [entry.get('name', entry['mesh'])] * count
+            mesh_ids.append(np.full(count, SceneLoader.add_path(scene.meshes, entry['mesh'])))
+            texture_ids.append(np.full(count, SceneLoader.add_path(scene.textures, entry['texture'])))
+            occluders.append(np.full(count, entry.get('occluder', False), dtype=bool))
+            positions.append(entry_positions)
+            scales.append(np.tile(matrix44.create_from_scale(scale, dtype='float32'), (count, 1, 1)))
+            rotations.append(np.tile(rotate, (count, 1, 1)))
+
+        # group identical mesh + texture pairs, so each group can be drawn with one instanced call
+        mesh_ids = np.concatenate(mesh_ids).astype('int32')
+        texture_ids = np.concatenate(texture_ids).astype('int32')
+        order = np.lexsort((texture_ids, mesh_ids))
+
+        scene.names = [names[i] for i in order]
+        scene.mesh_ids = mesh_ids[order]
+        scene.texture_ids = texture_ids[order]
+        scene.occluders = np.concatenate(occluders)[order]
+
+        # all the translation matrices in one contiguous (N, 4, 4) array, pyrr layout (translation in row 3)
+        positions = np.concatenate(positions)[order]
+        scene.models = np.tile(np.identity(4, dtype='float32'), (len(positions), 1, 1))
+        scene.models[:, 3, :3] = positions
+        scene.scales = np.ascontiguousarray(np.concatenate(scales)[order])
+        scene.rotations = np.ascontiguousarray(np.concatenate(rotations)[order])
+        scene.transforms = Transform.compose(scene.models, scene.scales, scene.rotations)
+
+        changes = np.flatnonzero((np.diff(scene.mesh_ids) != 0) | (np.diff(scene.texture_ids) != 0)) + 1
+        starts = np.concatenate(([0], changes))
+        ends = np.concatenate((changes, [len(order)]))
+        scene.batches = [(int(scene.mesh_ids[first]), int(scene.texture_ids[first]), int(first), int(end - first))
+                         for first, end in zip(starts, ends)]
+
+        # lights have a color, intensity and radius and are placed like the objects
+        light_positions, light_colors, light_radii = [], [], []
+        for entry in description.get('lights', []):
+            entry_positions = SceneLoader.object_positions(entry)
+            color = np.asarray(entry.get('color', [1, 1, 1]), dtype='float32') * entry.get('intensity', 1.0)
+            light_positions.append(entry_positions)
+            light_colors.append(np.tile(color, (len(entry_positions), 1)))
+            light_radii.append(np.full(len(entry_positions), entry.get('radius', 10.0), dtype='float32'))
+        if light_positions:
+            scene.light_positions = np.concatenate(light_positions)
+            scene.light_colors = np.concatenate(light_colors)
+            scene.light_radii = np.concatenate(light_radii)
+        return scene
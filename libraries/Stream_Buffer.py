@@ -0,0 +1,86 @@
+import ctypes
+import numpy as np
+from OpenGL.GL import glGenBuffers, glBindBuffer, glBufferData, glBufferSubData, glMapBufferRange, \
+    glFenceSync, glClientWaitSync, glDeleteSync, glGetIntegerv, \
+    GL_STREAM_DRAW, GL_MAP_WRITE_BIT, GL_SYNC_GPU_COMMANDS_COMPLETE, GL_SYNC_FLUSH_COMMANDS_BIT, \
+    GL_TIMEOUT_EXPIRED, GL_WAIT_FAILED, GL_MAJOR_VERSION, GL_MINOR_VERSION
+from OpenGL.raw.GL.VERSION.GL_4_4 import glBufferStorage, GL_MAP_PERSISTENT_BIT, GL_MAP_COHERENT_BIT
+
+# Per frame data (instance transforms, ...) written by the CPU every frame without stalling on the GPU.
+# The buffer holds FRAMES regions, the CPU fills one while the GPU may still read the ones of the frames
+# before, a fence after the draws of a region says when the GPU is done with it. With glBufferStorage
+# (GL 4.4) the buffer is mapped once, persistent and coherent, and begin() hands out a NumPy view of the
+# mapped memory, so the data is written straight into the buffer. Without it begin() gives a NumPy array
+# and commit() orphans the buffer (glBufferData with None) before the upload, the driver does the
+# ring behind it then.
+
+FRAMES = 3  # regions in flight, the frame being written and two the GPU can still be drawing
+FENCE_TIMEOUT = 1_000_000  # ns per glClientWaitSync, it is called again until the fence is done
+
+
+class StreamBuffer:
+    def __init__(self, target, shape, dtype='float32', frames=FRAMES, persistent=None):
+        self.target = target
+        self.shape = shape if isinstance(shape, tuple) else (shape,)
+        self.dtype = np.dtype(dtype)
+        self.frames = frames
+        self.region_size = int(np.prod(self.shape)) * self.dtype.itemsize
+        self.index = frames - 1  # the region of this frame, begin() moves on to the next
+        self.fences = [None] * frames
+        self.waits = 0  # frames begin() had to wait for the GPU, should stay 0
+
+        if persistent is None:
+            version = (glGetIntegerv(GL_MAJOR_VERSION), glGetIntegerv(GL_MINOR_VERSION))
+            persistent = version >= (4, 4) and bool(glBufferStorage)
+        self.persistent = persistent
+
+        self.buffer = glGenBuffers(1)
+        glBindBuffer(target, self.buffer)
+        if persistent:
+            flags = GL_MAP_WRITE_BIT | GL_MAP_PERSISTENT_BIT | GL_MAP_COHERENT_BIT
+            size = self.region_size * frames
+            glBufferStorage(target, size, None, flags)
+            address = glMapBufferRange(target, 0, size, flags)
+            memory = (ctypes.c_byte * size).from_address(address)
+            # every region as an array of the given shape, they stay valid as long as the buffer
+            self.regions = np.frombuffer(memory, dtype=self.dtype).reshape((frames,) + self.shape)
+        else:
+            glBufferData(target, self.region_size, None, GL_STREAM_DRAW)
+            self.regions = np.zeros((1,) + self.shape, dtype=self.dtype)
+
+    @property
+    def offset(self):
+        # byte offset of this frame's region in the buffer, for the attribute pointers or base instance
+        return self.index * self.region_size if self.persistent else 0
+
+    def begin(self):
+        # the array to write this frame's data to, the GPU is no longer reading it
+        if not self.persistent:
+            return self.regions[0]
+        self.index = (self.index + 1) % self.frames
+        fence = self.fences[self.index]
+        if fence is not None:
+            result = glClientWaitSync(fence, 0, 0)
+            if result == GL_TIMEOUT_EXPIRED:
+                self.waits += 1
+                while result == GL_TIMEOUT_EXPIRED:
+                    result = glClientWaitSync(fence, GL_SYNC_FLUSH_COMMANDS_BIT, FENCE_TIMEOUT)
+            if result == GL_WAIT_FAILED:
+                raise RuntimeError('glClientWaitSync failed on the stream buffer fence')
+            glDeleteSync(fence)
+            self.fences[self.index] = None
+        return self.regions[self.index]
+
+    def commit(self):
+        # after writing, before the draws. The coherent mapping needs nothing, the fallback uploads
+        # into a fresh store, the old one stays with the draws that still use it
+        if self.persistent:
+            return
+        glBindBuffer(self.target, self.buffer)
+        glBufferData(self.target, self.region_size, None, GL_STREAM_DRAW)
+        glBufferSubData(self.target, 0, self.region_size, self.regions[0])
+
+    def end(self):
+        # after the draws that read this frame's region
+        if self.persistent:
+            self.fences[self.index] = glFenceSync(GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
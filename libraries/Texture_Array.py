@@ -0,0 +1,74 @@
+import numpy as np
+from OpenGL.GL import glGenTextures, glBindTexture, glTexParameteri, glTexImage3D, \
+    glTexSubImage3D, glPixelStorei, GL_TEXTURE_2D_ARRAY, GL_TEXTURE_WRAP_S, GL_TEXTURE_WRAP_T, GL_REPEAT, \
+    GL_TEXTURE_MIN_FILTER, GL_TEXTURE_MAG_FILTER, GL_LINEAR, GL_LINEAR_MIPMAP_LINEAR, GL_TEXTURE_MAX_LEVEL, \
+    GL_RGBA8, GL_RGBA, GL_RGB, GL_UNSIGNED_BYTE, GL_UNPACK_ALIGNMENT
+from OpenGL.raw.GL.VERSION.GL_3_0 import glGenerateMipmap
+
+# All the textures of a scene as layers of one GL_TEXTURE_2D_ARRAY, so draws with different materials
+# need no texture bind in between, the shader picks the layer per instance. Every layer has the same size,
+# the images are scaled to it when baked (see Texture_Loader.bake_texture). An array and not an atlas:
+# the floor and walls repeat their texture, a rectangle of an atlas can't wrap.
+
+PLACEHOLDER_COLOR = (128, 128, 128, 255)
+
+
+def mip_count(size):
+    return size.bit_length()  # size, size / 2, ... 1
+
+
+class TextureArray:
+    def __init__(self, layers, size=1024):
+        self.layers = layers
+        self.size = size
+        self.levels = mip_count(size)
+        self.used = 0  # layers handed out by register()
+
+        self.texture = glGenTextures(1)
+        glBindTexture(GL_TEXTURE_2D_ARRAY, self.texture)
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_WRAP_S, GL_REPEAT)
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_WRAP_T, GL_REPEAT)
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_MIN_FILTER, GL_LINEAR_MIPMAP_LINEAR)
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_MAX_LEVEL, self.levels - 1)
+        # storage for every level, each layer starts as the grey placeholder
+        for level in range(self.levels):
+            width = max(1, size >> level)
+            glTexImage3D(GL_TEXTURE_2D_ARRAY, level, GL_RGBA8, width, width, layers, 0,
+                         GL_RGBA, GL_UNSIGNED_BYTE, None)
+        for layer in range(layers):
+            self.clear(layer)
+
+    def register(self):
+        # the next free layer, its number never changes
+        if self.used == self.layers:
+            raise ValueError(f'texture array is full, it has {self.layers} layers')
+        self.used += 1
+        return self.used - 1
+
+    def upload(self, layer, levels, channels=4):
+        # levels as (width, height, data) like Texture_Loader, the first one has to be size x size,
+        # with only that one the rest of the mip chain is generated on the GPU
+        width, height, _ = levels[0]
+        if (width, height) != (self.size, self.size):
+            raise ValueError(f'texture array layers are {self.size}x{self.size}, got {width}x{height}')
+        glBindTexture(GL_TEXTURE_2D_ARRAY, self.texture)
+        # RGB rows are not always a multiple of 4 bytes
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 4 if channels == 4 else 1)
+        pixel_format = GL_RGBA if channels == 4 else GL_RGB
+        for level, (width, height, img_data) in enumerate(levels[:self.levels]):
+            glTexSubImage3D(GL_TEXTURE_2D_ARRAY, level, 0, 0, layer, width, height, 1,
+                            pixel_format, GL_UNSIGNED_BYTE, img_data)
+        if len(levels) == 1:
+            glGenerateMipmap(GL_TEXTURE_2D_ARRAY)
+
+    def clear(self, layer):
+        # back to the placeholder, e.g. when the texture of the layer is evicted
+        glBindTexture(GL_TEXTURE_2D_ARRAY, self.texture)
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 4)
+        for level in range(self.levels):
+            width = max(1, self.size >> level)
+            pixels = np.empty((width, width, 4), dtype='uint8')
+            pixels[:] = PLACEHOLDER_COLOR
+            glTexSubImage3D(GL_TEXTURE_2D_ARRAY, level, 0, 0, layer, width, width, 1,
+                            GL_RGBA, GL_UNSIGNED_BYTE, pixels)
@@ -1,29 +1,153 @@
-from OpenGL.GL import glBindTexture, glTexParameteri, GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, \
-    GL_TEXTURE_WRAP_T, GL_REPEAT, GL_TEXTURE_MIN_FILTER, GL_TEXTURE_MAG_FILTER, GL_LINEAR,\
-    glTexImage2D, GL_RGBA, GL_UNSIGNED_BYTE
-from OpenGL.raw.GL.VERSION.GL_1_0 import GL_LINEAR_MIPMAP_LINEAR, GL_LINEAR_MIPMAP_NEAREST
-from OpenGL.raw.GL.VERSION.GL_3_0 import glGenerateMipmap
+from OpenGL.GL import glBindTexture, glTexParameteri, glTexImage2D, glPixelStorei, GL_TEXTURE_2D, \
+    GL_TEXTURE_WRAP_S, GL_TEXTURE_WRAP_T, GL_REPEAT, GL_TEXTURE_MIN_FILTER, GL_TEXTURE_MAG_FILTER, GL_LINEAR, \
+    GL_LINEAR_MIPMAP_LINEAR, GL_TEXTURE_MAX_LEVEL, GL_UNPACK_ALIGNMENT, GL_RGBA, GL_RGB, GL_UNSIGNED_BYTE
 from PIL import Image
+import os
+import sys
+import time
+import struct
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
+# baked texture file: header, one (width, height, offset) entry per mip level, then the raw pixels
+BAKED_MAGIC = b'MIP1'
+BAKED_HEADER = struct.Struct('<4sIIII')  # magic, width, height, channels, levels
+BAKED_LEVEL = struct.Struct('<III')  # width, height, offset
 
-# for use with GLFW
-def load_texture(path, texture):
+
+# decode, flip and convert an image, doesn't need the GL context so it can run on any thread
+# returns the mip levels as (width, height, data), the channel count and the decode time
+# size scales it to size x size, for a layer of a texture array
+def decode_texture(path, size=None):
+    start = time.perf_counter()
+    image = Image.open(path)
+    image = image.transpose(Image.FLIP_TOP_BOTTOM)
+    if size:
+        image = image.resize((size, size), Image.LANCZOS)
+    img_data = image.convert("RGBA").tobytes()
+    return [(image.width, image.height, img_data)], 4, time.perf_counter() - start
+
+
+# upload decoded image data, must run on the thread that owns the GL context
+def upload_texture(texture, levels, channels=4):
     glBindTexture(GL_TEXTURE_2D, texture)
     # Set the texture wrapping parameters
     glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_REPEAT)
     glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_REPEAT)
-    # Set texture filtering parameters
-    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
+    # Set texture filtering parameters, trilinear when the mip chain is there
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER,
+                    GL_LINEAR_MIPMAP_LINEAR if len(levels) > 1 else GL_LINEAR)
     glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
-    # load image
-    image = Image.open(path)
-    image = image.transpose(Image.FLIP_TOP_BOTTOM)
-    img_data = image.convert("RGBA").tobytes()
-    glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, image.width,
-                 image.height, 0, GL_RGBA, GL_UNSIGNED_BYTE, img_data)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAX_LEVEL, len(levels) - 1)
+    # RGB rows are not always a multiple of 4 bytes
+    glPixelStorei(GL_UNPACK_ALIGNMENT, 4 if channels == 4 else 1)
+    pixel_format = GL_RGBA if channels == 4 else GL_RGB
+    for level, (width, height, img_data) in enumerate(levels):
+        glTexImage2D(GL_TEXTURE_2D, level, pixel_format, width,
+                     height, 0, pixel_format, GL_UNSIGNED_BYTE, img_data)
     return texture
 
 
+# for use with GLFW
+def load_texture(path, texture):
+    levels, channels, _ = decode_texture(path)
+    return upload_texture(texture, levels, channels)
+
+
+def baked_path(path, size=None):
+    # the baked file is written next to the image, e.g. textures/sushi.png.mip
+    # or textures/sushi.png.1024.mip when scaled for a texture array
+    return path + ('.mip' if size is None else f'.{size}.mip')
+
+
+# offline step: flip, drop unused alpha and build the whole mip chain on the CPU,
+# size scales the image to size x size first
+def bake_texture(path, baked=None, size=None):
+    baked = baked or baked_path(path, size)
+    image = Image.open(path).transpose(Image.FLIP_TOP_BOTTOM)
+    if size:
+        image = image.resize((size, size), Image.LANCZOS)
+    if 'A' in image.getbands() and image.getchannel('A').getextrema()[0] < 255:
+        image = image.convert("RGBA")
+    else:
+        image = image.convert("RGB")
+    channels = len(image.getbands())
+
+    levels = [image]
+    while image.width > 1 or image.height > 1:
+        image = image.resize((max(1, image.width // 2), max(1, image.height // 2)), Image.BOX)
+        levels.append(image)
+
+    offset = BAKED_HEADER.size + BAKED_LEVEL.size * len(levels)
+    entries = []
+    for level in levels:
+        entries.append(BAKED_LEVEL.pack(level.width, level.height, offset))
+        offset += level.width * level.height * channels
+
+    # write to a temporary file first, an old baked file may still be mapped somewhere
+    temp = baked + '.tmp'
+    with open(temp, 'wb') as f:
+        f.write(BAKED_HEADER.pack(BAKED_MAGIC, levels[0].width, levels[0].height, channels, len(levels)))
+        f.write(b''.join(entries))
+        for level in levels:
+            f.write(level.tobytes())
+    os.replace(temp, baked)
+    return baked
+
+
+# memory-map a baked texture, it is baked first when missing or older than the image
+def map_baked_texture(path, size=None):
+    start = time.perf_counter()
+    baked = baked_path(path, size)
+    if not os.path.exists(baked) or os.path.getmtime(baked) < os.path.getmtime(path):
+        bake_texture(path, baked, size)
+
+    data = np.memmap(baked, dtype='uint8', mode='r')
+    magic, width, height, channels, count = BAKED_HEADER.unpack_from(data, 0)
+    if magic != BAKED_MAGIC:
+        raise ValueError(f'{baked} is not a baked texture')
+    levels = []
+    for i in range(count):
+        width, height, offset = BAKED_LEVEL.unpack_from(data, BAKED_HEADER.size + BAKED_LEVEL.size * i)
+        levels.append((width, height, data[offset:offset + width * height * channels]))
+    return levels, channels, time.perf_counter() - start
+
+
+# upload straight from the mapped file, no image decoding
+def load_texture_baked(path, texture):
+    levels, channels, _ = map_baked_texture(path)
+    return upload_texture(texture, levels, channels)
+
+
+# start decoding (or mapping the baked files of) all the images on a worker pool and return right away,
+# the GL thread can do other setup and call upload_textures later
+def decode_textures(paths, workers=4, baked=False):
+    pool = ThreadPoolExecutor(max_workers=workers)
+    decode = map_baked_texture if baked else decode_texture
+    futures = [pool.submit(decode, path) for path in paths]
+    pool.shutdown(wait=False)
+    return futures
+
+
+# upload each image as soon as its decoding is done,
+# returns (path, decode seconds, upload seconds) for every texture in input order
+def upload_textures(paths, futures, textures):
+    timings = [None] * len(futures)
+    index = {future: i for i, future in enumerate(futures)}
+    for future in as_completed(futures):
+        i = index[future]
+        levels, channels, decode_time = future.result()
+        start = time.perf_counter()
+        upload_texture(textures[i], levels, channels)
+        timings[i] = (paths[i], decode_time, time.perf_counter() - start)
+    return timings
+
+
+# decode on a worker pool and upload on the calling thread
+def load_textures(paths, textures, workers=4, baked=False):
+    return upload_textures(paths, decode_textures(paths, workers, baked), textures)
+
+
 # for use with pygame
 def load_texture_pygame(path, texture):
     import pygame
@@ -44,3 +168,15 @@ def load_texture_pygame(path, texture):
     glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, image_width,
                  image_height, 0, GL_RGBA, GL_UNSIGNED_BYTE, img_data)
     return texture
+
+
+# bake the given images ahead of time: python -m libraries.Texture_Loader textures/*.png textures/*.jp*g
+# with --size 1024 first they are baked as 1024 x 1024 texture array layers
+if __name__ == '__main__':
+    bake_size = None
+    image_paths = sys.argv[1:]
+    if image_paths[:1] == ['--size']:
+        bake_size, image_paths = int(image_paths[1]), image_paths[2:]
+    for image_path in image_paths:
+        start = time.perf_counter()
+        print(f'{bake_texture(image_path, size=bake_size)}  {(time.perf_counter() - start) * 1000:.1f} ms')
@@ -0,0 +1,16 @@
+import numpy as np
+
+
+# The matrices are pyrr arrays uploaded with GL_FALSE, so GLSL sees their transpose.
+# The old restaurant shader did: projection * view * model * (vec4(position, 1.0) * scale * rotate)
+# which is the same as one matrix: scale @ rotate.T @ model on the NumPy side.
+
+
+# compose (N, 4, 4) model, scale and rotation arrays into one matrix per object
+def compose(models, scales, rotations):
+    return np.ascontiguousarray(scales @ np.swapaxes(rotations, -1, -2) @ models, dtype='float32')
+
+
+# projection * view for the shader, recompute only when the camera or the window changes
+def view_projection(view, projection):
+    return np.ascontiguousarray(np.asarray(view, dtype='float32') @ np.asarray(projection, dtype='float32'))